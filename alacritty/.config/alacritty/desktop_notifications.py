@@ -0,0 +1,131 @@
+"""
+A client of the org.freedesktop.Notifications D-Bus service, which shows
+notifications and waits for the user to click or close them. Any number of
+notifications can wait at the same time on a single connection. Requires
+jeepney (python-jeepney).
+"""
+
+import asyncio
+import contextlib
+
+from jeepney import DBusAddress, HeaderFields, MatchRule, MessageType
+from jeepney import message_bus, new_method_call
+from jeepney.io.asyncio import Proxy, open_dbus_router
+
+NOTIFICATIONS = DBusAddress(
+    "/org/freedesktop/Notifications",
+    bus_name="org.freedesktop.Notifications",
+    interface="org.freedesktop.Notifications",
+)
+
+
+class DesktopNotifier:
+    def __init__(self, app_name, bus="SESSION"):
+        self.app_name = app_name
+        self.bus = bus
+        self._router = None
+        self._exit_stack = None
+        self._dispatcher = None
+        # Notification ID -> future of the invoked action key (None if it was
+        # closed without one)
+        self._pending = {}
+        # Results of notifications whose ID wasn't known yet, as the signals
+        # can arrive before the reply of Notify is processed. Only kept while
+        # Notify calls are in flight, as the signals of every application's
+        # notifications are received
+        self._early_results = {}
+        self._notify_calls_in_flight = 0
+
+    async def connect(self):
+        self._exit_stack = contextlib.AsyncExitStack()
+        self._router = await self._exit_stack.enter_async_context(
+            open_dbus_router(self.bus)
+        )
+        rule = MatchRule(
+            type="signal",
+            interface=NOTIFICATIONS.interface,
+            path=NOTIFICATIONS.object_path,
+        )
+        await Proxy(message_bus, self._router).AddMatch(rule)
+        signals = self._exit_stack.enter_context(
+            self._router.filter(rule, bufsize=0)
+        )
+        self._dispatcher = asyncio.create_task(self._dispatch(signals))
+
+    async def close(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+            self._exit_stack = None
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def _resolve(self, notification_id, action):
+        # The notification is also closed after an action, that's ignored as
+        # the first signal resolves it
+        future = self._pending.pop(notification_id, None)
+        if future is None:
+            if self._notify_calls_in_flight:
+                self._early_results.setdefault(notification_id, action)
+        elif not future.done():
+            future.set_result(action)
+
+    async def _dispatch(self, signals):
+        while True:
+            message = await signals.get()
+            member = message.header.fields.get(HeaderFields.member)
+            if member == "ActionInvoked":
+                notification_id, action = message.body
+                self._resolve(notification_id, action)
+            elif member == "NotificationClosed":
+                notification_id, _ = message.body
+                self._resolve(notification_id, None)
+
+    async def notify(self, title, body="", actions=None):
+        """
+        Show a notification and wait until the user acts on it. Returns the
+        key of the invoked action, or None if it was closed without one.
+        actions maps action keys to their labels, "default" being a click on
+        the notification itself
+        """
+        flat_actions = []
+        for key, label in (actions or {}).items():
+            flat_actions += [key, label]
+        message = new_method_call(
+            NOTIFICATIONS,
+            "Notify",
+            "susssasa{sv}i",
+            (self.app_name, 0, "", title, body, flat_actions, {}, -1),
+        )
+        self._notify_calls_in_flight += 1
+        try:
+            reply = await self._router.send_and_get_reply(message)
+        finally:
+            self._notify_calls_in_flight -= 1
+        early_results = self._early_results
+        if not self._notify_calls_in_flight:
+            # The rest belong to other applications
+            self._early_results = {}
+        if reply.header.message_type == MessageType.error:
+            raise RuntimeError(f"Notify failed: {reply.body}")
+        (notification_id,) = reply.body
+
+        if notification_id in early_results:
+            return early_results.pop(notification_id)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[notification_id] = future
+        try:
+            return await future
+        finally:
+            # Already gone unless the wait was cancelled
+            self._pending.pop(notification_id, None)
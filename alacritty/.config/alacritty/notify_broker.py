@@ -0,0 +1,193 @@
+#!/usr/bin/python
+# ^ Use this instead of /usr/bin/env python because I actually want to make
+# sure this always uses system python and never ends up running from a venv
+
+"""
+A long-lived broker for terminal_notify.py, started with sway. It keeps a live
+mirror of the sway windows keyed by PID, updated from sway window and
+workspace events, and
+shows the notifications terminal_notify.py hands off over a local socket. This
+saves starting a Python process that imports i3ipc and queries the whole sway
+tree for every notification. Notifications are shown over a single D-Bus
+connection, however many are waiting for the user.
+
+Every request is a single JSON line:
+{"pid": <PID of the shell in the terminal>, "title": "...",
+ "description": "...", "always_show": false}
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+from i3ipc import Event
+from i3ipc.aio import Connection
+
+from desktop_notifications import DesktopNotifier
+from terminal_notify import (
+    APP_NAME,
+    NOTIFICATION_ACTIONS,
+    TERMINAL_PROCESS_NAME,
+    broker_socket_path,
+    find_parent_pid_with_name,
+)
+
+
+def process_start_time(pid):
+    """
+    Start time of a process in clock ticks since boot, from /proc/<pid>/stat,
+    or None if it's gone
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except FileNotFoundError:
+        return None
+    # The fields after the name, which may contain spaces and parentheses,
+    # start with the state. The start time is the 22nd field
+    fields = stat[stat.rindex(b")") + 2:].split()
+    return int(fields[19])
+
+
+class NotificationBroker:
+    def __init__(self):
+        self.sway = None
+        self.notifier = DesktopNotifier(APP_NAME)
+        # PID -> sway container IDs of its windows, a single alacritty process
+        # can have several
+        self.windows = {}
+        self.focused_pid = None
+        # (PID, start time) of a shell -> PID of the terminal running it, as
+        # walking /proc is only needed once per shell. The start time tells
+        # apart processes which reused the PID
+        self.terminal_pids = {}
+        # Notifications waiting for the user, referenced until done
+        self._tasks = set()
+
+    def log(self, *args, **kwargs):
+        print(*args, **kwargs, file=sys.stderr, flush=True)
+
+    async def connect(self):
+        self.sway = await Connection(auto_reconnect=True).connect()
+        self.sway.on(Event.WINDOW_NEW, self._on_window_new)
+        self.sway.on(Event.WINDOW_CLOSE, self._on_window_close)
+        self.sway.on(Event.WINDOW_FOCUS, self._on_window_focus)
+        # Switching to an empty workspace sends no window event
+        self.sway.on(Event.WORKSPACE_FOCUS, self._on_workspace_focus)
+
+        # Fill the mirror once, events keep it up to date from now on
+        tree = await self.sway.get_tree()
+        for container in tree.descendants():
+            if container.pid:
+                self.windows.setdefault(container.pid, set()).add(container.id)
+                if container.focused:
+                    self.focused_pid = container.pid
+
+    def _on_window_new(self, sway, event):
+        if event.container.pid:
+            self.windows.setdefault(event.container.pid, set()).add(
+                event.container.id
+            )
+
+    def _on_window_close(self, sway, event):
+        pid = event.container.pid
+        container_ids = self.windows.get(pid)
+        if container_ids is not None:
+            container_ids.discard(event.container.id)
+            if not container_ids:
+                del self.windows[pid]
+                self.terminal_pids = {
+                    shell: terminal_pid
+                    for shell, terminal_pid in self.terminal_pids.items()
+                    if terminal_pid != pid
+                }
+        if self.focused_pid == pid:
+            self.focused_pid = None
+
+    def _on_window_focus(self, sway, event):
+        self.focused_pid = event.container.pid
+
+    def _on_workspace_focus(self, sway, event):
+        if event.current is None:
+            return
+        # Window focus events follow for a workspace with windows, but order
+        # doesn't matter as long as the focused window is known
+        focused = event.current.find_focused()
+        if focused is not None:
+            self.focused_pid = focused.pid
+        elif not event.current.leaves():
+            # No window is focused on an empty workspace
+            self.focused_pid = None
+
+    def _terminal_pid(self, shell_pid):
+        shell = (shell_pid, process_start_time(shell_pid))
+        terminal_pid = self.terminal_pids.get(shell)
+        if terminal_pid is None:
+            terminal_pid = find_parent_pid_with_name(
+                TERMINAL_PROCESS_NAME, shell_pid
+            )
+            if terminal_pid is None:
+                raise RuntimeError("Parent alacritty process not found")
+            self.terminal_pids[shell] = terminal_pid
+        return terminal_pid
+
+    async def notify(self, request):
+        """Show the notification of a request, if needed"""
+        terminal_pid = self._terminal_pid(request["pid"])
+
+        if not request.get("always_show", False):
+            if terminal_pid not in self.windows:
+                raise RuntimeError("Alacritty window not found")
+            if terminal_pid == self.focused_pid:
+                # Window already focused
+                return
+
+        action = await self.notifier.notify(
+            request["title"],
+            request.get("description", ""),
+            NOTIFICATION_ACTIONS,
+        )
+        # If the user clicked the notification, focus on alacritty
+        if action == "default":
+            await self.sway.command(f"[pid={terminal_pid}] focus")
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                # Each notification waits for the user independently
+                task = asyncio.create_task(self._notify_logging_errors(line))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        finally:
+            writer.close()
+
+    async def _notify_logging_errors(self, line):
+        try:
+            await self.notify(json.loads(line))
+        except Exception as e:
+            self.log(f"Error handling notification request: {e}")
+
+    async def run(self):
+        await self.connect()
+        await self.notifier.connect()
+
+        path = broker_socket_path()
+        # A leftover socket of a previous run would make the bind fail
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(self._handle_client, path)
+        try:
+            await asyncio.gather(self.sway.main(), server.serve_forever())
+        finally:
+            server.close()
+            os.remove(path)
+            await self.notifier.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(NotificationBroker().run())
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
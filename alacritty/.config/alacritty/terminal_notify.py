@@ -5,19 +5,40 @@
 """
 This script is executed by programs running on a terminal to notify they
 finished processing. If the terminal running the program is not focused it
-shows a notification using notify-send, which can be clicked to focus on the
+shows a desktop notification over D-Bus, which can be clicked to focus on the
 alacritty window.
+If notify_broker.py is running, the request is handed off to it and this
+script exits right away. Otherwise it does all the work itself.
+
+As it runs after every long command, it's kept quick to start: modules which
+are slow to import are only imported once they are needed, and the focus check
+is a single targeted Sway IPC command instead of fetching the whole tree. Run
+with --bench to see where the time goes.
 """
 
-import os
-import sys
-import subprocess
-import argparse
-from i3ipc import Connection
+import time
+
+# Imports are timed for --bench
+_START_TIME = time.perf_counter()
+
+import os  # noqa: E402
+import sys  # noqa: E402
+import json  # noqa: E402
+import socket  # noqa: E402
+import struct  # noqa: E402
+from types import SimpleNamespace  # noqa: E402
 
 # The process name of the terminal we look for
 TERMINAL_PROCESS_NAME = "alacritty"
 
+APP_NAME = "terminal_notify"
+# Clicking the notification invokes the "default" action
+NOTIFICATION_ACTIONS = {"default": "Activate"}
+
+
+def broker_socket_path():
+    return os.path.join(os.environ["XDG_RUNTIME_DIR"], "terminal-notify.sock")
+
 
 def daemonize():
     """
@@ -35,36 +56,33 @@ def daemonize():
         os.dup2(devnull.fileno(), sys.stderr.fileno())
 
 
-def find_parent_pid_with_name(process_to_find):
+def find_parent_pid_with_name(process_to_find, pid=None):
     """
-    Traverses up the process tree to find the PID of the parent process whose
-    name matches the one provided
+    Traverses up the process tree, starting from the given PID or this
+    process, to find the PID of the parent process whose name matches the one
+    provided
     """
     try:
-        pid = os.getpid()
+        if pid is None:
+            pid = os.getpid()
         # Loop until we reach the 'init' process (pid 1) or find the process
         while pid > 1:
-            # Construct the path to the process's status file
-            status_path = f"/proc/{pid}/status"
-
-            with open(status_path, "r") as f:
-                proc_name = ""
-                parent_pid = None
-                # Read the status file to find the process name and its parent's PID
-                for line in f:
-                    if line.startswith("Name:"):
-                        proc_name = line.split("\t")[1].strip()
-                    elif line.startswith("PPid:"):
-                        parent_pid = int(line.split("\t")[1].strip())
+            # The stat file has both the name and the parent's PID on a single
+            # line: "pid (name) state ppid ..."
+            with open(f"/proc/{pid}/stat", "rb") as f:
+                stat = f.read()
+            # The name itself may contain spaces and parentheses
+            name_end = stat.rindex(b")")
+            proc_name = stat[stat.index(b"(") + 1:name_end].decode()
+            parent_pid = int(stat[name_end + 2:].split(None, 2)[1])
 
             # Check if the current process in the chain is the one we look for
             if proc_name == process_to_find:
                 return pid
 
             # If not, move up to the parent process.
-            # This check is crucial to prevent an infinite loop if PPid isn't
-            # found.
-            if parent_pid is not None and parent_pid != pid:
+            # This check is crucial to prevent an infinite loop.
+            if parent_pid != pid:
                 pid = parent_pid
             else:
                 break  # Reached the top of this process branch
@@ -77,56 +95,155 @@ def find_parent_pid_with_name(process_to_find):
     return None
 
 
-def main():
+def sway_command(command):
+    """
+    Run a Sway command over its IPC socket and return the results, without
+    importing i3ipc. Uses the i3/Sway binary protocol: a magic string, the
+    payload length and the message type, followed by the payload
+    """
+    header = struct.Struct("=6sII")
+    run_command = 0
+    payload = command.encode("utf-8")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(os.environ["SWAYSOCK"])
+        sock.sendall(header.pack(b"i3-ipc", len(payload), run_command) +
+                     payload)
+        with sock.makefile("rb") as reply:
+            _, length, _ = header.unpack(reply.read(header.size))
+            return json.loads(reply.read(length))
+
+
+def is_window_focused(pid):
+    """
+    Check whether the window of the PID is focused, by matching it with
+    criteria instead of searching the whole tree. The no-op command only
+    succeeds if a window matches
+    """
+    results = sway_command(f"[pid={pid} con_id=__focused__] nop")
+    return all(result.get("success", False) for result in results)
+
+
+def parse_args(argv):
+    """
+    Parse the arguments by hand, as importing argparse alone takes a few
+    milliseconds. Anything unexpected is left to argparse, for its errors and
+    help
+    """
+    flags = {"--always-show": False, "--bench": False}
+    positional = []
+    for arg in argv:
+        if arg in flags:
+            flags[arg] = True
+        elif arg.startswith("-"):
+            return parse_args_slow(argv)
+        else:
+            positional.append(arg)
+    if len(positional) > 2 or (not positional and not flags["--bench"]):
+        return parse_args_slow(argv)
+
+    return SimpleNamespace(
+        title=positional[0] if positional else "",
+        description=positional[1] if len(positional) > 1 else "",
+        always_show=flags["--always-show"],
+        bench=flags["--bench"],
+    )
+
+
+def parse_args_slow(argv):
+    import argparse
+
     parser = argparse.ArgumentParser(description="Notify when terminal program finishes")
-    parser.add_argument("title", help="Notification title")
+    parser.add_argument("title", nargs="?", default="", help="Notification title")
     parser.add_argument("description", nargs="?", default="", help="Notification description")
     parser.add_argument("--always-show", action="store_true", help="Always show notification without checking focus")
+    parser.add_argument("--bench", action="store_true", help="Time finding the terminal and checking its focus, without notifying")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if not args.title and not args.bench:
+        parser.error("the following arguments are required: title")
+    return args
 
+
+def bench():
+    """Print how long each step of the "already focused" check takes"""
+    imports_done = time.perf_counter()
     alacritty_pid = find_parent_pid_with_name(TERMINAL_PROCESS_NAME)
-    if not alacritty_pid:
-        raise RuntimeError("Parent alacritty process not found")
+    ancestry_done = time.perf_counter()
+    focused = is_window_focused(alacritty_pid) if alacritty_pid else None
+    ipc_done = time.perf_counter()
+
+    def ms(seconds):
+        return f"{seconds * 1000:.2f} ms"
+
+    print(f"imports:  {ms(imports_done - _START_TIME)}")
+    print(f"ancestry: {ms(ancestry_done - imports_done)} "
+          f"(alacritty PID {alacritty_pid})")
+    print(f"ipc:      {ms(ipc_done - ancestry_done)} (focused: {focused})")
+    print(f"total:    {ms(ipc_done - _START_TIME)}")
+
+
+def send_to_broker(args):
+    """
+    Hand off the notification to the broker. Returns False if the broker is
+    not running.
+    """
+    request = {
+        # The shell running this script, which lives in the terminal
+        "pid": os.getppid(),
+        "title": args.title,
+        "description": args.description,
+        "always_show": args.always_show,
+    }
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(broker_socket_path())
+            sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+    except OSError:
+        return False
+    return True
+
+
+async def show_notification(title, description):
+    """Show the notification and return the action the user invoked"""
+    # Only imported when needed, as importing it is slow
+    from desktop_notifications import DesktopNotifier
 
-    sway = Connection()
+    async with DesktopNotifier(APP_NAME) as notifier:
+        return await notifier.notify(
+            title, description, NOTIFICATION_ACTIONS
+        )
 
-    if not args.always_show:
-        alacritty_windows = sway.get_tree().find_by_pid(alacritty_pid)
-        if not alacritty_windows:
-            raise RuntimeError("Alacritty window not found")
-        if len(alacritty_windows) > 1:
-            raise RuntimeError(
-                "Unexpected: Alacritty has more than one window"
-            )
 
-        alacritty_window = alacritty_windows[0]
-        if alacritty_window.focused:
-            # Window already focused
-            return
+def main():
+    args = parse_args(sys.argv[1:])
+
+    if args.bench:
+        bench()
+        return
+
+    if send_to_broker(args):
+        return
+
+    alacritty_pid = find_parent_pid_with_name(TERMINAL_PROCESS_NAME)
+    if not alacritty_pid:
+        raise RuntimeError("Parent alacritty process not found")
+
+    if not args.always_show and is_window_focused(alacritty_pid):
+        # Window already focused
+        return
 
     # For notifying the user fork to a different process. This allows waiting
-    # for the result of notify-send but also returning immediately so the
-    # program is not stuck waiting for this script
+    # for the user to act on the notification but also returning immediately
+    # so the program is not stuck waiting for this script
     daemonize()
 
-    # Show the notification using notify-send
-    result = subprocess.run(
-        [
-            "notify-send",
-            "-A",
-            "default=Activate",
-            args.title,
-            args.description,
-        ],
-        capture_output=True,
-        text=True,
-        # Raise CalledProcessError if notify-send returns non-zero exit code
-        check=True,
-    )
+    # Only imported when needed, as importing it is slow
+    import asyncio
+
+    action = asyncio.run(show_notification(args.title, args.description))
     # If the user clicked the notification, focus on alacritty
-    if result.stdout.strip() == "default":
-        sway.command(f"[pid={alacritty_pid}] focus")
+    if action == "default":
+        sway_command(f"[pid={alacritty_pid}] focus")
 
 
 if __name__ == "__main__":
@@ -1,3 +1,32 @@
 # Use a custom notification script so that if the notification is clicked the
-# underlying alacritty terminal is focused
-set __done_notification_command "~/.config/alacritty/terminal_notify.py --always-show \$title \$message"
+# underlying alacritty terminal is focused.
+# This runs after every long command, so the request goes straight to the
+# resident notify_broker.py over its socket with socat, instead of starting
+# Python each time. terminal_notify.py is only run if the broker isn't there.
+set __done_notification_command "__terminal_notify \$title \$message"
+
+# Quote a string for JSON. fish splits multi-line output into a list, which
+# is joined back with escaped newlines
+function __terminal_notify_json_string -a text
+    set -l lines (string replace --all '\\' '\\\\' -- "$text" |
+                  string replace --all '"' '\\"' |
+                  string replace --all \t '\\t' |
+                  string replace --all \r '\\r')
+    set -q lines[1]; or set lines ""
+    echo '"'(string join '\n' -- $lines)'"'
+end
+
+function __terminal_notify -a title message
+    set -l socket $XDG_RUNTIME_DIR/terminal-notify.sock
+    if test -S $socket; and command -q socat
+        # The broker expects the PID of the shell running in the terminal
+        set -l request (printf '{"pid": %d, "title": %s, ' $fish_pid \
+                            (__terminal_notify_json_string "$title"))
+        set -a request (printf '"description": %s, "always_show": true}' \
+                            (__terminal_notify_json_string "$message"))
+        # Fails if the socket was left behind by a broker which isn't running
+        string join '' -- $request | socat - UNIX-CONNECT:$socket 2>/dev/null
+        and return
+    end
+    ~/.config/alacritty/terminal_notify.py --always-show "$title" "$message"
+end
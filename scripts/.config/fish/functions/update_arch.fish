@@ -1,3 +1,5 @@
 function update_arch
-    sudo pacman -Syu && updates_recheck
+    # The monitor daemon notices the transaction on its own, both for the
+    # updates count and whether you need to reboot
+    sudo pacman -Syu
 end
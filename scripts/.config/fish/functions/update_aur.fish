@@ -1,3 +1,5 @@
 function update_aur
-    pikaur -Syua && updates_recheck
+    # The monitor daemon notices the transaction on its own, both for the
+    # updates count and whether you need to reboot
+    pikaur -Syua
 end
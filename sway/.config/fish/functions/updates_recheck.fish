@@ -1,6 +1,5 @@
 function updates_recheck
-    # Trigger both the update monitor daemon and the script that checks if you
-    # need to reboot in waybar
-    pkill -f -USR1 "python -m monitor"
-    pkill -SIGRTMIN+8 waybar
+    # Trigger both the update check and the check whether you need to reboot
+    ~/.config/sway/monitor/ctl.py recheck updates >/dev/null
+    ~/.config/sway/monitor/ctl.py recheck reboot >/dev/null
 end
@@ -7,23 +7,31 @@ the laptop screen when docked or external monitors are connected, or when the
 lid is closed, and turns it back on when they are disconnected (and the lid is
 open).
 
+The lid is tracked through its evdev switch device (which needs read access to
+/dev/input, e.g. being in the 'input' group). If that's not possible, the ACPI
+lid state is read instead, with a Sway bindswitch sending SIGUSR2 on lid
+events.
+
 It can be controlled via signals:
 - SIGUSR1: Toggles the script's enabled state. When disabled, the laptop
            monitor is forced on and no further state changes occur until
            re-enabled. When re-enabled, it immediately re-evaluates the
            correct state.
-- SIGUSR2: Triggers an immediate re-evaluation of the display state. This is
-           intended to be used with a Sway bindswitch for lid events.
+- SIGUSR2: Triggers an immediate re-evaluation of the display state.
 """
 
 import sys
-import subprocess
 import json
 import logging
 import signal
 import os
 import atexit
 import glob
+import socket
+import struct
+import fcntl
+import selectors
+import time
 
 logging.basicConfig(
     format='%(asctime)s %(levelname)s %(message)s',
@@ -32,9 +40,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Global variable to hold the manager instance
-# This is needed so the signal handlers can access it
-manager_instance = None
+# Global connection to Sway, shared by everything that sends it commands
+sway_ipc = None
 
 # Define the PID file path
 XDG_RUNTIME_DIR = os.environ.get('XDG_RUNTIME_DIR')
@@ -64,76 +71,293 @@ def reset_sway_bindswitch():
         # Only log the error as this is an atexit handler
         logger.error(f"Failed to reset Sway bindswitch: {e}")
 
-def run_swaymsg(command: list[str]):
-    """Helper function to run swaymsg commands."""
-    cmd = ['swaymsg'] + command
-    try:
-        result = subprocess.run(
-            cmd, check=True, capture_output=True, text=True
-        )
-        return result
-    except FileNotFoundError:
-        raise FileNotFoundError(
-            "'swaymsg' command not found. Is Sway installed and in your " +
-            "PATH?"
-        )
-    except subprocess.CalledProcessError as e:
-        error_msg = f"Error running swaymsg command: {' '.join(cmd)}\n"
-        error_msg += f"Return code: {e.returncode}\n"
-        if e.stdout:
-            error_msg += f"Stdout: {e.stdout.strip()}\n"
-        if e.stderr:
-            error_msg += f"Stderr: {e.stderr.strip()}"
-        raise RuntimeError(error_msg)
-    except Exception as e:
-        raise RuntimeError(
-            "An unexpected error occurred while running swaymsg: " +
-            f"{e}"
+class SwayIpc:
+    """
+    Minimal client for the i3/Sway IPC protocol, talking directly to $SWAYSOCK.
+    Keeps one connection for commands and queries, and a separate one for
+    event subscriptions so events are never mixed with replies.
+    """
+    MAGIC = b'i3-ipc'
+    # Magic, payload length and message type, in native byte order
+    HEADER = struct.Struct(f'={len(MAGIC)}sII')
+
+    RUN_COMMAND = 0
+    SUBSCRIBE = 2
+    GET_OUTPUTS = 3
+    GET_VERSION = 7
+    # Events have the highest bit of the message type set
+    EVENT_OUTPUT = 0x80000001
+
+    def __init__(self, socket_path=None):
+        self.socket_path = socket_path or os.environ.get('SWAYSOCK')
+        if not self.socket_path:
+            raise RuntimeError(
+                "$SWAYSOCK is not set. Is this running inside Sway?"
+            )
+        self._command_socket = self._connect()
+        self._event_socket = None
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise RuntimeError(
+                f"Could not connect to Sway at {self.socket_path}: {e}"
+            ) from e
+        return sock
+
+    @staticmethod
+    def _recv_exactly(sock, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Sway closed the IPC connection")
+            data += chunk
+        return bytes(data)
+
+    def _send(self, sock, message_type, payload=''):
+        data = payload.encode('utf-8')
+        sock.sendall(self.HEADER.pack(self.MAGIC, len(data), message_type) +
+                     data)
+
+    def _receive(self, sock):
+        """Receives a message, returning its type and parsed payload."""
+        magic, length, message_type = self.HEADER.unpack(
+            self._recv_exactly(sock, self.HEADER.size)
         )
+        if magic != self.MAGIC:
+            raise RuntimeError(f"Invalid Sway IPC magic: {magic!r}")
+        payload = self._recv_exactly(sock, length)
+        return message_type, json.loads(payload)
+
+    def request(self, message_type, payload=''):
+        """Sends a message on the command connection and returns the reply."""
+        self._send(self._command_socket, message_type, payload)
+        reply_type, reply = self._receive(self._command_socket)
+        if reply_type != message_type:
+            raise RuntimeError(
+                f"Unexpected Sway IPC reply type {reply_type} to " +
+                f"{message_type}"
+            )
+        return reply
+
+    def command(self, command):
+        """Runs a Sway command, raising RuntimeError if any part fails."""
+        results = self.request(self.RUN_COMMAND, command)
+        errors = [r.get('error', 'unknown error') for r in results
+                  if not r.get('success', False)]
+        if errors:
+            raise RuntimeError(
+                f"Error running Sway command '{command}': " +
+                '; '.join(errors)
+            )
+        return results
 
-class LaptopDisplayManager:
+    def get_outputs(self):
+        return self.request(self.GET_OUTPUTS)
+
+    def get_version(self):
+        return self.request(self.GET_VERSION)
+
+    @property
+    def event_socket(self):
+        """The subscription connection, to wait on with select."""
+        return self._event_socket
+
+    def subscribe(self, events: list[str]):
+        """Subscribes to the given event types on the event connection."""
+        if self._event_socket is None:
+            self._event_socket = self._connect()
+        self._send(self._event_socket, self.SUBSCRIBE, json.dumps(events))
+        _, reply = self._receive(self._event_socket)
+        if not reply.get('success', False):
+            raise RuntimeError(f"Failed to subscribe to Sway events {events}")
+
+    def read_event(self):
+        """
+        Blocks until the next subscribed event, returning its type and
+        payload.
+        """
+        return self._receive(self._event_socket)
+
+    def close(self):
+        for sock in (self._command_socket, self._event_socket):
+            if sock is not None:
+                sock.close()
+        self._command_socket = self._event_socket = None
+
+def get_sway_ipc():
+    """Returns the shared Sway connection, connecting on first use."""
+    global sway_ipc
+    if sway_ipc is None:
+        sway_ipc = SwayIpc()
+    return sway_ipc
+
+def run_swaymsg(command: list[str]):
+    """Helper function to run Sway commands over the shared connection."""
+    return get_sway_ipc().command(' '.join(command))
+
+# From linux/input-event-codes.h
+EV_SYN = 0x00
+EV_SW = 0x05
+SYN_DROPPED = 0x03
+SW_LID = 0x00
+# struct input_event: struct timeval time, __u16 type, __u16 code, __s32 value
+INPUT_EVENT = struct.Struct('llHHi')
+
+def EVIOCGSW(length):
+    """The ioctl request reading the state of all switches of a device."""
+    return (2 << 30) | (length << 16) | (ord('E') << 8) | 0x1b
+
+class LidSwitch:
     """
-    Manages the state of the laptop display based on the presence of other
-    active monitors in Sway and the laptop lid state. Can be enabled/disabled
-    via signals.
+    Tracks the laptop lid state. Uses the evdev switch device of the lid, whose
+    events can be waited on together with Sway's. Falls back to reading the
+    ACPI lid state file if the device can't be opened, in which case something
+    else has to trigger re-evaluations.
+    The device or state file is looked up once, when created.
     """
-    def __init__(self, laptop_monitor_name):
-        self.laptop_monitor_name = laptop_monitor_name
-        self.is_enabled = True
+    def __init__(self, sys_input_dir='/sys/class/input',
+                 dev_input_dir='/dev/input',
+                 acpi_glob='/proc/acpi/button/lid/*/state'):
+        self.device_fd = None
+        self.acpi_state_file = None
+        self._is_open = None
+
+        device = self._find_device(sys_input_dir)
+        if device:
+            try:
+                self.device_fd = os.open(
+                    os.path.join(dev_input_dir, device),
+                    os.O_RDONLY | os.O_NONBLOCK | os.O_CLOEXEC
+                )
+                self._is_open = self._read_device_state()
+                logger.info(f"Tracking lid state with evdev device {device}.")
+            except OSError as e:
+                logger.warning(f"Could not use lid device {device}: {e}")
+                self.close()
+
+        if self.device_fd is None:
+            lid_state_files = glob.glob(acpi_glob)
+            if not lid_state_files:
+                raise RuntimeError(
+                    f"Could not find a lid switch device or {acpi_glob}. " +
+                    "Cannot determine lid state."
+                )
+            # Assuming the first file found is the correct one
+            self.acpi_state_file = lid_state_files[0]
+            logger.info(
+                f"Reading lid state from {self.acpi_state_file}."
+            )
 
     @staticmethod
-    def _is_lid_open():
+    def _find_device(sys_input_dir):
+        """Returns the name of the first event device with a lid switch."""
+        for path in sorted(glob.glob(os.path.join(sys_input_dir, 'event*'))):
+            try:
+                with open(os.path.join(path, 'device/capabilities/sw')) as f:
+                    # Hex words, the one with the lowest bits is last
+                    words = f.read().split()
+            except OSError:
+                continue
+            if words and int(words[-1], 16) & (1 << SW_LID):
+                return os.path.basename(path)
+        return None
+
+    @property
+    def has_events(self):
+        """Whether lid changes are reported through fileno()."""
+        return self.device_fd is not None
+
+    def fileno(self):
+        return self.device_fd
+
+    def close(self):
+        if self.device_fd is not None:
+            os.close(self.device_fd)
+            self.device_fd = None
+
+    def _read_device_state(self):
+        state = bytearray(8)
+        fcntl.ioctl(self.device_fd, EVIOCGSW(len(state)), state)
+        return not state[0] & (1 << SW_LID)
+
+    def read_events(self):
+        """
+        Reads the pending events of the device. Returns True if the lid state
+        changed.
+        """
+        was_open = self._is_open
+        while True:
+            try:
+                data = os.read(self.device_fd, INPUT_EVENT.size * 64)
+            except BlockingIOError:
+                break
+            for offset in range(0, len(data), INPUT_EVENT.size):
+                _, _, event_type, code, value = INPUT_EVENT.unpack_from(
+                    data, offset
+                )
+                if event_type == EV_SW and code == SW_LID:
+                    self._is_open = value == 0
+                elif event_type == EV_SYN and code == SYN_DROPPED:
+                    # The kernel's buffer overflowed, so ask for the state
+                    self._is_open = self._read_device_state()
+        return self._is_open != was_open
+
+    def is_open(self):
         """
-        Checks the laptop lid state by reading /proc/acpi/button/lid/*/state.
-        Returns True if open, False if closed.
+        Returns True if the lid is open, False if closed.
         Raises RuntimeError if the state cannot be determined.
         """
-        lid_state_files = glob.glob('/proc/acpi/button/lid/*/state')
-        if not lid_state_files:
-            raise RuntimeError(
-                "Could not find /proc/acpi/button/lid/*/state. " +
-                "Cannot determine lid state."
-            )
-
-        # Assuming the first file found is the correct one
-        lid_state_file = lid_state_files[0]
+        if self.device_fd is not None:
+            return self._is_open
 
         try:
-            with open(lid_state_file, 'r') as f:
+            with open(self.acpi_state_file, 'r') as f:
                 content = f.read().strip()
-                if 'state:      open' in content:
-                    return True
-                elif 'state:      closed' in content:
-                    return False
-                else:
-                    raise RuntimeError(
-                        f"Unexpected content in {lid_state_file}: {content}"
-                    )
         except IOError as e:
             raise RuntimeError(
-                f"Error reading lid state file {lid_state_file}: {e}"
+                f"Error reading lid state file {self.acpi_state_file}: {e}"
             ) from e
+        # E.g. "state:      open"
+        state = content.split()[-1] if content else ''
+        if state == 'open':
+            return True
+        elif state == 'closed':
+            return False
+        raise RuntimeError(
+            f"Unexpected content in {self.acpi_state_file}: {content}"
+        )
+
+class LaptopDisplayManager:
+    """
+    Manages the state of the laptop display based on the presence of other
+    active monitors in Sway and the laptop lid state. Can be enabled/disabled
+    via signals.
+    """
+    def __init__(self, laptop_monitor_name, settle_time=0.25,
+                 max_settle_time=1.0):
+        self.laptop_monitor_name = laptop_monitor_name
+        self.is_enabled = True
+        self.lid = LidSwitch()
+
+        # Events are collapsed into one evaluation once they stop arriving for
+        # settle_time, or at most max_settle_time after the first one (seconds)
+        self.settle_time = settle_time
+        self.max_settle_time = max_settle_time
+        self._update_due = None
+        self._first_request_time = None
 
+        # Output name -> whether it's active, as of the last evaluation
+        self.outputs = {}
+
+        # Counters, to see how much work the events cause
+        self.evaluations = 0
+        self.commands_sent = 0
+        self.events_coalesced = 0
 
     def toggle_enabled_state(self):
         """Toggles the enabled state of the manager."""
@@ -146,116 +370,149 @@ class LaptopDisplayManager:
                 "Manager disabled. Ensuring " +
                 f"{self.laptop_monitor_name} is enabled."
             )
-            run_swaymsg(['output', self.laptop_monitor_name, 'enable'])
         else:
             logger.info(
                 "Manager enabled. Re-evaluating display state."
             )
-            self.update_monitor_state()
+        self.update_monitor_state()
 
-    def update_monitor_state(self):
+    def request_update(self):
         """
-        Determines desired laptop monitor state based on other active outputs
-        and the lid state, and executes the swaymsg command to set the state,
-        but only if enabled.
-        Raises RuntimeError on failure.
+        Schedules an evaluation of the display state, coalescing it with the
+        other events of a burst (e.g. docking).
         """
-        logger.info("Checking current display state...")
+        now = time.monotonic()
+        if self._update_due is None:
+            self._first_request_time = now
+        else:
+            self.events_coalesced += 1
+        self._update_due = min(
+            now + self.settle_time,
+            self._first_request_time + self.max_settle_time
+        )
 
+    def _time_until_update(self):
+        """Seconds until the scheduled evaluation, None if there's none."""
+        if self._update_due is None:
+            return None
+        return max(self._update_due - time.monotonic(), 0)
+
+    def _run_due_update(self):
+        if self._update_due is not None and \
+                time.monotonic() >= self._update_due:
+            self._update_due = None
+            self.update_monitor_state()
+
+    def _desired_laptop_state(self):
+        """
+        Returns whether the laptop monitor should be enabled, and the reason.
+        """
         # Always turn off display if lid is closed
-        lid_is_open = self._is_lid_open()
-        if not lid_is_open:
-            logger.info("Lid is closed. Ensuring laptop monitor is disabled.")
-            run_swaymsg(['output', self.laptop_monitor_name, 'disable'])
-            return
+        if not self.lid.is_open():
+            return False, "Lid is closed"
 
         # Otherwise if lid is open and the manager is not enabled then always
         # turn on the display
         if not self.is_enabled:
-            logger.info(
-                "Manager is disabled. Ensuring laptop monitor is enabled."
-            )
-            run_swaymsg(['output', self.laptop_monitor_name, 'enable'])
-            return
+            return True, "Manager is disabled"
 
         # Only if lid is open and manager is enabled then go with its logic
-        result = run_swaymsg(['-t', 'get_outputs'])
-
-        try:
-            outputs = json.loads(result.stdout)
-        except json.JSONDecodeError:
-            error_msg = "Failed to parse JSON output from swaymsg."
-            logger.error(error_msg)
-            logger.error(f"Received output:\n{result.stdout[:500]}...")
-            raise RuntimeError(error_msg)
-
-        # Count active monitors *excluding* our laptop monitor
-        other_active_monitors_count = 0
-        for output in outputs:
-            if (output.get('active', False) and
-                    output.get('name') != self.laptop_monitor_name):
-                other_active_monitors_count += 1
-
+        other_active_monitors_count = sum(
+            1 for name, active in self.outputs.items()
+            if active and name != self.laptop_monitor_name
+        )
         logger.info(
             f"Found {other_active_monitors_count} other active monitor(s)."
         )
-
-        # Find the laptop output specifically for state check
-        laptop_output = next(
-            (o for o in outputs if o.get('name') == self.laptop_monitor_name),
-            None
+        if other_active_monitors_count == 0:
+            return True, "Condition: No other active monitors detected"
+        return False, (
+            f"Condition: {other_active_monitors_count} other monitor(s) " +
+            "active"
         )
 
-        if not laptop_output:
+    def update_monitor_state(self):
+        """
+        Reconciles the laptop monitor with its desired state, based on other
+        active outputs, the lid state and whether the manager is enabled.
+        Sends a Sway command only if the laptop monitor is not in the desired
+        state already.
+        Raises RuntimeError on failure.
+        """
+        logger.info("Checking current display state...")
+        self.evaluations += 1
+
+        # Output events carry no details, so refresh the model of the outputs
+        self.outputs = {
+            output.get('name'): output.get('active', False)
+            for output in get_sway_ipc().get_outputs()
+        }
+        if self.laptop_monitor_name not in self.outputs:
             error_msg = (
                 f"Laptop monitor {self.laptop_monitor_name} not found in " +
-                "swaymsg outputs."
+                "Sway outputs."
             )
             logger.error(error_msg)
             raise RuntimeError(error_msg)
 
-        if other_active_monitors_count == 0:
+        desired, reason = self._desired_laptop_state()
+        is_active = self.outputs[self.laptop_monitor_name]
+        desired_str = "enabled" if desired else "disabled"
+        logger.info(
+            f"{reason}. Ensuring {self.laptop_monitor_name} is {desired_str}."
+        )
+
+        if is_active == desired:
             logger.info(
-                "Condition: No other active monitors detected. " +
-                f"Ensuring {self.laptop_monitor_name} is enabled."
+                f"Laptop monitor {self.laptop_monitor_name} is already " +
+                f"{desired_str}."
             )
-            if not laptop_output.get('active', False):
-                logger.info(
-                    f"Laptop monitor {self.laptop_monitor_name} is currently " +
-                    "disabled. Enabling..."
-                )
-                run_swaymsg(['output', self.laptop_monitor_name, 'enable'])
-            else:
-                 logger.info(
-                     f"Laptop monitor {self.laptop_monitor_name} is already " +
-                     "enabled."
-                 )
-
         else:
+            action = 'enable' if desired else 'disable'
+            current_str = "disabled" if desired else "enabled"
+            action_str = "Enabling" if desired else "Disabling"
             logger.info(
-                f"Condition: {other_active_monitors_count} other monitor(s) " +
-                f"active. Ensuring {self.laptop_monitor_name} is disabled."
+                f"Laptop monitor {self.laptop_monitor_name} is currently " +
+                f"{current_str}. {action_str}..."
             )
-            if laptop_output.get('active', False):
-                logger.info(
-                    f"Laptop monitor {self.laptop_monitor_name} is currently " +
-                    "enabled. Disabling..."
-                )
-                run_swaymsg(['output', self.laptop_monitor_name, 'disable'])
-            else:
-                 logger.info(
-                     f"Laptop monitor {self.laptop_monitor_name} is already " +
-                     "disabled."
-                 )
+            run_swaymsg(['output', self.laptop_monitor_name, action])
+            self.outputs[self.laptop_monitor_name] = desired
+            self.commands_sent += 1
+
+        logger.info(
+            f"Evaluations: {self.evaluations}, commands sent: " +
+            f"{self.commands_sent}, events coalesced: {self.events_coalesced}"
+        )
 
     def run_loop(self):
         """
         Starts the event monitoring loop, reacting to Sway 'output' events.
         This loop will exit if an exception occurs during event processing.
         """
-        # Check if swaymsg is available before proceeding by trying to run a
-        # simple command. run_swaymsg will raise if it fails.
-        run_swaymsg(['-v'])
+        # Check Sway is reachable before proceeding. This will raise if it
+        # fails.
+        ipc = get_sway_ipc()
+        version = ipc.get_version()
+        logger.info(f"Connected to Sway {version.get('human_readable')}")
+
+        # Subscribe before the initial check so no event in between is lost
+        ipc.subscribe(['output'])
+
+        # Sway events, lid events and signals are all handled here one at a
+        # time, so a state update is never interrupted by another
+        selector = selectors.DefaultSelector()
+        selector.register(ipc.event_socket, selectors.EVENT_READ,
+                          self._on_sway_event)
+        if self.lid.has_events:
+            selector.register(self.lid, selectors.EVENT_READ,
+                              self._on_lid_event)
+        # The signal handlers do nothing, Python writes the signal numbers here
+        signal_reader, signal_writer = socket.socketpair()
+        signal_reader.setblocking(False)
+        signal_writer.setblocking(False)
+        signal.set_wakeup_fd(signal_writer.fileno())
+        selector.register(signal_reader, selectors.EVENT_READ,
+                          lambda: self._on_signals(signal_reader))
 
         logger.info(
             "Starting laptop display manager loop for Sway " +
@@ -265,52 +522,48 @@ class LaptopDisplayManager:
         # Initial check when the script starts.
         self.update_monitor_state()
 
-        # Event monitoring loop
+        # Event monitoring loop. The subscription stays open, so events which
+        # arrive while the state is being updated are queued, not lost.
         while True:
-            logger.info("Waiting for next Sway 'output' event...")
-            # Run the subscribe command. This will block until an event happens
-            # and exit after each event.
-            run_swaymsg(['-t', 'subscribe', '["output"]'])
-
+            if self._update_due is None:
+                logger.info("Waiting for next event...")
+            for key, _ in selector.select(self._time_until_update()):
+                key.data()
+            self._run_due_update()
+
+    def _on_sway_event(self):
+        event_type, _ = get_sway_ipc().read_event()
+        if event_type == SwayIpc.EVENT_OUTPUT:
             logger.info("Sway 'output' event detected.")
-            self.update_monitor_state()
-            # The loop repeats, starting the next swaymsg subscribe command.
-
-# Signal handler function for SIGUSR1
-def handle_sigusr1(signum, frame):
-    """Signal handler for SIGUSR1."""
-    global manager_instance
-    if manager_instance:
-        logger.info("Received SIGUSR1 signal.")
-        try:
-            manager_instance.toggle_enabled_state()
-        except Exception as e:
-            logger.error(f"Error in SIGUSR1 handler: {e}")
-            sys.exit(1)
-    else:
-        logger.warning(
-            "Received SIGUSR1 but manager_instance is not set."
-        )
+            self.request_update()
 
-# Signal handler function for SIGUSR2
-def handle_sigusr2(signum, frame):
-    """Signal handler for SIGUSR2."""
-    global manager_instance
-    if manager_instance:
-        logger.info("Received SIGUSR2 signal (Lid toggle event).")
+    def _on_lid_event(self):
+        if self.lid.read_events():
+            state_str = "opened" if self.lid.is_open() else "closed"
+            logger.info(f"Lid {state_str}.")
+            self.request_update()
+
+    def _on_signals(self, signal_reader):
         try:
-            manager_instance.update_monitor_state()
-        except Exception as e:
-            logger.error(f"Error in SIGUSR2 handler: {e}")
-            sys.exit(1)
-    else:
-        logger.warning(
-            "Received SIGUSR2 but manager_instance is not set."
-        )
+            signals = signal_reader.recv(64)
+        except BlockingIOError:
+            return
+        for signum in signals:
+            if signum == signal.SIGUSR1:
+                logger.info("Received SIGUSR1 signal.")
+                self.toggle_enabled_state()
+            elif signum == signal.SIGUSR2:
+                logger.info("Received SIGUSR2 signal (Lid toggle event).")
+                self.request_update()
+
+def handle_signal(signum, frame):
+    """
+    Signal handler for SIGUSR1 and SIGUSR2. The signals are handled by the
+    manager's event loop, which is woken up through the signal wakeup fd.
+    """
+    pass
 
 def main(laptop_monitor_name):
-    global manager_instance
-
     # Check if PID file already exists
     if os.path.exists(PID_FILE):
         raise RecursionError(
@@ -332,29 +585,30 @@ def main(laptop_monitor_name):
     # Register cleanup function to remove PID file on exit
     atexit.register(remove_pid_file)
 
-    # Register cleanup function to reset the bindswitch on exit
-    atexit.register(reset_sway_bindswitch)
-
-    # Create the manager instance and store it globally
-    manager_instance = LaptopDisplayManager(laptop_monitor_name)
+    manager = LaptopDisplayManager(laptop_monitor_name)
 
     # Register signal handlers
-    signal.signal(signal.SIGUSR1, handle_sigusr1)
+    signal.signal(signal.SIGUSR1, handle_signal)
     logger.info("SIGUSR1 handler registered.")
-    signal.signal(signal.SIGUSR2, handle_sigusr2)
+    signal.signal(signal.SIGUSR2, handle_signal)
     logger.info("SIGUSR2 handler registered.")
 
-    # Set up Sway bindswitch for lid events
-    try:
-        run_swaymsg([f"bindswitch --locked lid:toggle exec kill -USR2 {pid}"])
-        logger.info("Sway bindswitch successfully set.")
-    except Exception as e:
-        error_msg = f"Failed to set Sway bindswitch: {e}"
-        logger.error(error_msg)
-        raise RuntimeError(error_msg) from e
+    # Without the lid device, set up Sway bindswitch for lid events
+    if not manager.lid.has_events:
+        # Register cleanup function to reset the bindswitch on exit
+        atexit.register(reset_sway_bindswitch)
+        try:
+            run_swaymsg(
+                [f"bindswitch --locked lid:toggle exec kill -USR2 {pid}"]
+            )
+            logger.info("Sway bindswitch successfully set.")
+        except Exception as e:
+            error_msg = f"Failed to set Sway bindswitch: {e}"
+            logger.error(error_msg)
+            raise RuntimeError(error_msg) from e
 
     # Start the main loop. This will run until an exception occurs.
-    manager_instance.run_loop()
+    manager.run_loop()
 
 if __name__ == "__main__":
     # Check if the laptop monitor name is provided as an argument
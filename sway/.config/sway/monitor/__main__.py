@@ -2,21 +2,84 @@
 A Python daemon that continuously monitors:
 - Internet connection
 - Arch and AUR package updates
-Writes the output to $XDG_RUNTIME_DIR for waybar consumption.
+- Whether a reboot is needed for a new kernel or microcode
+Pushes the output to clients of a socket in $XDG_RUNTIME_DIR for waybar
+consumption (see client.py), and optionally writes it to files there as well.
+Can be controlled through a second socket (see ctl.py).
+Exports metrics of every check to a Prometheus text file in $XDG_RUNTIME_DIR
+whenever they change (see metrics.py), also available with `ctl.py metrics`.
+Can be profiled while running, through the control socket (see profiling.py).
+Checks less often on battery, and pauses and catches up around suspend (see
+power.py).
+Each monitor is supervised and restarted on failure (see supervisor.py).
 """
 
 
+import argparse
 import asyncio
 
-from .arch_updates import UpdatesMonitor
-from .internet import InternetMonitor
+# Importing the monitors registers them with the supervisor
+from . import arch_updates, internet, reboot  # noqa: F401
+from .control import ControlServer
+from .metrics import MetricsExporter
+from .power import PowerContext
+from .profiling import Profiler
+from .status_server import StatusServer
+from .supervisor import Supervisor
 
 
-async def main():
-    internet = InternetMonitor()
-    updates = UpdatesMonitor(internet)
-    await asyncio.gather(internet.run(), updates.run())
+async def main(write_files: bool):
+    server = StatusServer()
+    supervisor = Supervisor()
+    monitors = supervisor.monitors
+
+    power = PowerContext()
+    control = ControlServer()
+    for name, monitor in monitors.items():
+        monitor.status_server = server
+        monitor.write_file = write_files
+        monitor.attach_power(power)
+        for action, handler in monitor.commands().items():
+            control.add_command(f"{action} {name}", handler)
+    control.add_command(
+        "status",
+        lambda: {name: monitor.status for name, monitor in monitors.items()},
+    )
+    control.add_command(
+        "stats",
+        lambda: {name: monitor.stats() for name, monitor in monitors.items()},
+    )
+    control.add_command("health", supervisor.health)
+    control.add_command("power", power.status)
+
+    exporter = MetricsExporter(
+        [supervisor.metrics]
+        + [monitor.metrics for monitor in monitors.values()]
+    )
+    for name, handler in exporter.commands().items():
+        control.add_command(name, handler)
+    for name, handler in Profiler().commands().items():
+        control.add_command(name, handler)
+
+    await server.start()
+    await control.start()
+    await power.start()
+    exporter.start()
+    try:
+        await supervisor.run()
+    finally:
+        exporter.close()
+        await power.close()
+        await control.close()
+        await server.close()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Monitor daemon for waybar")
+    parser.add_argument(
+        "--write-files",
+        action="store_true",
+        help="Also write the status to JSON files in $XDG_RUNTIME_DIR",
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.write_files))
@@ -1,131 +1,296 @@
 """
 # A Python daemon that continuously monitors Arch and AUR package updates. It
-# runs in the background checking for updates hourly or instantly via `pkill
-# -USR1` and writes JSON status to `$XDG_RUNTIME_DIR` for waybar consumption.
+# runs in the background checking for updates hourly (less often on battery,
+# and right after resuming if a check was missed while suspended) or instantly
+# via the control socket (or `pkill -USR1`), recounts them whenever a pacman
+# transaction finishes, and writes JSON status to `$XDG_RUNTIME_DIR` for waybar
+# consumption.
+# Updates are calculated in-process from the pacman databases and the AUR RPC
+# interface (see pacman.py and aur.py).
 """
 
 
 import asyncio
+import os
 import signal
 from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
 
+import aiohttp
+
+from .aur import AurUpdateChecker
 from .base_monitor import BaseMonitor
 from .internet import InternetMonitor
+from .pacman import (
+    ArchUpdateChecker,
+    PackageUpdate,
+    PacmanConfig,
+    PacmanDbWatcher,
+)
+from .power import PowerEvent, PowerProfile, boottime
+from .supervisor import register
+
+
+def format_size(size: float) -> str:
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024 or unit == "GiB":
+            break
+        size /= 1024
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
 
 
+@register("updates", depends_on=["internet"])
 class UpdatesMonitor(BaseMonitor):
     def __init__(self, internet_monitor: InternetMonitor):
-        super().__init__("arch_updates_monitor.json")
+        super().__init__("updates", "arch_updates_monitor.json")
         self.signal_event = asyncio.Event()
         self.internet_monitor = internet_monitor
 
-    async def _get_arch_updates(self):
-        """Get number of Arch updates"""
-        proc = await asyncio.create_subprocess_exec(
-            "checkupdates",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
+        self.cache_dir = Path(
+            os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+        ) / "sway-monitor"
+        self.arch_checker: Optional[ArchUpdateChecker] = None
+        self.aur_checker = AurUpdateChecker()
+        self.db_watcher: Optional[PacmanDbWatcher] = None
+        self._http_session: Optional[aiohttp.ClientSession] = None
+        self._full_check_requested = False
+        self._check_requested = False
+        self._last_checked: Optional[datetime] = None
+        # Time between full checks on AC and on battery (seconds)
+        self.check_intervals = {
+            PowerProfile.AC: 3600,
+            PowerProfile.BATTERY: 4 * 3600,
+        }
+        # Boot time of the last full check, which unlike the event loop's
+        # clock includes the time spent suspended
+        self._last_check_boottime: Optional[float] = None
+        self.arch_updates: list[PackageUpdate] = []
+        self.aur_updates: list[PackageUpdate] = []
+
+    async def _get_arch_updates(self) -> list[PackageUpdate]:
+        """Get the pending Arch updates"""
         try:
-            stdout, stderr = await asyncio.wait_for(
-                proc.communicate(), timeout=90
+            return await asyncio.wait_for(
+                self.arch_checker.check(self._http_session), timeout=90
             )
-            lines = stdout.decode().strip().split("\n")
-            return len([line for line in lines if line.strip()])
         except asyncio.TimeoutError:
-            proc.kill()
-            await proc.wait()
             raise RuntimeError("Arch updates check timed out")
 
-    async def _get_aur_updates(self):
-        """Get number of AUR updates"""
-        proc = await asyncio.create_subprocess_exec(
-            "pikaur",
-            "-Qua",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
+    async def _get_aur_updates(self) -> list[PackageUpdate]:
+        """Get the pending AUR updates"""
+        # Needs the sync databases, so must run after _get_arch_updates
+        foreign_packages = await self.run_in_thread(
+            "foreign_packages", self.arch_checker.foreign_packages
         )
         try:
-            stdout, stderr = await asyncio.wait_for(
-                proc.communicate(), timeout=90
+            return await asyncio.wait_for(
+                self.aur_checker.check(self._http_session, foreign_packages),
+                timeout=90,
             )
-            if proc.returncode != 0:
-                raise Exception(f"pikaur exited with code {proc.returncode}")
-            lines = stdout.decode().strip().split("\n")
-            return len([line for line in lines if line.strip()])
         except asyncio.TimeoutError:
-            proc.kill()
-            await proc.wait()
             raise RuntimeError("AUR check timed out")
 
-    async def _check_updates(self):
-        """Check for updates and write result"""
-        self.log("Checking for updates...")
-        self.write_json("", "Checking updates...", "checking")
+    def request_check(self, full: bool = True):
+        """
+        Check for updates now. If not full, only recount them against the data
+        of the last check (e.g. after packages were installed).
+        """
+        self._full_check_requested |= full
+        self._check_requested = True
+        self.signal_event.set()
 
-        try:
-            arch_updates, aur_updates = await asyncio.gather(
-                self._get_arch_updates(), self._get_aur_updates()
+    def on_power_event(self, event: PowerEvent):
+        # Re-evaluate when the next check is due, a check may have been missed
+        # while suspended
+        if event in (PowerEvent.POWER_CHANGED, PowerEvent.RESUMED):
+            self.signal_event.set()
+
+    def _on_db_change(self, sync_changed: bool):
+        """Called by the database watcher after a pacman transaction"""
+        if sync_changed:
+            self.log("Sync databases changed, checking updates")
+        else:
+            self.log("Installed packages changed, recounting updates")
+        self.request_check(full=sync_changed)
+
+    def _recheck_command(self, mode: str = "full") -> dict:
+        """`recheck updates [full|quick]`, arguments arrive as strings"""
+        if mode not in ("full", "quick"):
+            raise ValueError(
+                f"Unknown recheck mode {mode!r}, expected full or quick"
             )
+        self.request_check(full=mode == "full")
+        return {"mode": mode}
 
-            self.log(
-                f"Found {arch_updates} Arch updates, {aur_updates} AUR updates"
+    def commands(self) -> dict[str, Callable]:
+        return {"recheck": self._recheck_command}
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["last_checked"] = self._last_checked
+        for name, updates in [
+            ("arch_updates", self.arch_updates),
+            ("aur_updates", self.aur_updates),
+        ]:
+            stats[name] = [
+                f"{update.name} {update.old_version} -> {update.new_version}"
+                for update in updates
+            ]
+        return stats
+
+    def _write_updates(
+        self,
+        arch_updates: list[PackageUpdate],
+        aur_updates: list[PackageUpdate],
+    ):
+        self.arch_updates = arch_updates
+        self.aur_updates = aur_updates
+        self.log(
+            f"Found {len(arch_updates)} Arch updates, "
+            f"{len(aur_updates)} AUR updates"
+        )
+
+        if not arch_updates and not aur_updates:
+            last_checked = self._last_checked.strftime("%H:%M")
+            self.write_json(
+                "",
+                f"No updates found\nLast checked: {last_checked}",
+                "none",
             )
+            return
 
-            if arch_updates == 0 and aur_updates == 0:
-                current_time = datetime.now().strftime("%H:%M")
-                self.write_json(
-                    "",
-                    f"No updates found\nLast checked: {current_time}",
-                    "none",
-                )
-            else:
-                tooltips = []
-                classes = []
+        tooltips = []
+        classes = []
 
-                if arch_updates > 0:
-                    tooltips.append(f"Arch updates: {arch_updates}")
-                    classes.append("arch")
+        if arch_updates:
+            download_size = sum(
+                update.download_size for update in arch_updates
+            )
+            tooltips.append(
+                f"Arch updates: {len(arch_updates)} "
+                f"({format_size(download_size)})"
+            )
+            classes.append("arch")
 
-                if aur_updates > 0:
-                    tooltips.append(f"AUR updates: {aur_updates}")
-                    classes.append("aur")
+        if aur_updates:
+            tooltips.append(f"AUR updates: {len(aur_updates)}")
+            classes.append("aur")
 
-                self.write_json("", "\n".join(tooltips), "_".join(classes))
+        self.write_json("", "\n".join(tooltips), "_".join(classes))
 
+    async def _check_updates(self):
+        """Check for updates and write result"""
+        self.log("Checking for updates...")
+        self.write_json("", "Checking updates...", "checking")
+        self._last_check_boottime = boottime()
+
+        try:
+            with self.metrics.timed("stage_duration_seconds", stage="arch"):
+                arch_updates = await self._get_arch_updates()
+            with self.metrics.timed("stage_duration_seconds", stage="aur"):
+                aur_updates = await self._get_aur_updates()
+            self._last_checked = datetime.now()
+            self._write_updates(arch_updates, aur_updates)
         except Exception as e:
             self.log(f"Error during update check: {e}")
             self.write_json("!", f"Error checking updates\n{e}", "error")
 
+    async def _recount_updates(self):
+        """Recount updates using the data of the last check and write result"""
+        try:
+            arch_updates = await self.run_in_thread(
+                "recount", self.arch_checker.recount
+            )
+            foreign_packages = await self.run_in_thread(
+                "foreign_packages", self.arch_checker.foreign_packages
+            )
+            aur_updates = self.aur_checker.recount(foreign_packages)
+            self._write_updates(arch_updates, aur_updates)
+        except Exception as e:
+            self.log(f"Error during update recount: {e}")
+            self.write_json("!", f"Error counting updates\n{e}", "error")
+
+    def _time_until_check(self) -> float:
+        """Seconds until the next full check is due, with the power profile"""
+        interval = self.check_intervals[self.power_profile]
+        if self._last_check_boottime is None:
+            return 0
+        return interval - (boottime() - self._last_check_boottime)
+
+    async def _wait_for_request(self) -> bool:
+        """
+        Wait for the next check, which is either requested or due after the
+        interval of the power profile. Returns whether it should be a full
+        check.
+        """
+        while not self._check_requested:
+            remaining = self._time_until_check()
+            if remaining <= 0:
+                return True
+            try:
+                await asyncio.wait_for(
+                    self.signal_event.wait(), timeout=remaining
+                )
+            except asyncio.TimeoutError:
+                pass
+            # Woken up by a request, or to re-evaluate the next check
+            self.signal_event.clear()
+
+        self._check_requested = False
+        full = self._full_check_requested or self._last_checked is None
+        self._full_check_requested = False
+        return full
+
     async def run(self):
         """Main loop"""
         try:
             self.log("Starting waybar updates monitor")
 
             loop = asyncio.get_running_loop()
-            loop.add_signal_handler(signal.SIGUSR1, self.signal_event.set)
+            loop.add_signal_handler(signal.SIGUSR1, self.request_check)
 
-            # Main loop - check every hour or on signal
-            while True:
-                if not self.internet_monitor.internet_working.is_set():
-                    self.write_json("", "", "")
-                    await self.internet_monitor.internet_working.wait()
-
-                await self._check_updates()
+            # Used for downloading the sync databases and querying the AUR.
+            # Kept open so the connections are reused between checks
+            self._http_session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=60)
+            )
 
-                self.log("Waiting for next check (1 hour) or signal...")
-                self.signal_event.clear()
-                try:
-                    await asyncio.wait_for(self.signal_event.wait(), timeout=3600)
-                    self.log("Received signal, checking updates immediately")
-                except asyncio.TimeoutError:
-                    pass
+            pacman_config = PacmanConfig.load()
+            self.arch_checker = ArchUpdateChecker(
+                pacman_config, self.cache_dir / "sync"
+            )
 
-        except Exception as e:
-            self.log(f"Unexpected error: {e}")
-            self.write_json(
-                "!",
-                f"Unexpected error, terminating monitor\n{e}",
-                "error",
+            # Recount as soon as a pacman transaction finishes, no matter how
+            # it was started
+            self.db_watcher = PacmanDbWatcher(
+                pacman_config.db_path, self._on_db_change
             )
-            raise
+            try:
+                self.db_watcher.start()
+            except OSError as e:
+                self.log(f"Not watching the pacman database: {e}")
+
+            # Main loop - check every hour or on request, recount when the
+            # installed packages change
+            full_check = True
+            while True:
+                if full_check:
+                    if not self.internet_monitor.internet_working.is_set():
+                        self.write_json("", "", "")
+                        await self.internet_monitor.internet_working.wait()
+                    with self.metrics.timed("cycle_duration_seconds"):
+                        await self._check_updates()
+                else:
+                    with self.metrics.timed("cycle_duration_seconds"):
+                        await self._recount_updates()
+
+                hours = self.check_intervals[self.power_profile] / 3600
+                self.log(f"Waiting for next check ({hours:g} h) or signal...")
+                full_check = await self._wait_for_request()
+
+        finally:
+            if self.db_watcher is not None:
+                self.db_watcher.close()
+            if self._http_session is not None:
+                await self._http_session.close()
@@ -0,0 +1,121 @@
+"""
+Checks installed foreign packages against the AUR RPC interface. Packages are
+queried in large batches of `info` requests over the monitor's pooled HTTP
+session, and responses are cached so unchanged batches can be answered with a
+304 by the server.
+"""
+
+
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import quote
+
+import aiohttp
+
+from .pacman import Package, PackageUpdate, vercmp
+
+
+@dataclass
+class _CachedResponse:
+    etag: Optional[str]
+    last_modified: Optional[str]
+    versions: dict[str, str]
+
+
+class AurUpdateChecker:
+    def __init__(
+        self,
+        base_url: str = "https://aur.archlinux.org",
+        # The AUR rejects longer request URIs
+        max_url_length: int = 4000,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.max_url_length = max_url_length
+        self._cache: dict[str, _CachedResponse] = {}
+        # AUR versions from the last check
+        self._versions: dict[str, str] = {}
+
+    def _batch_urls(self, names: list[str]) -> list[str]:
+        """Split the package names into as few request URLs as possible"""
+        prefix = f"{self.base_url}/rpc/?v=5&type=info"
+        urls = []
+        url = prefix
+        for name in names:
+            arg = f"&arg[]={quote(name)}"
+            if url != prefix and len(url) + len(arg) > self.max_url_length:
+                urls.append(url)
+                url = prefix
+            url += arg
+        if url != prefix:
+            urls.append(url)
+        return urls
+
+    async def _query(
+        self, session: aiohttp.ClientSession, url: str
+    ) -> dict[str, str]:
+        """Fetch a batch, returning the AUR version of each package found"""
+        cached = self._cache.get(url)
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304 and cached is not None:
+                return cached.versions
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+
+        if data.get("type") == "error":
+            raise RuntimeError(f"AUR RPC error: {data.get('error')}")
+        versions = {
+            result["Name"]: result["Version"] for result in data["results"]
+        }
+        if etag or last_modified:
+            self._cache[url] = _CachedResponse(etag, last_modified, versions)
+        else:
+            self._cache.pop(url, None)
+        return versions
+
+    async def check(
+        self,
+        session: aiohttp.ClientSession,
+        foreign_packages: dict[str, Package],
+    ) -> list[PackageUpdate]:
+        """Return the pending upgrades of the given foreign packages"""
+        urls = self._batch_urls(sorted(foreign_packages))
+        # Drop cached batches which are no longer requested
+        for url in self._cache.keys() - set(urls):
+            del self._cache[url]
+
+        aur_versions = {}
+        # One batch at a time so they all reuse the same connection
+        for url in urls:
+            aur_versions.update(await self._query(session, url))
+        self._versions = aur_versions
+
+        return self.recount(foreign_packages)
+
+    def recount(
+        self, foreign_packages: dict[str, Package]
+    ) -> list[PackageUpdate]:
+        """
+        Return the pending upgrades using the AUR versions of the last check,
+        e.g. after packages were installed
+        """
+        updates = []
+        for name, package in sorted(foreign_packages.items()):
+            aur_version = self._versions.get(name)
+            if aur_version is not None and \
+                    vercmp(aur_version, package.version) > 0:
+                updates.append(PackageUpdate(
+                    name=name,
+                    old_version=package.version,
+                    new_version=aur_version,
+                    download_size=0,
+                ))
+        return updates
@@ -1,25 +1,108 @@
+import asyncio
 import json
 import os
-import sys
 from pathlib import Path
+from typing import Callable, Optional
+
+from .metrics import Metrics
+from .power import PowerContext, PowerEvent, PowerProfile
+from .status_server import StatusServer
 
 
 class BaseMonitor:
-    def __init__(self, json_filename: str):
+    def __init__(self, channel: str, json_filename: str):
+        # Name of the channel the status is pushed to on the status socket
+        self.channel = channel
+        self.status_server: Optional[StatusServer] = None
+        # Writing the status to a file is kept for compatibility with readers
+        # which watch the file
+        self.write_file = False
+
         xdg_runtime_dir = Path(os.environ["XDG_RUNTIME_DIR"])
         self.output_file = xdg_runtime_dir / json_filename
+        # Written first and then renamed over the output file, so readers never
+        # see a partially written file
+        self._temp_file = xdg_runtime_dir / f".{json_filename}.tmp"
+        self._last_published: bytes = b""
+        # The latest status, as published
+        self.status: dict = {}
+        self.writes_emitted = 0
+        self.writes_suppressed = 0
+        # Exported by the daemon, see metrics.py
+        self.metrics = Metrics(monitor=channel)
+        # Power source and suspend state of the system, set by the daemon
+        self.power: Optional[PowerContext] = None
 
     def log(self, *args, **kwargs):
         class_name = self.__class__.__name__
         print(f"{class_name}:", *args, **kwargs, flush=True)
 
+    def stats(self) -> dict:
+        """Counters and internal state of the monitor, for diagnostics"""
+        return {
+            "writes_emitted": self.writes_emitted,
+            "writes_suppressed": self.writes_suppressed,
+        }
+
+    def commands(self) -> dict[str, Callable]:
+        """
+        Actions for the control socket, registered as "<action> <channel>"
+        """
+        return {}
+
+    @property
+    def power_profile(self) -> PowerProfile:
+        if self.power is None:
+            return PowerProfile.AC
+        return self.power.profile
+
+    def attach_power(self, power: PowerContext):
+        """Follow the power source and suspend state of the system"""
+        self.power = power
+        power.subscribe(self.on_power_event)
+        self.on_power_event(PowerEvent.POWER_CHANGED)
+
+    def on_power_event(self, event: PowerEvent):
+        """
+        Called after switching between AC and battery, before suspending and
+        after resuming. Monitors apply their power profiles here
+        """
+
+    async def wait_awake(self):
+        """Wait until the system resumed, if it's suspending"""
+        if self.power is not None:
+            await self.power.wait_awake()
+
+    async def run_in_thread(self, job: str, func: Callable, *args):
+        """Run blocking work in a worker thread, counting and timing it"""
+        self.metrics.inc("thread_jobs_total", job=job)
+        with self.metrics.timed("thread_job_duration_seconds", job=job):
+            return await asyncio.to_thread(func, *args)
+
     def write_json(self, text="", tooltip="", class_name=""):
         data = {"text": text, "tooltip": tooltip, "class": class_name}
+        self.status = data
+        payload = (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
+
+        # Every update wakes up the readers and makes waybar re-render, so skip
+        # it if nothing changed
+        if payload == self._last_published:
+            self.writes_suppressed += 1
+            self.metrics.inc("status_writes_total", result="suppressed")
+            return
+
+        if self.status_server is not None:
+            self.status_server.publish(self.channel, payload)
+
+        if self.write_file:
+            try:
+                with open(self._temp_file, "wb") as f:
+                    f.write(payload)
+                os.replace(self._temp_file, self.output_file)
+            except Exception as e:
+                self.log(f"Unexpected error while writing json file: {e}")
+                raise
 
-        try:
-            with open(self.output_file, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False)
-                f.write("\n")
-        except Exception as e:
-            self.log(f"Unexpected error while writing json file: {e}")
-            sys.exit(1)
+        self._last_published = payload
+        self.writes_emitted += 1
+        self.metrics.inc("status_writes_total", result="emitted")
@@ -0,0 +1,558 @@
+"""
+Benchmarks the check cycles of the internet and updates monitors against local
+stand-ins, so the cost of a change can be measured instead of guessed:
+- ICMP replies come from a scripted prober with injected latency and loss
+- The HTTP 204 check and the AUR RPC interface are served from 127.0.0.1
+- The sync database comes from a file:// mirror, checked against a generated
+  local package database
+
+Every scenario runs in a fresh interpreter, so its peak RSS is its own. Usage:
+    python -m monitor.bench --output baseline.json
+    python -m monitor.bench --compare baseline.json
+"""
+
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Union
+from urllib.parse import parse_qs, urlparse
+
+from .icmp import IcmpReply, IcmpReplyType
+
+
+@dataclass
+class InternetScenario:
+    name: str
+    # Seconds until every probe is answered
+    latency: float = 0.01
+    # Fraction of the probes which are lost
+    gateway_loss: float = 0
+    internet_loss: float = 0
+    # What the 204 URL returns, anything else is a captive portal
+    http_status: int = 204
+
+
+@dataclass
+class UpdatesScenario:
+    name: str
+    repo_packages: int = 1500
+    foreign_packages: int = 50
+    # Whether the mirror publishes a new database before every check
+    databases_change: bool = False
+
+
+Scenario = Union[InternetScenario, UpdatesScenario]
+
+SCENARIOS: dict[str, Scenario] = {
+    scenario.name: scenario
+    for scenario in [
+        InternetScenario("internet-healthy"),
+        InternetScenario("internet-lossy", internet_loss=0.3),
+        InternetScenario("internet-slow", latency=0.3),
+        InternetScenario("internet-no-gateway", gateway_loss=1),
+        InternetScenario("internet-captive", http_status=302),
+        UpdatesScenario("updates-unchanged"),
+        UpdatesScenario("updates-new-databases", databases_change=True),
+    ]
+}
+
+# Compared against the baseline, lower is better for all of them
+METRICS = [
+    "wall_per_cycle_mean",
+    "wall_per_cycle_max",
+    "cpu_per_cycle",
+    "child_cpu_per_cycle",
+    "child_processes",
+    "peak_rss_kib",
+    "status_writes_per_hour",
+    "file_writes_per_hour",
+]
+
+# Every update check is an hour apart, unless requested
+UPDATES_INTERVAL = 3600
+
+GATEWAY_ADDRESS = "192.0.2.1"
+
+
+class FakeProber:
+    """
+    Stand-in for IcmpProber. Answers every probe after the scenario's latency,
+    unless it's lost, in which case it times out like a real probe would.
+    """
+
+    def __init__(self, scenario: InternetScenario):
+        self.scenario = scenario
+        # Seeded so every run loses the same probes
+        self.random = random.Random(scenario.name)
+
+    async def ping(
+        self, address: str, ttl: Optional[int] = None, timeout: float = 3
+    ) -> Optional[IcmpReply]:
+        if ttl == 1:
+            loss = self.scenario.gateway_loss
+            reply_type = IcmpReplyType.TIME_EXCEEDED
+            source = GATEWAY_ADDRESS
+        else:
+            loss = self.scenario.internet_loss
+            reply_type = IcmpReplyType.ECHO_REPLY
+            source = address
+
+        if self.random.random() < loss:
+            await asyncio.sleep(timeout)
+            return None
+        await asyncio.sleep(self.scenario.latency)
+        return IcmpReply(reply_type, source, self.scenario.latency)
+
+    def has_route(self, address: str) -> bool:
+        return True
+
+    def close(self):
+        pass
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """Serves the HTTP 204 check and the AUR RPC info queries"""
+
+    # Keep-alive, like the real servers
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, status: int, body: bytes = b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/generate_204":
+            status = self.server.http_status
+            headers = {}
+            if status != 204:
+                headers["Location"] = f"http://{GATEWAY_ADDRESS}/login"
+            self._reply(status, headers=headers)
+        elif url.path == "/rpc/":
+            versions = self.server.aur_versions
+            results = [
+                {"Name": name, "Version": versions[name]}
+                for name in parse_qs(url.query).get("arg[]", [])
+                if name in versions
+            ]
+            body = json.dumps({
+                "version": 5,
+                "type": "multiinfo",
+                "resultcount": len(results),
+                "results": results,
+            }).encode("utf-8")
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            if self.headers.get("If-None-Match") == etag:
+                self._reply(304, headers={"ETag": etag})
+            else:
+                self._reply(200, body, {
+                    "Content-Type": "application/json",
+                    "ETag": etag,
+                })
+        else:
+            self._reply(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve(sock: socket.socket, http_status: int, aur_versions: dict):
+    server = ThreadingHTTPServer(
+        sock.getsockname(), _StandInHandler, bind_and_activate=False
+    )
+    server.socket.close()
+    server.socket = sock
+    server.http_status = http_status
+    server.aur_versions = aur_versions
+    server.serve_forever()
+
+
+@contextlib.contextmanager
+def stand_in_server(http_status: int = 204, aur_versions=None):
+    """
+    Run the HTTP stand-in in a separate process, so its CPU time is not
+    counted as the monitor's. Yields its base URL.
+    """
+    sock = socket.create_server(("127.0.0.1", 0))
+    host, port = sock.getsockname()
+    process = multiprocessing.get_context("fork").Process(
+        target=_serve, args=(sock, http_status, aur_versions or {}),
+        daemon=True,
+    )
+    process.start()
+    sock.close()
+    try:
+        yield f"http://{host}:{port}"
+    finally:
+        process.terminate()
+        process.join()
+
+
+def _desc(name: str, version: str, size: int = 0) -> str:
+    desc = f"%NAME%\n{name}\n\n%VERSION%\n{version}\n"
+    if size:
+        desc += f"\n%CSIZE%\n{size}\n"
+    return desc
+
+
+class UpdatesFixture:
+    """
+    A local package database with repository and foreign (AUR) packages, a
+    file:// mirror with the sync database of the repository packages, and the
+    AUR versions of the foreign ones. Some of each have an update.
+    """
+
+    REPO = "core"
+
+    def __init__(self, root: Path, scenario: UpdatesScenario):
+        self.db_path = root / "db"
+        self.mirror = root / "mirror"
+        self.cache_dir = root / "cache"
+        self.mirror.mkdir(parents=True)
+
+        self.sync_versions = {}
+        for i in range(scenario.repo_packages):
+            name = f"package{i:05}"
+            self._install(name, "1.0-1")
+            # One in twenty is outdated
+            self.sync_versions[name] = "1.1-1" if i % 20 == 0 else "1.0-1"
+
+        self.aur_versions = {}
+        for i in range(scenario.foreign_packages):
+            name = f"aur-package{i:05}"
+            self._install(name, "2.0-1")
+            self.aur_versions[name] = "2.1-1" if i % 10 == 0 else "2.0-1"
+
+        self._published_at = time.time()
+        self.publish()
+
+    def _install(self, name: str, version: str):
+        entry = self.db_path / "local" / f"{name}-{version}"
+        entry.mkdir(parents=True)
+        (entry / "desc").write_text(_desc(name, version), encoding="utf-8")
+
+    def publish(self, bump: Optional[str] = None):
+        """Write the sync database, with a new version of a package if given"""
+        if bump is not None:
+            self.sync_versions[bump] = f"{self.sync_versions[bump]}.1"
+
+        path = self.mirror / f"{self.REPO}.db"
+        with tarfile.open(path, "w:gz") as tar:
+            for name, version in self.sync_versions.items():
+                data = _desc(name, version, size=1 << 20).encode("utf-8")
+                member = tarfile.TarInfo(f"{name}-{version}/desc")
+                member.size = len(data)
+                tar.addfile(member, io.BytesIO(data))
+        # Always newer than the copy of the last check
+        self._published_at += UPDATES_INTERVAL
+        os.utime(path, (self._published_at, self._published_at))
+
+
+class Meter:
+    """
+    Measures the cycles of a monitor. Child processes and files opened for
+    writing are counted with an audit hook, only while a cycle runs.
+    """
+
+    def __init__(self):
+        self.walls: list[float] = []
+        self.cpu = 0.0
+        self.child_cpu = 0.0
+        self.child_processes = 0
+        self.file_writes = 0
+        self._active = False
+        sys.addaudithook(self._audit)
+
+    def _audit(self, event: str, args: tuple):
+        if not self._active:
+            return
+        if event in ("subprocess.Popen", "os.posix_spawn", "os.fork",
+                     "os.system", "os.spawn"):
+            self.child_processes += 1
+        elif event == "open" and args[2] & (os.O_WRONLY | os.O_RDWR):
+            self.file_writes += 1
+
+    async def measure(self, cycle: Callable[[], Awaitable]):
+        start = resource.getrusage(resource.RUSAGE_SELF)
+        start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start_wall = time.perf_counter()
+        self._active = True
+        try:
+            await cycle()
+        finally:
+            self._active = False
+            self.walls.append(time.perf_counter() - start_wall)
+            end = resource.getrusage(resource.RUSAGE_SELF)
+            end_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+            self.cpu += (end.ru_utime - start.ru_utime) + \
+                (end.ru_stime - start.ru_stime)
+            self.child_cpu += \
+                (end_children.ru_utime - start_children.ru_utime) + \
+                (end_children.ru_stime - start_children.ru_stime)
+
+
+async def bench_internet(
+    scenario: InternetScenario, cycles: int, meter: Meter
+) -> tuple[int, float]:
+    """Run connectivity checks, returns the status writes and simulated time"""
+    from .internet import InternetMonitor
+
+    monitor = InternetMonitor()
+    monitor.write_file = True
+    monitor.probers = {
+        family: FakeProber(scenario) for family in monitor.probers
+    }
+
+    async def cycle():
+        await monitor.check_connectivity()
+        monitor._record_check()
+
+    simulated = 0.0
+    with stand_in_server(scenario.http_status) as url:
+        monitor.test_url_204 = f"{url}/generate_204"
+        try:
+            for _ in range(cycles):
+                await meter.measure(cycle)
+                # The check itself, and the wait until the next one
+                simulated += meter.walls[-1] + monitor.scheduler.interval
+        finally:
+            await monitor._close_http_session()
+    return monitor.writes_emitted, simulated
+
+
+async def bench_updates(
+    scenario: UpdatesScenario, cycles: int, meter: Meter, root: Path
+) -> tuple[int, float]:
+    """Run update checks, returns the status writes and simulated time"""
+    import aiohttp
+
+    from .arch_updates import UpdatesMonitor
+    from .aur import AurUpdateChecker
+    from .pacman import ArchUpdateChecker, PacmanConfig, Repo
+
+    fixture = UpdatesFixture(root, scenario)
+    config = PacmanConfig(
+        db_path=fixture.db_path,
+        repos=[Repo(fixture.REPO, [f"file://{fixture.mirror}"])],
+    )
+
+    # Only the main loop waits for the internet monitor
+    monitor = UpdatesMonitor(internet_monitor=None)
+    monitor.write_file = True
+    monitor.arch_checker = ArchUpdateChecker(config, fixture.cache_dir)
+
+    with stand_in_server(aur_versions=fixture.aur_versions) as url:
+        monitor.aur_checker = AurUpdateChecker(base_url=url)
+        monitor._http_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=60)
+        )
+        try:
+            for i in range(cycles):
+                if scenario.databases_change and i > 0:
+                    fixture.publish(bump=f"package{i:05}")
+                await meter.measure(monitor._check_updates)
+        finally:
+            await monitor._http_session.close()
+    return monitor.writes_emitted, cycles * UPDATES_INTERVAL
+
+
+async def run_scenario(scenario: Scenario, cycles: int) -> dict:
+    """Benchmark a scenario in this process"""
+    meter = Meter()
+    with tempfile.TemporaryDirectory(prefix="monitor-bench-") as temp:
+        root = Path(temp)
+        # Where the monitors write their status files
+        os.environ["XDG_RUNTIME_DIR"] = str(root)
+        # The monitors log every check
+        with open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(devnull):
+            if isinstance(scenario, InternetScenario):
+                status_writes, simulated = await bench_internet(
+                    scenario, cycles, meter
+                )
+            else:
+                status_writes, simulated = await bench_updates(
+                    scenario, cycles, meter, root
+                )
+
+    hours = simulated / 3600
+    return {
+        "parameters": asdict(scenario),
+        "cycles": cycles,
+        "simulated_hours": hours,
+        "wall_per_cycle_mean": statistics.mean(meter.walls),
+        "wall_per_cycle_max": max(meter.walls),
+        "cpu_per_cycle": meter.cpu / cycles,
+        "child_cpu_per_cycle": meter.child_cpu / cycles,
+        "child_processes": meter.child_processes,
+        # Of the whole process, including the setup of the scenario
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "status_writes_per_hour": status_writes / hours,
+        "file_writes_per_hour": meter.file_writes / hours,
+    }
+
+
+def with_overrides(
+    scenario: Scenario,
+    latency: Optional[float],
+    loss: Optional[float],
+) -> Scenario:
+    """Inject the latency (seconds) and loss given on the command line"""
+    if not isinstance(scenario, InternetScenario):
+        return scenario
+    parameters = asdict(scenario)
+    if latency is not None:
+        parameters["latency"] = latency
+    if loss is not None:
+        parameters["gateway_loss"] = parameters["internet_loss"] = loss
+    return InternetScenario(**parameters)
+
+
+def run_in_subprocess(name: str, args: argparse.Namespace) -> dict:
+    command = [
+        sys.executable, "-m", __spec__.name,
+        "--in-process", "--scenario", name, "--cycles", str(args.cycles),
+    ]
+    if args.latency is not None:
+        command += ["--latency", str(args.latency)]
+    if args.loss is not None:
+        command += ["--loss", str(args.loss)]
+    result = subprocess.run(command, stdout=subprocess.PIPE, check=True)
+    return json.loads(result.stdout)
+
+
+def format_metric(name: str, value: float) -> str:
+    if name.startswith(("wall_", "cpu_", "child_cpu_")):
+        return f"{value * 1000:.1f} ms"
+    if name.endswith("_per_hour"):
+        return f"{value:.1f}"
+    return str(value)
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """Print the changes against the baseline, returns whether any regressed"""
+    regressed = False
+    for name, result in results.items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            print(f"{name}: not in the baseline")
+            continue
+        if base["parameters"] != result["parameters"]:
+            print(f"{name}: different parameters than the baseline")
+            continue
+        print(f"{name}:")
+        for metric in METRICS:
+            old, new = base[metric], result[metric]
+            if old:
+                change = (new - old) / old
+                worse = change > threshold
+                change_text = f"{change:+.0%}"
+            else:
+                worse = new > 0
+                change_text = "new" if worse else "="
+            regressed |= worse
+            print(
+                f"  {metric}: {format_metric(metric, old)} -> "
+                f"{format_metric(metric, new)} ({change_text})"
+                + (" REGRESSION" if worse else "")
+            )
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the monitor cycles against local stand-ins"
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=SCENARIOS,
+        help="Scenario to run, can be repeated (default: all)",
+    )
+    parser.add_argument(
+        "--cycles", type=int, default=5, help="Cycles per scenario"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        help="Latency of every probe in seconds, for the internet scenarios",
+    )
+    parser.add_argument(
+        "--loss",
+        type=float,
+        help="Fraction of lost probes, for the internet scenarios",
+    )
+    parser.add_argument("--output", type=Path, help="Save the results as JSON")
+    parser.add_argument(
+        "--compare", type=Path, help="Baseline JSON to compare against"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative increase reported as a regression (default: 0.1)",
+    )
+    # Used for running each scenario in a fresh interpreter
+    parser.add_argument(
+        "--in-process", action="store_true", help=argparse.SUPPRESS
+    )
+    args = parser.parse_args()
+    names = args.scenario or list(SCENARIOS)
+
+    if args.in_process:
+        scenario = with_overrides(SCENARIOS[names[0]], args.latency, args.loss)
+        result = asyncio.run(run_scenario(scenario, args.cycles))
+        print(json.dumps(result))
+        return
+
+    results = {}
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        results[name] = run_in_subprocess(name, args)
+
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        regressed = compare(results, baseline, args.threshold)
+    else:
+        regressed = False
+        for name, result in results.items():
+            print(f"{name}:")
+            for metric in METRICS:
+                print(f"  {metric}: {format_metric(metric, result[metric])}")
+
+    if args.output is not None:
+        args.output.write_text(json.dumps({
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "scenarios": results,
+        }, indent=2) + "\n", encoding="utf-8")
+
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
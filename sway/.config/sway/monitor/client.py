@@ -0,0 +1,61 @@
+#!/usr/bin/python
+# ^ Use this instead of /usr/bin/env python because I actually want to make
+# sure this always uses system python and never ends up running from a venv
+
+"""
+Subscribes to channels of the monitor daemon's status socket and prints every
+update, for use as the exec of a waybar custom module. Reconnects if the daemon
+is not running yet or restarts. Kept free of package imports so it can be run
+directly as a script and start quickly.
+"""
+
+
+import os
+import socket
+import sys
+import time
+
+
+def print_line(line: str):
+    sys.stdout.write(line if line.endswith("\n") else line + "\n")
+    sys.stdout.flush()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <channel>...", file=sys.stderr)
+        sys.exit(1)
+
+    socket_path = os.path.join(
+        os.environ["XDG_RUNTIME_DIR"], "sway-monitor.sock"
+    )
+    request = (" ".join(sys.argv[1:]) + "\n").encode("utf-8")
+    unavailable = (
+        '{"text": "!", "tooltip": "Monitor daemon not available", '
+        '"class": "critical"}'
+    )
+    last_line = None
+
+    while True:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(socket_path)
+                sock.sendall(request)
+                for line in sock.makefile("r", encoding="utf-8"):
+                    print_line(line)
+                    last_line = line
+        except OSError:
+            pass
+
+        # Only report the daemon missing once instead of on every retry
+        if last_line != unavailable:
+            print_line(unavailable)
+            last_line = unavailable
+        time.sleep(1)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,89 @@
+"""
+Local request/response control socket of the monitor daemon. Every request is
+a single line with a command and its arguments separated by spaces, and gets a
+single line of JSON back: {"ok": true, "result": ...} on success or
+{"ok": false, "error": "..."} on failure.
+"""
+
+
+import asyncio
+import json
+import os
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+
+def default_control_path() -> Path:
+    return Path(os.environ["XDG_RUNTIME_DIR"]) / "sway-monitor-control.sock"
+
+
+class ControlServer:
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or default_control_path()
+        self._commands: dict[str, Callable[..., Any]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def add_command(self, name: str, handler: Callable[..., Any]):
+        """
+        Register a command, which may be multiple words (e.g. "recheck
+        updates"). The handler gets the remaining words as arguments, and may
+        be a coroutine function. Its return value must be JSON serializable.
+        """
+        self._commands[name] = handler
+
+    async def start(self):
+        # A leftover socket of a previous run would make the bind fail
+        self.path.unlink(missing_ok=True)
+        self._server = await asyncio.start_unix_server(
+            self._handle_client, path=self.path
+        )
+
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+        self.path.unlink(missing_ok=True)
+
+    def _find_command(self, words: list[str]):
+        """Match the longest registered command at the start of the words"""
+        for length in range(len(words), 0, -1):
+            handler = self._commands.get(" ".join(words[:length]))
+            if handler is not None:
+                return handler, words[length:]
+        return None, words
+
+    async def _execute(self, line: str) -> dict:
+        words = line.split()
+        if not words:
+            return {"ok": False, "error": "Empty command"}
+        handler, args = self._find_command(words)
+        if handler is None:
+            commands = ", ".join(sorted(self._commands))
+            return {
+                "ok": False,
+                "error": f"Unknown command, available: {commands}",
+            }
+        try:
+            result = handler(*args)
+            if asyncio.iscoroutine(result):
+                result = await result
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+        return {"ok": True, "result": result}
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            while line := await reader.readline():
+                response = await self._execute(line.decode("utf-8", "ignore"))
+                writer.write(
+                    (json.dumps(response, default=str) + "\n").encode("utf-8")
+                )
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,52 @@
+#!/usr/bin/python
+# ^ Use this instead of /usr/bin/env python because I actually want to make
+# sure this always uses system python and never ends up running from a venv
+
+"""
+Sends a command to the monitor daemon's control socket and prints the JSON
+reply, e.g. `ctl.py recheck updates` or `ctl.py stats`. Text replies (such as
+the one of `ctl.py metrics`) are printed as they are. Exits with a non-zero
+status if the command failed. Kept free of package imports so it can be run
+directly as a script and start quickly.
+"""
+
+
+import json
+import os
+import socket
+import sys
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(f"Usage: {sys.argv[0]} <command> [args...]", file=sys.stderr)
+        print(f"Example: {sys.argv[0]} recheck updates", file=sys.stderr)
+        sys.exit(1)
+
+    socket_path = os.path.join(
+        os.environ["XDG_RUNTIME_DIR"], "sway-monitor-control.sock"
+    )
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(10)
+        sock.connect(socket_path)
+        sock.sendall((" ".join(sys.argv[1:]) + "\n").encode("utf-8"))
+        reply = sock.makefile("r", encoding="utf-8").readline()
+
+    if not reply:
+        raise RuntimeError("The monitor daemon closed the connection")
+    response = json.loads(reply)
+    if not response["ok"]:
+        raise RuntimeError(response["error"])
+    result = response["result"]
+    if isinstance(result, str):
+        print(result, end="")
+    else:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,345 @@
+"""
+In-process asyncio ICMP echo engine, for IPv4 or IPv6 (ICMPv6). Uses
+unprivileged ICMP datagram sockets (allowed by net.ipv4.ping_group_range, for
+both families) and falls back to raw sockets. Replies, including TTL exceeded
+errors, are parsed from the wire instead of from the localized output of the
+ping command.
+"""
+
+
+import asyncio
+import itertools
+import os
+import socket
+import struct
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional
+
+
+ICMP_ECHO_REPLY = 0
+ICMP_DEST_UNREACH = 3
+ICMP_ECHO_REQUEST = 8
+ICMP_TIME_EXCEEDED = 11
+
+ICMPV6_DEST_UNREACH = 1
+ICMPV6_TIME_EXCEEDED = 3
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+# Linux specific constants which are not all exposed by the socket module
+IP_RECVERR = getattr(socket, "IP_RECVERR", 11)
+IPV6_RECVERR = getattr(socket, "IPV6_RECVERR", 25)
+MSG_ERRQUEUE = getattr(socket, "MSG_ERRQUEUE", 0x2000)
+SO_EE_ORIGIN_ICMP = 2
+SO_EE_ORIGIN_ICMP6 = 3
+
+# Fixed part of the IPv6 header, which errors quote before our request
+_IPV6_HEADER_SIZE = 40
+
+# type, code, checksum, identifier, sequence
+_ICMP_HEADER = struct.Struct("!BBHHH")
+# struct sock_extended_err, followed by the offender's sockaddr
+_SOCK_EXTENDED_ERR = struct.Struct("=IBBBBII")
+_PAYLOAD = b"sway-monitor-ping".ljust(56, b"\0")
+
+
+class IcmpReplyType(Enum):
+    ECHO_REPLY = "ECHO_REPLY"
+    TIME_EXCEEDED = "TIME_EXCEEDED"
+    UNREACHABLE = "UNREACHABLE"
+
+
+@dataclass
+class IcmpReply:
+    type: IcmpReplyType
+    source: str
+    rtt: float  # Seconds
+
+
+@dataclass
+class _PendingProbe:
+    future: asyncio.Future
+    sent_at: float
+
+
+def _checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _build_echo_request(ident: int, seq: int, ipv6: bool = False) -> bytes:
+    if ipv6:
+        # The ICMPv6 checksum covers a pseudo-header with the addresses, so
+        # the kernel always computes it
+        header = _ICMP_HEADER.pack(ICMPV6_ECHO_REQUEST, 0, 0, ident, seq)
+        return header + _PAYLOAD
+    header = _ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    checksum = _checksum(header + _PAYLOAD)
+    header = _ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum, ident, seq)
+    return header + _PAYLOAD
+
+
+@dataclass(frozen=True)
+class _Protocol:
+    """What differs between ICMP over IPv4 and ICMPv6"""
+    family: int
+    proto: int
+    echo_request: int
+    echo_reply: int
+    reply_types: dict[int, IcmpReplyType]
+    # Socket option level of the TTL (hop limit) and error queue options
+    level: int
+    ttl_option: int
+    recverr_option: int
+    error_origin: int
+
+
+_PROTOCOLS = {
+    socket.AF_INET: _Protocol(
+        family=socket.AF_INET,
+        proto=socket.IPPROTO_ICMP,
+        echo_request=ICMP_ECHO_REQUEST,
+        echo_reply=ICMP_ECHO_REPLY,
+        reply_types={
+            ICMP_ECHO_REPLY: IcmpReplyType.ECHO_REPLY,
+            ICMP_TIME_EXCEEDED: IcmpReplyType.TIME_EXCEEDED,
+            ICMP_DEST_UNREACH: IcmpReplyType.UNREACHABLE,
+        },
+        level=socket.IPPROTO_IP,
+        ttl_option=socket.IP_TTL,
+        recverr_option=IP_RECVERR,
+        error_origin=SO_EE_ORIGIN_ICMP,
+    ),
+    socket.AF_INET6: _Protocol(
+        family=socket.AF_INET6,
+        proto=socket.IPPROTO_ICMPV6,
+        echo_request=ICMPV6_ECHO_REQUEST,
+        echo_reply=ICMPV6_ECHO_REPLY,
+        reply_types={
+            ICMPV6_ECHO_REPLY: IcmpReplyType.ECHO_REPLY,
+            ICMPV6_TIME_EXCEEDED: IcmpReplyType.TIME_EXCEEDED,
+            ICMPV6_DEST_UNREACH: IcmpReplyType.UNREACHABLE,
+        },
+        level=socket.IPPROTO_IPV6,
+        ttl_option=socket.IPV6_UNICAST_HOPS,
+        recverr_option=IPV6_RECVERR,
+        error_origin=SO_EE_ORIGIN_ICMP6,
+    ),
+}
+
+
+class IcmpProber:
+    """
+    Sends ICMP echo requests over a single long-lived socket and matches the
+    replies to the waiting probes by their sequence number. One prober handles
+    a single address family.
+    """
+
+    def __init__(self, family: int = socket.AF_INET):
+        self.family = family
+        self._protocol = _PROTOCOLS[family]
+        self._sock: Optional[socket.socket] = None
+        self._raw = False
+        self._default_ttl = 64
+        self._ident = os.getpid() & 0xFFFF
+        self._seq = itertools.count()
+        self._pending: dict[int, _PendingProbe] = {}
+
+    def _open(self):
+        try:
+            # Unprivileged ping socket. The kernel owns the identifier and
+            # only delivers replies to our own probes
+            sock = socket.socket(
+                self.family, socket.SOCK_DGRAM, self._protocol.proto
+            )
+            self._raw = False
+        except PermissionError:
+            # Not in net.ipv4.ping_group_range, requires CAP_NET_RAW
+            sock = socket.socket(
+                self.family, socket.SOCK_RAW, self._protocol.proto
+            )
+            self._raw = True
+
+        protocol = self._protocol
+        sock.setblocking(False)
+        if not self._raw:
+            # ICMP errors (such as TTL exceeded) for datagram sockets are only
+            # delivered through the socket's error queue
+            sock.setsockopt(protocol.level, protocol.recverr_option, 1)
+        self._default_ttl = sock.getsockopt(
+            protocol.level, protocol.ttl_option
+        )
+
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._on_readable)
+        self._sock = sock
+
+    def close(self):
+        if self._sock is None:
+            return
+        asyncio.get_running_loop().remove_reader(self._sock.fileno())
+        self._sock.close()
+        self._sock = None
+        for pending in self._pending.values():
+            pending.future.cancel()
+        self._pending.clear()
+
+    def _next_seq(self) -> int:
+        while True:
+            seq = next(self._seq) & 0xFFFF
+            if seq not in self._pending:
+                return seq
+
+    def _resolve(self, seq: int, reply_type: IcmpReplyType, source: str):
+        pending = self._pending.pop(seq, None)
+        if pending is None or pending.future.done():
+            # Late reply of a probe which already timed out
+            return
+        rtt = time.perf_counter() - pending.sent_at
+        pending.future.set_result(IcmpReply(reply_type, source, rtt))
+
+    def _on_readable(self):
+        if self._sock is None:
+            return
+        if not self._raw:
+            self._drain_error_queue()
+        while True:
+            try:
+                data, address = self._sock.recvfrom(4096)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # Pending errors are reported here as well, they are picked
+                # up from the error queue on the next wakeup
+                if self._raw:
+                    return
+                self._drain_error_queue()
+                continue
+            if self._raw:
+                self._handle_raw_packet(data, address[0])
+            else:
+                self._handle_dgram_packet(data, address[0])
+
+    def _drain_error_queue(self):
+        while True:
+            try:
+                data, ancdata, _, _ = self._sock.recvmsg(
+                    4096, socket.CMSG_SPACE(512), MSG_ERRQUEUE
+                )
+            except (BlockingIOError, InterruptedError):
+                return
+            if len(data) < _ICMP_HEADER.size:
+                continue
+            _, _, _, _, seq = _ICMP_HEADER.unpack_from(data)
+            protocol = self._protocol
+            for level, cmsg_type, cmsg_data in ancdata:
+                if level != protocol.level or \
+                        cmsg_type != protocol.recverr_option:
+                    continue
+                _, origin, icmp_type, _, _, _, _ = \
+                    _SOCK_EXTENDED_ERR.unpack_from(cmsg_data)
+                reply_type = protocol.reply_types.get(icmp_type)
+                if origin != protocol.error_origin or reply_type is None:
+                    continue
+                self._resolve(seq, reply_type, self._offender(cmsg_data))
+
+    def _offender(self, cmsg_data: bytes) -> str:
+        # The offender's sockaddr follows the extended error. Its address
+        # is at offset 4 in a sockaddr_in and at offset 8 in a sockaddr_in6
+        if self.family == socket.AF_INET6:
+            offset = _SOCK_EXTENDED_ERR.size + 8
+            return socket.inet_ntop(
+                socket.AF_INET6, cmsg_data[offset:offset + 16]
+            )
+        offset = _SOCK_EXTENDED_ERR.size + 4
+        return socket.inet_ntoa(cmsg_data[offset:offset + 4])
+
+    def _handle_dgram_packet(self, data: bytes, source: str):
+        if len(data) < _ICMP_HEADER.size:
+            return
+        icmp_type, _, _, _, seq = _ICMP_HEADER.unpack_from(data)
+        if icmp_type == self._protocol.echo_reply:
+            self._resolve(seq, IcmpReplyType.ECHO_REPLY, source)
+
+    def _skip_ip_header(self, packet: bytes) -> bytes:
+        if self.family == socket.AF_INET6:
+            # Assumes no extension headers, which echo requests don't have
+            return packet[_IPV6_HEADER_SIZE:]
+        if not packet:
+            return packet
+        return packet[(packet[0] & 0x0F) * 4:]
+
+    def _handle_raw_packet(self, data: bytes, source: str):
+        protocol = self._protocol
+        # Raw sockets receive every ICMP packet. For IPv4 they include the IP
+        # header, for IPv6 they don't
+        icmp = data if self.family == socket.AF_INET6 else \
+            self._skip_ip_header(data)
+        if len(icmp) < _ICMP_HEADER.size:
+            return
+        icmp_type, _, _, ident, seq = _ICMP_HEADER.unpack_from(icmp)
+
+        if icmp_type == protocol.echo_reply:
+            if ident == self._ident:
+                self._resolve(seq, IcmpReplyType.ECHO_REPLY, source)
+            return
+
+        reply_type = protocol.reply_types.get(icmp_type)
+        if reply_type is None:
+            return
+        # Errors quote the original IP header and the start of our request
+        quoted_icmp = self._skip_ip_header(icmp[_ICMP_HEADER.size:])
+        if len(quoted_icmp) < _ICMP_HEADER.size:
+            return
+        quoted_type, _, _, ident, seq = _ICMP_HEADER.unpack_from(quoted_icmp)
+        if quoted_type == protocol.echo_request and ident == self._ident:
+            self._resolve(seq, reply_type, source)
+
+    def has_route(self, address: str) -> bool:
+        """
+        Whether the kernel has a route to the address. Connecting a UDP
+        socket only looks up the route, nothing is sent.
+        """
+        try:
+            with socket.socket(self.family, socket.SOCK_DGRAM) as sock:
+                sock.connect((address, 9))
+        except OSError:
+            return False
+        return True
+
+    async def ping(
+        self, address: str, ttl: Optional[int] = None, timeout: float = 3
+    ) -> Optional[IcmpReply]:
+        """
+        Send a single echo request to an address of the prober's family.
+        Returns the reply (which may be an error such as TTL exceeded) or None
+        on timeout.
+        """
+        if self._sock is None:
+            self._open()
+
+        seq = self._next_seq()
+        future = asyncio.get_running_loop().create_future()
+        self._sock.setsockopt(
+            self._protocol.level,
+            self._protocol.ttl_option,
+            ttl or self._default_ttl,
+        )
+        self._pending[seq] = _PendingProbe(future, time.perf_counter())
+        try:
+            request = _build_echo_request(
+                self._ident, seq, ipv6=self.family == socket.AF_INET6
+            )
+            self._sock.sendto(request, (address, 0))
+            return await asyncio.wait_for(future, timeout)
+        except (asyncio.TimeoutError, OSError):
+            # Either no reply or the probe couldn't be sent at all (e.g. no
+            # route to the network)
+            return None
+        finally:
+            self._pending.pop(seq, None)
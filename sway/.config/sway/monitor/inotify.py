@@ -0,0 +1,107 @@
+"""
+Minimal asyncio wrapper around Linux inotify, using libc through ctypes.
+"""
+
+
+import asyncio
+import ctypes
+import os
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional
+
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+# wd, mask, cookie, len
+_EVENT = struct.Struct("iIII")
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_libc.inotify_add_watch.argtypes = [
+    ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32
+]
+
+
+@dataclass
+class InotifyEvent:
+    # The watched path, or None on a queue overflow (events were lost)
+    path: Optional[Path]
+    mask: int
+    # Name of the file inside a watched directory, empty for the path itself
+    name: str
+
+
+class Inotify:
+    """
+    Calls `callback` with every event of the watched paths, from the event
+    loop.
+    """
+
+    def __init__(self, callback: Callable[[InotifyEvent], None]):
+        self.callback = callback
+        self._fd: Optional[int] = None
+        self._watches: dict[int, Path] = {}
+
+    def start(self):
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        asyncio.get_running_loop().add_reader(fd, self._on_readable)
+        self._fd = fd
+
+    def add_watch(self, path: Path, mask: int) -> int:
+        wd = _libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(path))
+        self._watches[wd] = path
+        return wd
+
+    def close(self):
+        if self._fd is None:
+            return
+        asyncio.get_running_loop().remove_reader(self._fd)
+        os.close(self._fd)
+        self._fd = None
+        self._watches.clear()
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & IN_IGNORED:
+                # The watch was removed, e.g. because the path was deleted
+                self._watches.pop(wd, None)
+                continue
+            if mask & IN_Q_OVERFLOW:
+                self.callback(InotifyEvent(None, mask, ""))
+                continue
+            path = self._watches.get(wd)
+            if path is not None:
+                self.callback(InotifyEvent(path, mask, os.fsdecode(name)))
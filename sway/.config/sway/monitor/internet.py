@@ -1,21 +1,37 @@
 """
 Monitors internet connectivity by checking multiple network layers. Performs
-gateway ping, internet ping, and HTTP 204 test.
+gateway ping, internet ping, and HTTP 204 test. Pings are sent in-process using
+the ICMP engine in icmp.py, and their RTTs are kept per target in stats.py.
+
+Internet pings go to several providers over both IPv4 and IPv6. Each family
+gets a verdict from a quorum of its targets, so a single provider's outage is
+not mistaken for the internet being down, while IPv6-only breakage still
+shows. Each check probes a few targets per family, rotating through the rest
+in later checks.
 """
 
 
 import asyncio
 import aiohttp
+import ipaddress
+import socket
 from dataclasses import dataclass
 from enum import Enum
-from typing import ClassVar, Optional
+from typing import Callable, ClassVar, Optional
 
 from .base_monitor import BaseMonitor
+from .icmp import IcmpProber, IcmpReplyType
+from .netlink import NetlinkWatcher
+from .power import PowerEvent, PowerProfile
+from .scheduler import AdaptiveScheduler, ScheduleConfig
+from .stats import LatencyThresholds, RttStats, RttSummary
+from .supervisor import register
 
 
 class ConnectivityStatus(Enum):
     FAILED = "FAILED"
     CHOPPY = "CHOPPY"
+    DEGRADED = "DEGRADED"
     SUCCESS = "SUCCESS"
     CAPTIVE = "CAPTIVE"
     UNKNOWN = "UNKNOWN"
@@ -25,24 +41,40 @@ class ConnectivityStatus(Enum):
 class PingResult:
     successful: int
     total: int
+    # Rolling statistics of the target, including previous checks
+    rtt: Optional[RttSummary] = None
+    degraded: bool = False
 
     FAILED: ClassVar["PingResult"]
 
     @classmethod
-    def from_results(cls, results: list[bool]) -> "PingResult":
+    def from_results(
+        cls,
+        results: list[bool],
+        rtt: Optional[RttSummary] = None,
+        thresholds: Optional[LatencyThresholds] = None,
+    ) -> "PingResult":
         return cls(
             successful=sum(results),
-            total=len(results)
+            total=len(results),
+            rtt=rtt,
+            degraded=(
+                rtt is not None
+                and thresholds is not None
+                and rtt.exceeds(thresholds)
+            ),
         )
 
     @property
     def status(self) -> ConnectivityStatus:
         if self.successful == 0:
             return ConnectivityStatus.FAILED
-        elif self.successful == self.total:
-            return ConnectivityStatus.SUCCESS
-        else:
+        elif self.successful != self.total:
             return ConnectivityStatus.CHOPPY
+        elif self.degraded:
+            return ConnectivityStatus.DEGRADED
+        else:
+            return ConnectivityStatus.SUCCESS
 
     def __str__(self):
         return f"{self.status.value} ({self.successful}/{self.total})"
@@ -50,21 +82,152 @@ class PingResult:
 PingResult.FAILED = PingResult(successful=0, total=0)
 
 
+@dataclass(frozen=True)
+class ProbeTarget:
+    address: str
+    provider: str
+
+    @property
+    def family(self) -> int:
+        if ipaddress.ip_address(self.address).version == 6:
+            return socket.AF_INET6
+        return socket.AF_INET
+
+    def __str__(self):
+        return f"{self.provider} ({self.address})"
+
+
+FAMILY_NAMES = {socket.AF_INET: "IPv4", socket.AF_INET6: "IPv6"}
+
+# Public DNS resolvers of different providers, which answer pings over anycast
+DEFAULT_TARGETS = [
+    ProbeTarget("1.1.1.1", "Cloudflare"),
+    ProbeTarget("8.8.8.8", "Google"),
+    ProbeTarget("9.9.9.9", "Quad9"),
+    ProbeTarget("208.67.222.222", "OpenDNS"),
+    ProbeTarget("2606:4700:4700::1111", "Cloudflare"),
+    ProbeTarget("2001:4860:4860::8888", "Google"),
+    ProbeTarget("2620:fe::fe", "Quad9"),
+    ProbeTarget("2620:119:35::35", "OpenDNS"),
+]
+
+
+@dataclass
+class QuorumResult:
+    """Verdict of the internet pings of one address family"""
+    family: str
+    successful: int
+    failed: int
+    # Targets probed in this check, some may have been cancelled
+    total: int
+    quorum: int
+    degraded: bool = False
+
+    @property
+    def decided(self) -> bool:
+        return (
+            self.successful >= self.quorum
+            or self.failed > self.total - self.quorum
+        )
+
+    @property
+    def status(self) -> ConnectivityStatus:
+        if self.successful >= self.quorum:
+            if self.degraded:
+                return ConnectivityStatus.DEGRADED
+            return ConnectivityStatus.SUCCESS
+        elif self.successful > 0:
+            return ConnectivityStatus.CHOPPY
+        else:
+            return ConnectivityStatus.FAILED
+
+    def __str__(self):
+        answered = self.successful + self.failed
+        return (
+            f"{self.family}: {self.status.value} "
+            f"({self.successful}/{answered}, quorum {self.quorum})"
+        )
+
+
+@register("internet")
 class InternetMonitor(BaseMonitor):
-    def __init__(self):
-        super().__init__("internet_monitor.json")
+    def __init__(
+        self,
+        schedule: Optional[ScheduleConfig] = None,
+        battery_schedule: Optional[ScheduleConfig] = None,
+        targets: Optional[list[ProbeTarget]] = None,
+        targets_per_check: int = 3,
+        quorum: int = 2,
+        nameservers: Optional[list[str]] = None,
+    ):
+        super().__init__("internet", "internet_monitor.json")
+        if not 0 < quorum <= targets_per_check:
+            raise ValueError("The quorum must be between 1 and the targets "
+                             "probed per check")
         self.default_gateway: Optional[PingResult] = None
-        self.internet_ping: Optional[PingResult] = None
+        # Verdict per address family, None if the family has no route
+        self.families: dict[str, Optional[QuorumResult]] = {}
+        self.internet_status = ConnectivityStatus.UNKNOWN
         self.internet_204: ConnectivityStatus = ConnectivityStatus.UNKNOWN
         self.internet_working = asyncio.Event()
         self._last_status_log = ""
-
-        self.target_ip = "8.8.8.8"
+        self.probers = {
+            family: IcmpProber(family) for family in FAMILY_NAMES
+        }
+        # Address of the router which answered the TTL=1 pings, used to notice
+        # when we moved to a different network
+        self.first_hop: Optional[str] = None
+
+        self._http_session: Optional[aiohttp.ClientSession] = None
+        self._http_session_first_hop: Optional[str] = None
+
+        # Checks are less frequent on battery. Between backed off checks a
+        # single ping every keepalive interval bounds how long an outage goes
+        # unnoticed: about 13s on AC (the keepalive and its timeout, as with
+        # the fixed 10s interval of old), about 33s on battery
+        self.schedules = {
+            PowerProfile.AC: schedule or ScheduleConfig(),
+            PowerProfile.BATTERY: battery_schedule or ScheduleConfig(
+                min_interval=30,
+                max_interval=600,
+                burst_interval=3,
+                keepalive_interval=30,
+            ),
+        }
+        self.scheduler = AdaptiveScheduler(self.schedules[PowerProfile.AC])
+        self.netlink = NetlinkWatcher(self._on_network_change)
+        self._netlink_running = False
+        self._network_changed = False
+
+        self.targets = targets or DEFAULT_TARGETS
+        # Targets probed per family in each check, and how many of them must
+        # agree on the verdict
+        self.targets_per_check = targets_per_check
+        self.quorum = quorum
+        # Where the rotation of each family's targets continues next check
+        self._rotation = {family: 0 for family in FAMILY_NAMES}
+        # Next target pinged by the keepalive
+        self._keepalive_index = 0
+        # The default targets are resolvers of several providers as well
+        self.nameservers = nameservers or [
+            target.address for target in DEFAULT_TARGETS
+        ]
         self.test_url_204 = "http://clients3.google.com/generate_204"
 
+        # RTT statistics per target, the gateway is whatever answers TTL=1
+        self.rtt_stats: dict[str, RttStats] = {}
+        # Number of latest probes summarized in the stats
+        self.stats_window = 50
+        # Number of latest probes compared against the latency thresholds
+        self.degraded_window = 10
+        self.latency_thresholds = LatencyThresholds()
+
     def write_json(self, text="", tooltip="", class_name=""):
         # To keep track of status changes in the log but not spam, print the
-        # tooltip only if it's different from the last log
+        # tooltip only if it's different from the last log. The tooltip only
+        # holds statuses, so it's stable while nothing changes: figures which
+        # vary every check (RTTs, loss, probe counts) are in the stats and
+        # metrics instead
         message = tooltip.replace("\n", " ")
         # Empty tooltip is a special case
         if not message:
@@ -75,92 +238,217 @@ class InternetMonitor(BaseMonitor):
         return super().write_json(text, tooltip, class_name)
 
     async def _run_ping_command(
-        self, ttl: Optional[int], timeout: int = 3
+        self, address: str, ttl: Optional[int], timeout: int = 3
     ) -> bool:
         """
-        Execute ping command asynchronously.
+        Send a single ICMP probe to the address.
         """
         ping_type = f"TTL={ttl}" if ttl else "normal"
+        stage = "gateway" if ttl == 1 else "internet"
+        prober = self.probers[ProbeTarget(address, "").family]
 
         try:
-            cmd = ["ping", "-c", "1", "-W", str(timeout)]
-            if ttl:
-                cmd.extend(["-t", str(ttl)])
-
-            cmd.append(self.target_ip)
-
-            # Run the command
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-
-            try:
-                stdout, stderr = await asyncio.wait_for(
-                    process.communicate(),
-                    timeout=timeout + 0.5  # Add small buffer to timeout
-                )
-            except asyncio.TimeoutError:
-                process.kill()
-                await process.communicate()
-                return False
-
-            output = stdout.decode("utf-8", errors="ignore").lower()
-
-            # Check for success conditions
-            if ttl == 1:
-                # For TTL=1, we expect "Time to live exceeded" or similar
-                ttl_exceeded_messages = [
-                    "time to live exceeded",
-                    "ttl exceeded",
-                    "time exceeded",
-                    "hop limit exceeded"
-                ]
-                success = any(msg in output for msg in ttl_exceeded_messages)
-            else:
-                # For normal ping, check for success indicators
-                success_indicators = [
-                    "bytes from",
-                    "reply from",
-                    "64 bytes",
-                    "32 bytes"
-                ]
-                success = any(
-                    indicator in output for indicator in success_indicators
-                )
-
-            return success
-
+            reply = await prober.ping(address, ttl, timeout)
         except Exception as e:
             self.log(
-                f"Ping ({ping_type}) to {self.target_ip} finished: FAILED (exception: {e})"
+                f"Ping ({ping_type}) to {address} finished: FAILED (exception: {e})"
             )
+            self.metrics.inc("probes_total", stage=stage, result="error")
             return False
 
-    async def check_http_204(self):
-        try:
+        if ttl == 1:
+            # For TTL=1, we expect the first hop to report the TTL exceeded
+            target = "gateway"
+            success = (
+                reply is not None
+                and reply.type == IcmpReplyType.TIME_EXCEEDED
+            )
+            if success:
+                self.first_hop = reply.source
+        else:
+            target = address
+            success = (
+                reply is not None and reply.type == IcmpReplyType.ECHO_REPLY
+            )
+
+        if target not in self.rtt_stats:
+            self.rtt_stats[target] = RttStats()
+        self.rtt_stats[target].add(reply.rtt if success else None)
+        if success:
+            self.metrics.observe("probe_rtt_seconds", reply.rtt, target=target)
+
+        if success:
+            result = "success"
+        elif reply is None:
+            result = "timeout"
+        else:
+            # Such as an unreachable error
+            result = "unexpected_reply"
+        self.metrics.inc("probes_total", stage=stage, result=result)
+        return success
+
+    def _ping_result(self, results: list[bool], target: str) -> PingResult:
+        """Combine the results of a stage with the target's statistics"""
+        stats = self.rtt_stats.get(target)
+        return PingResult.from_results(
+            results,
+            stats.summary(self.degraded_window) if stats else None,
+            self.latency_thresholds,
+        )
+
+    def _quorum_result(
+        self, family: int, successful: list[str], failed: int, total: int
+    ) -> QuorumResult:
+        """
+        Combine the pings of a family. It's degraded if a quorum of the
+        targets which answered exceed the latency thresholds.
+        """
+        # Fewer targets than the quorum may be configured for a family
+        quorum = min(self.quorum, total) or self.quorum
+        slow = 0
+        for address in successful:
+            stats = self.rtt_stats.get(address)
+            summary = stats.summary(self.degraded_window) if stats else None
+            if summary is not None and \
+                    summary.exceeds(self.latency_thresholds):
+                slow += 1
+        return QuorumResult(
+            family=FAMILY_NAMES[family],
+            successful=len(successful),
+            failed=failed,
+            total=total,
+            quorum=quorum,
+            degraded=slow >= quorum,
+        )
+
+    def _overall_status(self) -> ConnectivityStatus:
+        """
+        Combine the families which have a route. Any family failing makes
+        the connection choppy, all of them failing makes it failed.
+        """
+        results = [result for result in self.families.values() if result]
+        statuses = [result.status for result in results]
+        if not statuses or all(
+            status == ConnectivityStatus.FAILED for status in statuses
+        ):
+            return ConnectivityStatus.FAILED
+        if any(
+            status in (ConnectivityStatus.FAILED, ConnectivityStatus.CHOPPY)
+            for status in statuses
+        ):
+            return ConnectivityStatus.CHOPPY
+        if ConnectivityStatus.DEGRADED in statuses:
+            return ConnectivityStatus.DEGRADED
+        return ConnectivityStatus.SUCCESS
+
+    def _describe_families(self) -> str:
+        """
+        Verdict of each family, for the tooltip. Without the counts, which
+        depend on when the remaining probes were cancelled
+        """
+        return "\n".join(
+            f"{name}: {result.status.value if result else 'no route'}"
+            for name, result in self.families.items()
+        )
+
+    def _target_name(self, address: str) -> str:
+        for target in self.targets:
+            if target.address == address:
+                return str(target)
+        return address
+
+    def commands(self) -> dict[str, Callable]:
+        return {"probe": self.request_probe}
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["next_check_in"] = self.scheduler.interval
+        stats["first_hop"] = self.first_hop
+        if self._netlink_running and self.netlink.default_route is not None:
+            stats["default_route"] = str(self.netlink.default_route)
+        if self.default_gateway is not None:
+            stats["gateway"] = str(self.default_gateway)
+        stats["families"] = {
+            name: str(result) if result else None
+            for name, result in self.families.items()
+        }
+        stats["targets"] = {}
+        for target, target_stats in self.rtt_stats.items():
+            summary = target_stats.summary(self.stats_window)
+            stats["targets"][target] = {
+                "name": self._target_name(target),
+                "sent": target_stats.sent,
+                "lost": target_stats.lost,
+                "recent": summary.as_dict() if summary else None,
+            }
+        return stats
+
+    def _get_http_session(self) -> aiohttp.ClientSession:
+        """
+        Return the long-lived HTTP session, creating it if needed. Keeping it
+        around allows reusing the resolver, DNS cache and a keep-alive
+        connection between checks.
+        """
+        if self._http_session is None or self._http_session.closed:
             resolver = aiohttp.resolver.AsyncResolver(
-                nameservers=["8.8.8.8", "8.8.4.4"]
+                nameservers=self.nameservers
+            )
+            connector = aiohttp.TCPConnector(
+                resolver=resolver,
+                limit=1,
+                ttl_dns_cache=300,
+                # Longer than the longest interval between checks of any
+                # power profile, so the connection survives until the next
+                # one even after switching to a longer schedule
+                keepalive_timeout=max(
+                    config.max_interval for config in self.schedules.values()
+                ) + 10,
             )
-            connector = aiohttp.TCPConnector(resolver=resolver)
             timeout = aiohttp.ClientTimeout(total=5)
-            async with aiohttp.ClientSession(
+            self._http_session = aiohttp.ClientSession(
                 connector=connector, timeout=timeout
-            ) as session:
-                async with session.get(
-                    self.test_url_204, allow_redirects=False
-                ) as response:
-                    if response.status == 204:
-                        self.internet_204 = ConnectivityStatus.SUCCESS
-                    else:
-                        self.internet_204 = ConnectivityStatus.CAPTIVE
+            )
+            self._http_session_first_hop = self.first_hop
+        return self._http_session
+
+    async def _close_http_session(self):
+        if self._http_session is not None:
+            await self._http_session.close()
+            self._http_session = None
+
+    async def check_http_204(self, fresh_connection: bool = False):
+        """
+        Request the 204 URL over the persistent session. A captive portal only
+        intercepts new connections, so a fresh connection (and DNS lookup) is
+        used whenever the network changed or the last check didn't succeed.
+        """
+        if (
+            fresh_connection
+            or self.internet_204 != ConnectivityStatus.SUCCESS
+            or self.first_hop != self._http_session_first_hop
+            or self._network_changed
+        ):
+            await self._close_http_session()
+            self._network_changed = False
+
+        try:
+            session = self._get_http_session()
+            async with session.get(
+                self.test_url_204, allow_redirects=False
+            ) as response:
+                if response.status == 204:
+                    self.internet_204 = ConnectivityStatus.SUCCESS
+                else:
+                    self.internet_204 = ConnectivityStatus.CAPTIVE
         except Exception as e:
             self.log(f"HTTP test failed: {e}")
             self.internet_204 = ConnectivityStatus.FAILED
+        self.metrics.inc(
+            "http_checks_total", result=self.internet_204.value.lower()
+        )
 
     async def _run_multiple_pings(
-        self, ttl: Optional[int], count: int, delay: float = 0.5
+        self, address: str, ttl: Optional[int], count: int, delay: float = 0.5
     ) -> set:
         """
         Create multiple ping tasks and return the set of running tasks.
@@ -169,11 +457,34 @@ class InternetMonitor(BaseMonitor):
         for i in range(count):
             async def ping_with_delay(iteration):
                 await asyncio.sleep(iteration * delay)
-                return await self._run_ping_command(ttl)
+                return await self._run_ping_command(address, ttl)
             task = asyncio.create_task(ping_with_delay(i))
             tasks.add(task)
         return tasks
 
+    def _targets_for_check(self) -> dict[int, list[ProbeTarget]]:
+        """
+        Pick the targets of each family with a route for this check, rotating
+        through all of them over the following checks
+        """
+        selected = {}
+        for family in FAMILY_NAMES:
+            targets = [
+                target for target in self.targets if target.family == family
+            ]
+            if not targets:
+                continue
+            start = self._rotation[family] % len(targets)
+            count = min(self.targets_per_check, len(targets))
+            picked = [
+                targets[(start + i) % len(targets)] for i in range(count)
+            ]
+            if not self.probers[family].has_route(picked[0].address):
+                continue
+            self._rotation[family] = start + count
+            selected[family] = picked
+        return selected
+
     async def check_connectivity(self):
         """
         Main method to check all connectivity levels.
@@ -184,21 +495,64 @@ class InternetMonitor(BaseMonitor):
         # first successful ping from the previous stage completes.
         # - Gateway pings start immediately
         # - First gateway success -> internet pings start (gateway continues)
-        # - First internet success -> HTTP check starts (both continue)
+        # - First family reaching its quorum -> HTTP check starts
+        # The remaining internet pings of a family are cancelled once its
+        # quorum is decided either way.
+
+        loop = asyncio.get_running_loop()
+        # When each stage started, for the stage metrics
+        started = {"gateway": loop.time()}
+
+        def stage_finished(stage: str):
+            self.metrics.observe(
+                "stage_duration_seconds",
+                loop.time() - started[stage],
+                stage=stage,
+            )
+
+        def stage_succeeded(stage: str):
+            # Since the start of the whole check
+            self.metrics.observe(
+                "stage_first_success_seconds",
+                loop.time() - started["gateway"],
+                stage=stage,
+            )
+
+        selected = self._targets_for_check()
+        # The gateway is probed over the first family with a route
+        gateway_address = next(
+            (targets[0].address for targets in selected.values()),
+            self.targets[0].address,
+        )
 
         all_running_tasks = set()
 
         gateway_tasks = set()
-        internet_tasks = set()
+        # Family and target of each internet ping
+        internet_tasks: dict[asyncio.Task, tuple[int, str]] = {}
+        cancelled_tasks = set()
         http_task = None
 
         gateway_results = []
-        internet_results = []
+        # Addresses which answered, and the number of failures per family
+        internet_successes = {family: [] for family in selected}
+        internet_failures = {family: 0 for family in selected}
 
         internet_started = False
+        internet_finished = False
         http_started = False
 
-        gateway_tasks = await self._run_multiple_pings(ttl=1, count=5)
+        def family_result(family: int) -> QuorumResult:
+            return self._quorum_result(
+                family,
+                internet_successes[family],
+                internet_failures[family],
+                len(selected[family]),
+            )
+
+        gateway_tasks = await self._run_multiple_pings(
+            gateway_address, ttl=1, count=5
+        )
         all_running_tasks.update(gateway_tasks)
 
         while all_running_tasks:
@@ -209,34 +563,87 @@ class InternetMonitor(BaseMonitor):
 
             for task in done:
                 if task == http_task:
+                    stage_finished("http")
+                    if self.internet_204 == ConnectivityStatus.SUCCESS:
+                        stage_succeeded("http")
                     continue
 
                 result = await task
 
                 if task in gateway_tasks:
                     gateway_results.append(result)
+                    if len(gateway_results) == len(gateway_tasks):
+                        stage_finished("gateway")
 
                     if result and not internet_started:
-                        internet_tasks = await self._run_multiple_pings(
-                            ttl=None, count=3
-                        )
+                        stage_succeeded("gateway")
+                        started["internet"] = loop.time()
+                        for family, targets in selected.items():
+                            for target in targets:
+                                ping = asyncio.create_task(
+                                    self._run_ping_command(
+                                        target.address, ttl=None
+                                    )
+                                )
+                                internet_tasks[ping] = (
+                                    family, target.address
+                                )
                         all_running_tasks.update(internet_tasks)
                         internet_started = True
 
                 elif task in internet_tasks:
-                    internet_results.append(result)
-
-                    if result and not http_started:
+                    family, address = internet_tasks[task]
+                    if result:
+                        internet_successes[family].append(address)
+                    else:
+                        internet_failures[family] += 1
+                    verdict = family_result(family)
+                    if not verdict.decided:
+                        continue
+
+                    # Cancel the rest of the family, the verdict is known
+                    for other, (other_family, _) in internet_tasks.items():
+                        if other_family == family and not other.done() and \
+                                other not in cancelled_tasks:
+                            other.cancel()
+                            cancelled_tasks.add(other)
+                            all_running_tasks.discard(other)
+                            self.metrics.inc(
+                                "probes_total",
+                                stage="internet",
+                                result="cancelled",
+                            )
+                    if not internet_finished and all(
+                        other.done() or other in cancelled_tasks
+                        for other in internet_tasks
+                    ):
+                        stage_finished("internet")
+                        internet_finished = True
+
+                    if verdict.successful >= verdict.quorum and \
+                            not http_started:
+                        stage_succeeded("internet")
+                        started["http"] = loop.time()
                         http_task = asyncio.create_task(self.check_http_204())
                         all_running_tasks.add(http_task)
                         http_started = True
 
-        self.default_gateway = PingResult.from_results(gateway_results)
-
-        if internet_started:
-            self.internet_ping = PingResult.from_results(internet_results)
-        else:
-            self.internet_ping = PingResult.FAILED
+        # Let the cancelled pings clean up their pending probes
+        await asyncio.gather(*cancelled_tasks, return_exceptions=True)
+
+        self.default_gateway = self._ping_result(gateway_results, "gateway")
+
+        self.families = {}
+        for family, name in FAMILY_NAMES.items():
+            if family in selected:
+                self.families[name] = family_result(family)
+            elif any(target.family == family for target in self.targets):
+                self.families[name] = None
+        self.internet_status = (
+            self._overall_status()
+            if internet_started
+            else ConnectivityStatus.FAILED
+        )
 
         if not http_started:
             self.internet_204 = ConnectivityStatus.FAILED
@@ -244,35 +651,121 @@ class InternetMonitor(BaseMonitor):
         if self.default_gateway.status != ConnectivityStatus.SUCCESS:
             self.write_json(
                 "⚠",
-                f"Pings to default gateway:\n{self.default_gateway}",
-                "warning"
-                if self.default_gateway.status == ConnectivityStatus.CHOPPY
-                else "critical",
+                f"Pings to default gateway{self._describe_route()}:\n"
+                f"{self.default_gateway.status.value}",
+                "critical"
+                if self.default_gateway.status == ConnectivityStatus.FAILED
+                else "warning",
             )
-        elif self.internet_ping.status != ConnectivityStatus.SUCCESS:
+        elif self.internet_status != ConnectivityStatus.SUCCESS:
             self.write_json(
                 "",
-                f"Pings to internet:\n{self.internet_ping}",
-                "warning"
-                if self.internet_ping.status == ConnectivityStatus.CHOPPY
-                else "critical",
+                f"Pings to internet{self._describe_route()}:\n"
+                f"{self._describe_families()}",
+                "critical"
+                if self.internet_status == ConnectivityStatus.FAILED
+                else "warning",
             )
         else:
+            # Working, but show how each family fared
+            families = self._describe_families()
             match self.internet_204:
                 case ConnectivityStatus.FAILED:
                     self.write_json(
-                        "", "HTTP connection to 204 check failed", "critical"
+                        "",
+                        f"HTTP connection to 204 check failed\n{families}",
+                        "critical",
                     )
                 case ConnectivityStatus.CAPTIVE:
-                    self.write_json("", "Captive portal detected", "warning")
+                    self.write_json(
+                        "", f"Captive portal detected\n{families}", "warning"
+                    )
                 case _:
-                    self.write_json("", "", "")
+                    self.write_json("", families, "")
 
         if self.internet_204 == ConnectivityStatus.SUCCESS:
             self.internet_working.set()
         else:
             self.internet_working.clear()
 
+    def _describe_route(self) -> str:
+        """Name the default gateway and interface for the tooltip"""
+        if not self._netlink_running:
+            return ""
+        if self.netlink.default_route is None:
+            return " (no default route)"
+        return f" ({self.netlink.default_route})"
+
+    def _on_network_change(self):
+        """Called by the netlink watcher when the network changed"""
+        self._network_changed = True
+        self.request_probe()
+
+    def on_power_event(self, event: PowerEvent):
+        if event == PowerEvent.POWER_CHANGED:
+            self.scheduler.set_config(self.schedules[self.power_profile])
+        elif event == PowerEvent.SUSPENDING:
+            # The connection is unknown after resuming, until checked
+            self.internet_working.clear()
+        elif event == PowerEvent.RESUMED:
+            # Don't show the status from before suspending meanwhile
+            self.write_json("", "Checking after resume...", "")
+            self._network_changed = True
+            self.scheduler.start_burst()
+
+    async def _keepalive(self) -> bool:
+        """
+        Ping a single target between checks, rotating through the families
+        which had a route in the last check. A failure triggers a full check.
+        """
+        routed = {
+            family
+            for family, name in FAMILY_NAMES.items()
+            if self.families.get(name) is not None
+        }
+        targets = [
+            target for target in self.targets if target.family in routed
+        ]
+        if not targets:
+            return True
+        target = targets[self._keepalive_index % len(targets)]
+        self._keepalive_index += 1
+
+        try:
+            reply = await self.probers[target.family].ping(target.address)
+        except Exception:
+            reply = None
+        success = reply is not None and reply.type == IcmpReplyType.ECHO_REPLY
+        self.metrics.inc(
+            "probes_total",
+            stage="keepalive",
+            result="success" if success else "failure",
+        )
+        if not success:
+            self.log(f"Keepalive ping to {target} failed, checking now")
+        return success
+
+    def request_probe(self):
+        """Run a connectivity check now instead of waiting for the next one"""
+        self.scheduler.trigger()
+
+    def _record_check(self):
+        """Feed the result of the latest check to the scheduler"""
+        statuses = (
+            self.default_gateway.status,
+            self.internet_status,
+            self.internet_204,
+        )
+        healthy = all(
+            status == ConnectivityStatus.SUCCESS for status in statuses
+        )
+        # A family changing its verdict is a change as well
+        families = tuple(
+            (name, result.status if result else None)
+            for name, result in self.families.items()
+        )
+        self.scheduler.record((statuses, families), healthy)
+
     async def run(self):
         """Main loop"""
         try:
@@ -280,16 +773,27 @@ class InternetMonitor(BaseMonitor):
             # internet check even ran
             self.write_json("", "Starting...", "")
 
-            # Main loop - check every 10 seconds
-            while True:
-                await self.check_connectivity()
-                await asyncio.sleep(10)
+            # Re-check immediately on network changes instead of waiting for
+            # the next scheduled check
+            try:
+                self.netlink.start()
+                self._netlink_running = True
+            except OSError as e:
+                self.log(f"Not watching network changes: {e}")
 
-        except Exception as e:
-            self.log(f"Unexpected error: {e}")
-            self.write_json(
-                "!",
-                f"Unexpected error, terminating monitor\n{e}",
-                "critical",
-            )
-            raise
+            # Main loop - check more often while the connection is unstable,
+            # back off while nothing changes, or check now when requested
+            while True:
+                # No probes while suspending
+                await self.wait_awake()
+                with self.metrics.timed("cycle_duration_seconds"):
+                    await self.check_connectivity()
+                self._record_check()
+                await self.scheduler.wait(self._keepalive)
+
+        finally:
+            self.netlink.close()
+            self._netlink_running = False
+            for prober in self.probers.values():
+                prober.close()
+            await self._close_http_session()
@@ -0,0 +1,253 @@
+"""
+Instrumentation of the daemon: counters and histograms with labels, kept in
+memory and rendered in the Prometheus text format. The exporter writes them to
+a file in $XDG_RUNTIME_DIR (which node_exporter's textfile collector can pick
+up) shortly after they change, or when requested with `ctl.py metrics write`,
+and they can be fetched on demand with `ctl.py metrics`. It never wakes up the
+daemon by itself.
+"""
+
+
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+PREFIX = "sway_monitor_"
+
+# Seconds, from delays of the event loop up to checks which timed out
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    30, 60,
+)
+
+HELP = {
+    "status_writes_total":
+        "Status updates, published or suppressed because nothing changed",
+    "cycle_duration_seconds": "Duration of a whole check",
+    "stage_duration_seconds": "Duration of a stage of a check",
+    "stage_first_success_seconds":
+        "Time from the start of a check to the first success of a stage",
+    "probes_total": "Probes sent, by result",
+    "probe_rtt_seconds": "Round trip time of the probes which were answered",
+    "http_checks_total": "HTTP 204 checks, by result",
+    "thread_jobs_total": "Blocking jobs run in a worker thread",
+    "thread_job_duration_seconds":
+        "Duration of blocking jobs run in a worker thread",
+    "restarts_total": "Restarts of a monitor after it failed",
+    "metrics_write_delay_seconds":
+        "How late the event loop ran the delayed metrics write",
+}
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # Observations per bucket, not cumulative. Larger ones are only in
+        # the count
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+
+
+class Metrics:
+    """
+    Counters and histograms of a component. The labels given here are added
+    to all of them.
+    """
+
+    def __init__(self, **labels: str):
+        self.labels: Labels = tuple(sorted(labels.items()))
+        self.counters: dict[tuple[str, Labels], float] = {}
+        self.histograms: dict[tuple[str, Labels], Histogram] = {}
+        # Called after any value changed
+        self.listeners: list[Callable[[], None]] = []
+
+    def _changed(self):
+        for listener in self.listeners:
+            listener()
+
+    def _key(self, name: str, labels: dict) -> tuple[str, Labels]:
+        return name, self.labels + tuple(sorted(labels.items()))
+
+    def inc(self, name: str, amount: float = 1, **labels: str):
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+        self._changed()
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+        self._changed()
+
+    @contextmanager
+    def timed(self, name: str, **labels: str) -> Iterator[None]:
+        """Observe the duration of the block, even if it fails"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    formatted = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in labels
+    )
+    return f"{{{formatted}}}"
+
+
+def _escape(value: str) -> str:
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+    )
+
+
+def _format_value(value: float) -> str:
+    # The shortest representation which reads back as the same value
+    return repr(value)
+
+
+def render(sources: Iterable[Metrics]) -> str:
+    """Render the metrics of all sources in the Prometheus text format"""
+    counters: dict[str, list[tuple[Labels, float]]] = {}
+    histograms: dict[str, list[tuple[Labels, Histogram]]] = {}
+    for metrics in sources:
+        for (name, labels), value in metrics.counters.items():
+            counters.setdefault(name, []).append((labels, value))
+        for (name, labels), histogram in metrics.histograms.items():
+            histograms.setdefault(name, []).append((labels, histogram))
+
+    lines = []
+    for name, samples in sorted(counters.items()):
+        full_name = PREFIX + name
+        lines.append(f"# HELP {full_name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {full_name} counter")
+        for labels, value in samples:
+            lines.append(
+                f"{full_name}{_format_labels(labels)} {_format_value(value)}"
+            )
+
+    for name, samples in sorted(histograms.items()):
+        full_name = PREFIX + name
+        lines.append(f"# HELP {full_name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {full_name} histogram")
+        for labels, histogram in samples:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                bucket_labels = labels + (("le", _format_value(bound)),)
+                lines.append(
+                    f"{full_name}_bucket{_format_labels(bucket_labels)} "
+                    f"{cumulative}"
+                )
+            bucket_labels = labels + (("le", "+Inf"),)
+            lines.append(
+                f"{full_name}_bucket{_format_labels(bucket_labels)} "
+                f"{histogram.count}"
+            )
+            lines.append(
+                f"{full_name}_sum{_format_labels(labels)} "
+                f"{_format_value(histogram.sum)}"
+            )
+            lines.append(
+                f"{full_name}_count{_format_labels(labels)} {histogram.count}"
+            )
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """
+    Writes the metrics of all sources to a file a moment after they changed,
+    so a burst of changes (such as the probes of a check) is written once.
+    As changes only happen while the daemon is busy anyway, it adds no
+    wakeups of its own. How late the event loop runs that write is recorded,
+    which hints at its lag while the daemon is busy, but it isn't sampled
+    while it's idle.
+    """
+
+    def __init__(self, sources: list[Metrics], write_delay: float = 5):
+        # Metrics of the daemon itself, they don't trigger writes
+        self.metrics = Metrics()
+        self.sources = [self.metrics] + sources
+        self.write_delay = write_delay
+
+        xdg_runtime_dir = Path(os.environ["XDG_RUNTIME_DIR"])
+        self.output_file = xdg_runtime_dir / "sway-monitor.prom"
+        # Renamed over the output file, so readers never see a partial file
+        self._temp_file = xdg_runtime_dir / ".sway-monitor.prom.tmp"
+        self._write_handle: Optional[asyncio.TimerHandle] = None
+        self._write_due = 0.0
+
+    def log(self, *args, **kwargs):
+        print("MetricsExporter:", *args, **kwargs, flush=True)
+
+    def commands(self) -> dict[str, Callable]:
+        return {"metrics": self.render, "metrics write": self.write_now}
+
+    def render(self) -> str:
+        return render(self.sources)
+
+    def write(self):
+        with open(self._temp_file, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(self._temp_file, self.output_file)
+
+    def write_now(self) -> dict:
+        """Write the file right away, on request"""
+        self.write()
+        return {"file": str(self.output_file)}
+
+    def _on_change(self):
+        if self._write_handle is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._write_due = loop.time() + self.write_delay
+        self._write_handle = loop.call_at(self._write_due, self._write_later)
+
+    def _write_later(self):
+        self._write_handle = None
+        delay = asyncio.get_running_loop().time() - self._write_due
+        self.metrics.observe("metrics_write_delay_seconds", max(delay, 0))
+        try:
+            self.write()
+        except OSError as e:
+            self.log(f"Failed to write the metrics file: {e}")
+
+    def start(self):
+        for source in self.sources[1:]:
+            source.listeners.append(self._on_change)
+        self._on_change()
+
+    def close(self):
+        for source in self.sources[1:]:
+            source.listeners.remove(self._on_change)
+        if self._write_handle is not None:
+            self._write_handle.cancel()
+            self._write_handle = None
+        # Don't leave stale metrics around
+        try:
+            os.remove(self.output_file)
+        except FileNotFoundError:
+            pass
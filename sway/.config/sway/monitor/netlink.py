@@ -0,0 +1,300 @@
+"""
+Watches rtnetlink for link, address and default route changes. Bursts of
+events (such as the ones caused by a Wi-Fi roam or plugging a cable) are
+collapsed into a single notification, and the current default gateway and
+interface are kept up to date. The routing table is dumped in a worker thread,
+so the event loop never blocks on the kernel.
+"""
+
+
+import asyncio
+import errno
+import socket
+import struct
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional
+
+
+NETLINK_ROUTE = 0
+
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_NEWROUTE = 24
+RTM_DELROUTE = 25
+RTM_GETROUTE = 26
+
+IFLA_WIRELESS = 11
+RTA_OIF = 4
+RTA_GATEWAY = 5
+RTA_PRIORITY = 6
+RTA_TABLE = 15
+RT_TABLE_MAIN = 254
+RTN_UNICAST = 1
+
+IFF_UP = 0x1
+IFF_RUNNING = 0x40
+IFF_LOWER_UP = 0x10000
+
+# len, type, flags, seq, pid
+_NLMSGHDR = struct.Struct("=IHHII")
+# family, type, index, flags, change
+_IFINFOMSG = struct.Struct("=BxHiII")
+# family, dst_len, src_len, tos, table, protocol, scope, type, flags
+_RTMSG = struct.Struct("=BBBBBBBBI")
+# len, type
+_RTATTR = struct.Struct("=HH")
+
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+
+def _parse_messages(data: bytes) -> Iterator[tuple[int, bytes]]:
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, msg_type, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+        if length < _NLMSGHDR.size:
+            return
+        yield msg_type, data[offset + _NLMSGHDR.size:offset + length]
+        offset += _align(length)
+
+
+def _parse_attrs(data: bytes) -> dict[int, bytes]:
+    attrs = {}
+    offset = 0
+    while offset + _RTATTR.size <= len(data):
+        length, attr_type = _RTATTR.unpack_from(data, offset)
+        if length < _RTATTR.size:
+            break
+        attrs[attr_type] = data[offset + _RTATTR.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+@dataclass
+class DefaultRoute:
+    family: int
+    gateway: Optional[str]
+    interface: Optional[str]
+    priority: int
+
+    def __str__(self):
+        if self.gateway and self.interface:
+            return f"{self.gateway} via {self.interface}"
+        return self.gateway or self.interface or "unknown"
+
+
+def _parse_default_route(payload: bytes) -> Optional[DefaultRoute]:
+    """Parse an rtmsg, returning it only if it's a main table default route"""
+    if len(payload) < _RTMSG.size:
+        return None
+    family, dst_len, _, _, table, _, _, route_type, _ = \
+        _RTMSG.unpack_from(payload)
+    attrs = _parse_attrs(payload[_RTMSG.size:])
+    if RTA_TABLE in attrs:
+        table = struct.unpack("=I", attrs[RTA_TABLE][:4])[0]
+    if dst_len != 0 or table != RT_TABLE_MAIN or route_type != RTN_UNICAST:
+        return None
+
+    gateway = None
+    if RTA_GATEWAY in attrs:
+        gateway = socket.inet_ntop(family, attrs[RTA_GATEWAY])
+    interface = None
+    if RTA_OIF in attrs:
+        try:
+            interface = socket.if_indextoname(
+                struct.unpack("=I", attrs[RTA_OIF][:4])[0]
+            )
+        except OSError:
+            # The interface was removed in the meantime
+            pass
+    priority = 0
+    if RTA_PRIORITY in attrs:
+        priority = struct.unpack("=I", attrs[RTA_PRIORITY][:4])[0]
+    return DefaultRoute(family, gateway, interface, priority)
+
+
+def dump_default_route() -> Optional[DefaultRoute]:
+    """
+    Ask the kernel for the routing table and return the preferred default
+    route (IPv4 over IPv6, then the lowest metric).
+    """
+    with socket.socket(
+        socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE
+    ) as sock:
+        request = _NLMSGHDR.pack(
+            _NLMSGHDR.size + _RTMSG.size,
+            RTM_GETROUTE,
+            NLM_F_REQUEST | NLM_F_DUMP,
+            1,
+            0,
+        ) + _RTMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0, 0, 0, 0, 0)
+        sock.sendto(request, (0, 0))
+
+        routes = []
+        while True:
+            data = sock.recv(65536)
+            for msg_type, payload in _parse_messages(data):
+                if msg_type == NLMSG_DONE:
+                    return min(
+                        routes,
+                        key=lambda r: (r.family != socket.AF_INET, r.priority),
+                        default=None,
+                    )
+                if msg_type == NLMSG_ERROR:
+                    error = -struct.unpack_from("=i", payload)[0]
+                    raise OSError(error, "Failed to dump routes")
+                if msg_type == RTM_NEWROUTE:
+                    route = _parse_default_route(payload)
+                    if route is not None:
+                        routes.append(route)
+
+
+class NetlinkWatcher:
+    """
+    Subscribes to rtnetlink multicast groups and calls `on_change` once per
+    burst of relevant events, after `settle_time` seconds.
+    """
+
+    def __init__(
+        self, on_change: Callable[[], None], settle_time: float = 0.5
+    ):
+        self.on_change = on_change
+        self.settle_time = settle_time
+        self.default_route: Optional[DefaultRoute] = None
+        self._sock: Optional[socket.socket] = None
+        self._link_flags: dict[int, int] = {}
+        self._settle_handle: Optional[asyncio.TimerHandle] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def log(self, *args, **kwargs):
+        print("NetlinkWatcher:", *args, **kwargs, flush=True)
+
+    def _subscribe(self):
+        groups = (
+            RTMGRP_LINK
+            | RTMGRP_IPV4_IFADDR
+            | RTMGRP_IPV4_ROUTE
+            | RTMGRP_IPV6_IFADDR
+            | RTMGRP_IPV6_ROUTE
+        )
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        sock.bind((0, groups))
+        sock.setblocking(False)
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._on_readable)
+        self._sock = sock
+
+    def _unsubscribe(self):
+        if self._sock is not None:
+            asyncio.get_running_loop().remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+
+    def start(self):
+        self._subscribe()
+        self._refresh_task = asyncio.create_task(self._refresh(notify=False))
+
+    def close(self):
+        if self._settle_handle is not None:
+            self._settle_handle.cancel()
+            self._settle_handle = None
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        self._unsubscribe()
+
+    def _on_readable(self):
+        while self._sock is not None:
+            try:
+                data = self._sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    self._resubscribe(e)
+                    return
+                # The socket buffer overflowed and events were lost, so
+                # assume something relevant changed
+                self._schedule()
+                continue
+            # Check every message, as link state is tracked along the way
+            relevant = [
+                self._is_relevant(msg_type, payload)
+                for msg_type, payload in _parse_messages(data)
+            ]
+            if any(relevant):
+                self._schedule()
+
+    def _is_relevant(self, msg_type: int, payload: bytes) -> bool:
+        if msg_type == RTM_DELLINK:
+            if len(payload) >= _IFINFOMSG.size:
+                _, _, index, _, _ = _IFINFOMSG.unpack_from(payload)
+                self._link_flags.pop(index, None)
+            return True
+        if msg_type == RTM_NEWLINK:
+            if len(payload) < _IFINFOMSG.size:
+                return False
+            _, _, index, flags, _ = _IFINFOMSG.unpack_from(payload)
+            # Wireless drivers send a lot of link messages carrying wireless
+            # events, only care about the link going up or down
+            if IFLA_WIRELESS in _parse_attrs(payload[_IFINFOMSG.size:]):
+                return False
+            flags &= IFF_UP | IFF_RUNNING | IFF_LOWER_UP
+            previous = self._link_flags.get(index)
+            self._link_flags[index] = flags
+            return previous != flags
+        if msg_type in (RTM_NEWADDR, RTM_DELADDR):
+            return True
+        if msg_type in (RTM_NEWROUTE, RTM_DELROUTE):
+            return _parse_default_route(payload) is not None
+        return False
+
+    def _resubscribe(self, error: OSError):
+        """Start over with a new socket after an unexpected error"""
+        self.log(f"Error reading netlink events, resubscribing: {error}")
+        self._unsubscribe()
+        try:
+            self._subscribe()
+        except OSError as e:
+            self.log(f"Not watching network changes anymore: {e}")
+            return
+        # Events may have been missed meanwhile
+        self._schedule()
+
+    def _schedule(self):
+        if self._settle_handle is None:
+            self._settle_handle = asyncio.get_running_loop().call_later(
+                self.settle_time, self._fire
+            )
+
+    def _fire(self):
+        self._settle_handle = None
+        if self._refresh_task is not None and not self._refresh_task.done():
+            # Still dumping the routes, look again once it's done
+            self._schedule()
+            return
+        self._refresh_task = asyncio.create_task(self._refresh(notify=True))
+
+    async def _refresh(self, notify: bool):
+        loop = asyncio.get_running_loop()
+        try:
+            self.default_route = await loop.run_in_executor(
+                None, dump_default_route
+            )
+        except OSError:
+            self.default_route = None
+        if notify:
+            self.on_change()
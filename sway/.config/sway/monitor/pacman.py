@@ -0,0 +1,477 @@
+"""
+Native implementation of what `checkupdates` does: downloads fresh copies of
+the sync databases into a private directory (never touching pacman's own), and
+compares them against the local package database using pacman's version
+ordering.
+"""
+
+
+import asyncio
+import email.utils
+import glob
+import io
+import os
+import shutil
+import tarfile
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+
+from .inotify import (
+    IN_CLOSE_WRITE,
+    IN_CREATE,
+    IN_DELETE,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    Inotify,
+    InotifyEvent,
+)
+
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def _is_digit(c: str) -> bool:
+    return "0" <= c <= "9"
+
+
+def _is_alpha(c: str) -> bool:
+    return "a" <= c <= "z" or "A" <= c <= "Z"
+
+
+def _is_alnum(c: str) -> bool:
+    return _is_digit(c) or _is_alpha(c)
+
+
+def _rpmvercmp(a: str, b: str) -> int:
+    """Port of libalpm's rpmvercmp, comparing version segment by segment"""
+    if a == b:
+        return 0
+
+    one = two = 0
+    ptr1 = ptr2 = 0
+    while one < len(a) and two < len(b):
+        while one < len(a) and not _is_alnum(a[one]):
+            one += 1
+        while two < len(b) and not _is_alnum(b[two]):
+            two += 1
+        if one >= len(a) or two >= len(b):
+            break
+
+        # If the separator lengths were different, we are also finished
+        if one - ptr1 != two - ptr2:
+            return -1 if one - ptr1 < two - ptr2 else 1
+
+        ptr1, ptr2 = one, two
+        is_num = _is_digit(a[ptr1])
+        is_same_kind = _is_digit if is_num else _is_alpha
+        while ptr1 < len(a) and is_same_kind(a[ptr1]):
+            ptr1 += 1
+        while ptr2 < len(b) and is_same_kind(b[ptr2]):
+            ptr2 += 1
+
+        # Numeric segments are always newer than alpha segments
+        if two == ptr2:
+            return 1 if is_num else -1
+
+        segment1, segment2 = a[one:ptr1], b[two:ptr2]
+        if is_num:
+            segment1 = segment1.lstrip("0")
+            segment2 = segment2.lstrip("0")
+            if len(segment1) != len(segment2):
+                return 1 if len(segment1) > len(segment2) else -1
+        if segment1 != segment2:
+            return 1 if segment1 > segment2 else -1
+
+        one, two = ptr1, ptr2
+
+    if one >= len(a) and two >= len(b):
+        return 0
+
+    # A remaining alpha segment never beats an empty string
+    if (one >= len(a) and not _is_alpha(b[two])) or \
+            (one < len(a) and _is_alpha(a[one])):
+        return -1
+    return 1
+
+
+def _parse_evr(evr: str) -> tuple[str, str, Optional[str]]:
+    """Split epoch:version-release"""
+    epoch_end = 0
+    while epoch_end < len(evr) and _is_digit(evr[epoch_end]):
+        epoch_end += 1
+
+    if evr[epoch_end:epoch_end + 1] == ":":
+        epoch = evr[:epoch_end] or "0"
+        rest = evr[epoch_end + 1:]
+    else:
+        epoch = "0"
+        rest = evr
+
+    version, dash, release = rest.rpartition("-")
+    if not dash:
+        return epoch, rest, None
+    return epoch, version, release
+
+
+def vercmp(a: str, b: str) -> int:
+    """
+    Compare two package versions the same way as pacman's vercmp. Returns a
+    negative number if a is older, 0 if equal and a positive number if a is
+    newer.
+    """
+    if a == b:
+        return 0
+    epoch1, version1, release1 = _parse_evr(a)
+    epoch2, version2, release2 = _parse_evr(b)
+    result = _rpmvercmp(epoch1, epoch2)
+    if result == 0:
+        result = _rpmvercmp(version1, version2)
+        if result == 0 and release1 is not None and release2 is not None:
+            result = _rpmvercmp(release1, release2)
+    return result
+
+
+@dataclass
+class Package:
+    name: str
+    version: str
+    # Compressed package size, only known for sync database packages
+    download_size: int = 0
+
+
+@dataclass
+class PackageUpdate:
+    name: str
+    old_version: str
+    new_version: str
+    download_size: int
+
+
+def _parse_desc(text: str) -> Package:
+    """Parse a database desc file of %FIELD% headers followed by values"""
+    fields: dict[str, str] = {}
+    key = None
+    for line in text.splitlines():
+        if not line:
+            key = None
+        elif line.startswith("%") and line.endswith("%"):
+            key = line[1:-1]
+        elif key is not None and key not in fields:
+            fields[key] = line
+    return Package(
+        name=fields["NAME"],
+        version=fields["VERSION"],
+        download_size=int(fields.get("CSIZE", 0)),
+    )
+
+
+class LocalDb:
+    """
+    The local (installed) package database. Parsed entries are kept between
+    calls, and the directory's mtime is used to only parse entries which were
+    added since.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._mtime_ns: Optional[int] = None
+        self._entries: dict[str, Package] = {}
+        self._packages: dict[str, Package] = {}
+
+    def packages(self) -> dict[str, Package]:
+        # Take the mtime before listing, so a change during the listing is
+        # picked up next time
+        mtime_ns = self.path.stat().st_mtime_ns
+        if mtime_ns == self._mtime_ns:
+            return self._packages
+
+        entries = {
+            entry.name for entry in os.scandir(self.path) if entry.is_dir()
+        }
+        for removed in self._entries.keys() - entries:
+            del self._entries[removed]
+        for added in entries - self._entries.keys():
+            desc = (self.path / added / "desc").read_text(encoding="utf-8")
+            self._entries[added] = _parse_desc(desc)
+
+        self._packages = {
+            package.name: package for package in self._entries.values()
+        }
+        self._mtime_ns = mtime_ns
+        return self._packages
+
+
+def _open_db_tarball(path: Path) -> tarfile.TarFile:
+    data = path.read_bytes()
+    if data.startswith(_ZSTD_MAGIC):
+        try:
+            from compression import zstd
+            data = zstd.decompress(data)
+        except ImportError:
+            try:
+                import zstandard
+            except ImportError:
+                raise RuntimeError(
+                    f"{path.name} is zstd compressed, which requires the "
+                    "zstandard module"
+                )
+            data = zstandard.ZstdDecompressor().decompressobj().decompress(
+                data
+            )
+    return tarfile.open(fileobj=io.BytesIO(data))
+
+
+def parse_sync_db(path: Path) -> dict[str, Package]:
+    """Parse the packages of a sync database tarball"""
+    packages = {}
+    with _open_db_tarball(path) as tar:
+        for member in tar:
+            if not member.isfile() or not member.name.endswith("/desc"):
+                continue
+            desc = tar.extractfile(member).read().decode("utf-8")
+            package = _parse_desc(desc)
+            packages[package.name] = package
+    return packages
+
+
+@dataclass
+class Repo:
+    name: str
+    servers: list[str] = field(default_factory=list)
+
+
+@dataclass
+class PacmanConfig:
+    db_path: Path = Path("/var/lib/pacman")
+    repos: list[Repo] = field(default_factory=list)
+
+    @classmethod
+    def load(cls, path: Path = Path("/etc/pacman.conf")) -> "PacmanConfig":
+        """Parse the repositories (with their servers) of pacman.conf"""
+        config = cls()
+        arch = os.uname().machine
+        section = None
+
+        def parse(path: Path):
+            nonlocal section, arch
+            for line in path.read_text(encoding="utf-8").splitlines():
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                if line.startswith("[") and line.endswith("]"):
+                    section = line[1:-1]
+                    if section != "options":
+                        config.repos.append(Repo(section))
+                    continue
+
+                key, _, value = (part.strip() for part in line.partition("="))
+                if key == "Include":
+                    for include in sorted(glob.glob(value)):
+                        parse(Path(include))
+                elif section == "options":
+                    if key == "DBPath":
+                        config.db_path = Path(value)
+                    elif key == "Architecture" and value != "auto":
+                        arch = value.split()[0]
+                elif key == "Server" and section not in (None, "options"):
+                    config.repos[-1].servers.append(value)
+
+        parse(path)
+        for repo in config.repos:
+            repo.servers = [
+                server.replace("$repo", repo.name).replace("$arch", arch)
+                for server in repo.servers
+            ]
+        return config
+
+
+class ArchUpdateChecker:
+    """
+    Finds pending upgrades of packages installed from the sync repositories.
+    Fresh databases are downloaded to `cache_dir` (conditionally, so unchanged
+    ones are not downloaded again), and parsed databases are kept in memory
+    until their file changes.
+    """
+
+    def __init__(self, config: PacmanConfig, cache_dir: Path):
+        self.config = config
+        self.cache_dir = cache_dir
+        self.local_db = LocalDb(config.db_path / "local")
+        self._sync_dbs: dict[str, tuple[int, dict[str, Package]]] = {}
+
+    async def _download_db(self, session: aiohttp.ClientSession, repo: Repo):
+        """Refresh the cached copy of a repository database from a mirror"""
+        target = self.cache_dir / f"{repo.name}.db"
+        temp = self.cache_dir / f".{repo.name}.db.part"
+        errors = []
+
+        for server in repo.servers:
+            url = f"{server}/{repo.name}.db"
+            try:
+                parsed = urlparse(url)
+                if parsed.scheme == "file":
+                    source = Path(parsed.path)
+                    if target.exists() and \
+                            source.stat().st_mtime <= target.stat().st_mtime:
+                        return
+                    await asyncio.to_thread(shutil.copy2, source, temp)
+                    os.replace(temp, target)
+                    return
+
+                headers = {}
+                if target.exists():
+                    headers["If-Modified-Since"] = email.utils.formatdate(
+                        target.stat().st_mtime, usegmt=True
+                    )
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304:
+                        return
+                    response.raise_for_status()
+                    temp.write_bytes(await response.read())
+                # Keep the server's modification time for the next request
+                last_modified = response.headers.get("Last-Modified")
+                if last_modified:
+                    mtime = email.utils.parsedate_to_datetime(
+                        last_modified
+                    ).timestamp()
+                    os.utime(temp, (mtime, mtime))
+                os.replace(temp, target)
+                return
+            except Exception as e:
+                errors.append(f"{url}: {e}")
+
+        raise RuntimeError(
+            f"Failed to download {repo.name} database:\n" + "\n".join(errors)
+        )
+
+    def _sync_packages(self, repo: Repo) -> dict[str, Package]:
+        path = self.cache_dir / f"{repo.name}.db"
+        mtime_ns = path.stat().st_mtime_ns
+        cached = self._sync_dbs.get(repo.name)
+        if cached is None or cached[0] != mtime_ns:
+            cached = (mtime_ns, parse_sync_db(path))
+            self._sync_dbs[repo.name] = cached
+        return cached[1]
+
+    def _compute_updates(self) -> list[PackageUpdate]:
+        sync_dbs = [self._sync_packages(repo) for repo in self.config.repos]
+        updates = []
+        for name, local in sorted(self.local_db.packages().items()):
+            # Like pacman, the first repository with the package wins
+            sync = next((db[name] for db in sync_dbs if name in db), None)
+            if sync is not None and vercmp(sync.version, local.version) > 0:
+                updates.append(PackageUpdate(
+                    name=name,
+                    old_version=local.version,
+                    new_version=sync.version,
+                    download_size=sync.download_size,
+                ))
+        return updates
+
+    def foreign_packages(self) -> dict[str, Package]:
+        """
+        Installed packages which are not in any sync database (such as AUR
+        packages). Uses the databases downloaded by the last check.
+        """
+        sync_dbs = [self._sync_packages(repo) for repo in self.config.repos]
+        return {
+            name: package
+            for name, package in self.local_db.packages().items()
+            if not any(name in db for db in sync_dbs)
+        }
+
+    def recount(self) -> list[PackageUpdate]:
+        """
+        Recalculate the pending upgrades against the already downloaded
+        databases, e.g. after packages were installed. Only new local database
+        entries are parsed.
+        """
+        return self._compute_updates()
+
+    async def check(
+        self, session: aiohttp.ClientSession
+    ) -> list[PackageUpdate]:
+        """Refresh the sync databases and return the pending upgrades"""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        await asyncio.gather(
+            *(self._download_db(session, repo) for repo in self.config.repos)
+        )
+        # Parsing is CPU bound, keep it away from the event loop
+        return await asyncio.to_thread(self._compute_updates)
+
+
+class PacmanDbWatcher:
+    """
+    Watches pacman's database directory for transactions. A burst of changes is
+    collapsed into a single `on_change` call, made once pacman's lock file is
+    released. `on_change` gets whether the sync databases changed (so fresh
+    ones should be downloaded) or only the installed packages.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        on_change: Callable[[bool], None],
+        settle_time: float = 0.5,
+    ):
+        self.db_path = db_path
+        self.on_change = on_change
+        self.settle_time = settle_time
+        self._inotify = Inotify(self._on_event)
+        self._local_changed = False
+        self._sync_changed = False
+        self._settle_handle: Optional[asyncio.TimerHandle] = None
+
+    def start(self):
+        self._inotify.start()
+        # For the lock file
+        self._inotify.add_watch(self.db_path, IN_CREATE | IN_DELETE)
+        self._inotify.add_watch(
+            self.db_path / "local",
+            IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO,
+        )
+        self._inotify.add_watch(
+            self.db_path / "sync", IN_CLOSE_WRITE | IN_MOVED_TO
+        )
+
+    def close(self):
+        if self._settle_handle is not None:
+            self._settle_handle.cancel()
+            self._settle_handle = None
+        self._inotify.close()
+
+    def _on_event(self, event: InotifyEvent):
+        if event.path is None:
+            # Events were lost, assume everything changed
+            self._local_changed = self._sync_changed = True
+        elif event.path == self.db_path:
+            if event.name != "db.lck":
+                return
+        elif event.path.name == "sync":
+            if not event.name.endswith(".db"):
+                return
+            self._sync_changed = True
+        else:
+            self._local_changed = True
+
+        # Wait until the burst of changes is over
+        if self._settle_handle is not None:
+            self._settle_handle.cancel()
+        self._settle_handle = asyncio.get_running_loop().call_later(
+            self.settle_time, self._fire
+        )
+
+    def _fire(self):
+        self._settle_handle = None
+        # Still in a transaction, the lock's deletion will schedule again
+        if (self.db_path / "db.lck").exists():
+            return
+        if not (self._local_changed or self._sync_changed):
+            return
+        sync_changed = self._sync_changed
+        self._local_changed = self._sync_changed = False
+        self.on_change(sync_changed)
@@ -0,0 +1,293 @@
+"""
+Power and suspend state shared by the monitors, so they can check less often
+on battery and catch up right after resuming:
+- Whether the system runs on battery is read from /sys/class/power_supply,
+  re-read whenever the kernel sends a power supply uevent
+- logind's PrepareForSleep signal tells when the system is about to suspend
+  and when it resumed. Listening to it requires jeepney (python-jeepney),
+  without it suspend is not noticed. A delay inhibitor lock is held while
+  awake, so logind waits for the monitors to handle the signal (or the lock
+  timeout) before suspending
+
+Monitors subscribe to the events and apply their own profile for each power
+source. Timing which must include the time spent suspended (the monotonic
+clock of the event loop stops meanwhile) can use `boottime()`.
+"""
+
+
+import asyncio
+import errno
+import os
+import socket
+import time
+from enum import Enum
+from pathlib import Path
+from typing import Callable, Optional
+
+
+NETLINK_KOBJECT_UEVENT = 15
+# Multicast group of the uevents sent by the kernel (as opposed to udev)
+UEVENT_KERNEL_GROUP = 1
+
+LOGIND_BUS_NAME = "org.freedesktop.login1"
+LOGIND_PATH = "/org/freedesktop/login1"
+LOGIND_MANAGER_INTERFACE = "org.freedesktop.login1.Manager"
+
+
+class PowerProfile(Enum):
+    AC = "ac"
+    BATTERY = "battery"
+
+
+class PowerEvent(Enum):
+    # Switched between AC and battery
+    POWER_CHANGED = "power_changed"
+    # The system is about to suspend
+    SUSPENDING = "suspending"
+    # The system resumed from suspend
+    RESUMED = "resumed"
+
+
+def boottime() -> float:
+    """Monotonic time in seconds which keeps counting while suspended"""
+    return time.clock_gettime(time.CLOCK_BOOTTIME)
+
+
+def _read_attribute(path: Path) -> Optional[str]:
+    try:
+        return path.read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+
+
+def read_power_profile(sysfs_path: Path) -> PowerProfile:
+    """
+    The system is on battery if a system battery is discharging and no
+    external supply (mains, USB...) is online
+    """
+    discharging = False
+    try:
+        supplies = list(sysfs_path.iterdir())
+    except FileNotFoundError:
+        return PowerProfile.AC
+    for supply in supplies:
+        if _read_attribute(supply / "type") == "Battery":
+            # Batteries of peripherals, such as mice, have the device scope
+            if _read_attribute(supply / "scope") != "Device" and \
+                    _read_attribute(supply / "status") == "Discharging":
+                discharging = True
+        elif _read_attribute(supply / "online") == "1":
+            return PowerProfile.AC
+    return PowerProfile.BATTERY if discharging else PowerProfile.AC
+
+
+def take_sleep_lock(bus: str) -> int:
+    """
+    Take a delay inhibitor lock on sleep from logind, returning its file
+    descriptor. Closing it releases the lock. Blocking, as jeepney's asyncio
+    connections can't receive file descriptors
+    """
+    from jeepney import DBusAddress, new_method_call
+    from jeepney.io.blocking import open_dbus_connection
+    from jeepney.wrappers import unwrap_msg
+
+    logind = DBusAddress(
+        LOGIND_PATH,
+        bus_name=LOGIND_BUS_NAME,
+        interface=LOGIND_MANAGER_INTERFACE,
+    )
+    message = new_method_call(
+        logind,
+        "Inhibit",
+        "ssss",
+        ("sleep", "sway-monitor", "Pausing the monitors", "delay"),
+    )
+    with open_dbus_connection(bus, enable_fds=True) as connection:
+        reply = connection.send_and_get_reply(message, timeout=5)
+    (lock,) = unwrap_msg(reply)
+    return lock.to_raw_fd()
+
+
+class PowerContext:
+    def __init__(
+        self,
+        sysfs_path: Path = Path("/sys/class/power_supply"),
+        bus: str = "SYSTEM",
+    ):
+        self.sysfs_path = sysfs_path
+        # The D-Bus bus of logind, can be the address of a private bus
+        self.bus = bus
+        self.profile = PowerProfile.AC
+        self.suspending = False
+        self._awake = asyncio.Event()
+        self._awake.set()
+        self._listeners: list[Callable[[PowerEvent], None]] = []
+        self._sock: Optional[socket.socket] = None
+        self._logind_task: Optional[asyncio.Task] = None
+        # File descriptor of the sleep delay lock, while held
+        self._sleep_lock: Optional[int] = None
+
+    def log(self, *args, **kwargs):
+        print("PowerContext:", *args, **kwargs, flush=True)
+
+    def subscribe(self, listener: Callable[[PowerEvent], None]):
+        self._listeners.append(listener)
+
+    def status(self) -> dict:
+        return {
+            "profile": self.profile.value,
+            "suspending": self.suspending,
+            "watching_uevents": self._sock is not None,
+            "watching_logind": (
+                self._logind_task is not None and not self._logind_task.done()
+            ),
+            "delaying_sleep": self._sleep_lock is not None,
+        }
+
+    async def wait_awake(self):
+        """Wait until the system resumed, if it's suspending"""
+        await self._awake.wait()
+
+    def _notify(self, event: PowerEvent):
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                self.log(f"Error handling {event.value}: {e}")
+
+    def refresh(self):
+        """Re-read the power supplies, notifying if the profile changed"""
+        profile = read_power_profile(self.sysfs_path)
+        if profile == self.profile:
+            return
+        self.profile = profile
+        self.log(f"Running on {profile.value}")
+        self._notify(PowerEvent.POWER_CHANGED)
+
+    def _set_suspending(self, suspending: bool):
+        if suspending == self.suspending:
+            return
+        self.suspending = suspending
+        if suspending:
+            self.log("Suspending")
+            self._awake.clear()
+            self._notify(PowerEvent.SUSPENDING)
+        else:
+            self.log("Resumed")
+            self._awake.set()
+            # The power source may have changed while suspended
+            self.refresh()
+            self._notify(PowerEvent.RESUMED)
+
+    def _subscribe(self):
+        try:
+            sock = socket.socket(
+                socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT
+            )
+            sock.bind((0, UEVENT_KERNEL_GROUP))
+            sock.setblocking(False)
+            asyncio.get_running_loop().add_reader(
+                sock.fileno(), self._on_readable
+            )
+            self._sock = sock
+        except OSError as e:
+            self.log(f"Not watching power supply changes: {e}")
+
+    def _unsubscribe(self):
+        if self._sock is not None:
+            asyncio.get_running_loop().remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+
+    async def start(self):
+        self.refresh()
+        self._subscribe()
+        self._logind_task = asyncio.create_task(self._watch_logind())
+
+    async def close(self):
+        self._unsubscribe()
+        if self._logind_task is not None:
+            self._logind_task.cancel()
+            try:
+                await self._logind_task
+            except asyncio.CancelledError:
+                pass
+            self._logind_task = None
+
+    def _on_readable(self):
+        changed = False
+        while self._sock is not None:
+            try:
+                data = self._sock.recv(8192)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                if e.errno != errno.ENOBUFS:
+                    # Start over with a new socket, events may have been
+                    # missed meanwhile
+                    self.log(f"Error reading uevents, resubscribing: {e}")
+                    self._unsubscribe()
+                    self._subscribe()
+                    changed = True
+                    break
+                # The socket buffer overflowed and events were lost, so
+                # assume they were relevant
+                changed = True
+                continue
+            # "ACTION@DEVPATH\0KEY=VALUE\0..."
+            if b"\0SUBSYSTEM=power_supply\0" in data:
+                changed = True
+        if changed:
+            self.refresh()
+
+    async def _take_sleep_lock(self):
+        if self._sleep_lock is not None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            self._sleep_lock = await loop.run_in_executor(
+                None, take_sleep_lock, self.bus
+            )
+        except Exception as e:
+            self.log(f"Not delaying suspend: {e}")
+
+    def _release_sleep_lock(self):
+        if self._sleep_lock is not None:
+            os.close(self._sleep_lock)
+            self._sleep_lock = None
+
+    async def _watch_logind(self):
+        try:
+            from jeepney import MatchRule, message_bus
+            from jeepney.io.asyncio import Proxy, open_dbus_router
+
+            # Not matching the sender, as signals come from logind's unique
+            # name instead of org.freedesktop.login1
+            rule = MatchRule(
+                type="signal",
+                interface=LOGIND_MANAGER_INTERFACE,
+                member="PrepareForSleep",
+                path=LOGIND_PATH,
+            )
+            async with open_dbus_router(self.bus) as router:
+                await Proxy(message_bus, router).AddMatch(rule)
+                with router.filter(rule, bufsize=0) as signals:
+                    # Only once the signal would be received
+                    await self._take_sleep_lock()
+                    while True:
+                        message = await signals.get()
+                        (suspending,) = message.body
+                        self._set_suspending(suspending)
+                        if suspending:
+                            # Let the tasks woken by the listeners run,
+                            # then let the system suspend
+                            await asyncio.sleep(0)
+                            self._release_sleep_lock()
+                        else:
+                            await self._take_sleep_lock()
+        except Exception as e:
+            self.log(f"Not watching suspend and resume: {e}")
+        finally:
+            self._release_sleep_lock()
+            # Never stay paused without a way to notice resuming
+            self._set_suspending(False)
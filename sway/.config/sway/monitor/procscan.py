@@ -0,0 +1,153 @@
+"""
+Finds running processes which still map files that were deleted, usually
+libraries or executables replaced by an upgrade, so the processes have to be
+restarted to use the new versions. Results are remembered per process (keyed by
+its start time, so reused PIDs are noticed), so a re-scan only reads the
+processes which started since the last one.
+"""
+
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+
+# Only files from packages matter, not e.g. deleted temporary files
+PACKAGE_PREFIXES = ("/usr/", "/opt/")
+_DELETED = b" (deleted)"
+
+
+@dataclass
+class StaleProcess:
+    pid: int
+    name: str
+    # The systemd service the process belongs to, if any
+    service: Optional[str]
+    files: list[str]
+
+
+def _start_time(stat: bytes) -> int:
+    # The name in parentheses may contain spaces, fields are counted after it
+    fields = stat[stat.rindex(b")") + 2:].split()
+    return int(fields[19])
+
+
+def _service(cgroup: str) -> Optional[str]:
+    for line in cgroup.splitlines():
+        # The unified hierarchy, e.g. 0::/system.slice/sshd.service
+        if line.startswith("0::"):
+            # Only the leaf: the processes of an app scope such as
+            # user@1000.service/app.slice/app-foo.scope are not part of the
+            # services above it
+            leaf = line[3:].rstrip("/").rsplit("/", 1)[-1]
+            if leaf.endswith(".service"):
+                return leaf
+    return None
+
+
+def _deleted_files(maps: bytes) -> list[str]:
+    files = set()
+    for line in maps.splitlines():
+        if not line.endswith(_DELETED):
+            continue
+        # address perms offset dev inode path
+        path = line.split(None, 5)[-1][:-len(_DELETED)].decode(
+            "utf-8", "replace"
+        )
+        if path.startswith(PACKAGE_PREFIXES):
+            files.add(path)
+    return sorted(files)
+
+
+class DeletedMappingScanner:
+    def __init__(
+        self,
+        proc_path: Path = Path("/proc"),
+        batch_size: int = 64,
+        workers: int = 4,
+    ):
+        self.proc_path = proc_path
+        self.batch_size = batch_size
+        self.workers = workers
+        # pid -> (start time, result), None if the process is up to date
+        self._results: dict[int, tuple[int, Optional[StaleProcess]]] = {}
+        self.processes_scanned = 0
+
+    def invalidate(self):
+        """
+        Scan the processes which were up to date again, e.g. after an upgrade
+        deleted files they may be using. Stale processes stay stale.
+        """
+        self._results = {
+            pid: (start_time, stale)
+            for pid, (start_time, stale) in self._results.items()
+            if stale is not None
+        }
+
+    def _read(self, pid: int, known_start_time: Optional[int]):
+        """
+        Scan a process, returning None if it is gone or the cached result is
+        still valid
+        """
+        path = self.proc_path / str(pid)
+        try:
+            with open(path / "stat", "rb") as f:
+                start_time = _start_time(f.read())
+            if start_time == known_start_time:
+                return None
+            with open(path / "maps", "rb") as f:
+                maps = f.read()
+        except (FileNotFoundError, ProcessLookupError):
+            return None
+        except PermissionError:
+            # Processes of other users can't be inspected
+            return pid, start_time, None
+
+        files = _deleted_files(maps) if _DELETED in maps else []
+        if not files:
+            return pid, start_time, None
+        try:
+            name = (path / "comm").read_text().strip()
+            service = _service((path / "cgroup").read_text())
+        except OSError:
+            return None
+        return pid, start_time, StaleProcess(pid, name, service, files)
+
+    def _read_batch(self, pids: list[int]) -> list:
+        results = []
+        for pid in pids:
+            known = self._results.get(pid)
+            result = self._read(pid, known[0] if known else None)
+            if result is not None:
+                results.append(result)
+        return results
+
+    def scan(self) -> list[StaleProcess]:
+        """Return the processes which use deleted files, sorted by PID"""
+        pids = [
+            int(entry.name)
+            for entry in os.scandir(self.proc_path)
+            if entry.name.isdigit()
+        ]
+        running = set(pids)
+        for pid in self._results.keys() - running:
+            del self._results[pid]
+
+        # A cached PID still needs its start time read, in case it was reused
+        batches = [
+            pids[start:start + self.batch_size]
+            for start in range(0, len(pids), self.batch_size)
+        ]
+        with ThreadPoolExecutor(self.workers) as executor:
+            for results in executor.map(self._read_batch, batches):
+                for pid, start_time, stale in results:
+                    self._results[pid] = (start_time, stale)
+                    self.processes_scanned += 1
+
+        return [
+            stale
+            for _, (_, stale) in sorted(self._results.items())
+            if stale is not None
+        ]
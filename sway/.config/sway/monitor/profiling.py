@@ -0,0 +1,165 @@
+"""
+On-demand diagnostics of the running daemon, triggered through the control
+socket (see ctl.py):
+- `profile start [seconds]` runs cProfile on the event loop for a while (or
+  until `profile stop`) and dumps the pstats
+- `memory snapshot` takes a tracemalloc snapshot and writes its difference
+  against the previous one. Tracing starts with the first snapshot and lasts
+  until `memory stop`
+- `tasks` dumps the stacks of all asyncio tasks
+
+Nothing is enabled until requested, so there's no overhead otherwise. Output
+goes to timestamped files in $XDG_RUNTIME_DIR, whose paths are returned.
+"""
+
+
+import asyncio
+import cProfile
+import os
+import pstats
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+
+class Profiler:
+    def __init__(
+        self,
+        default_seconds: float = 30,
+        traceback_frames: int = 10,
+        top_lines: int = 50,
+    ):
+        self.default_seconds = default_seconds
+        # Frames kept per allocation while tracing memory, more frames cost
+        # more
+        self.traceback_frames = traceback_frames
+        # Lines shown in the text reports
+        self.top_lines = top_lines
+        self.output_dir = Path(os.environ["XDG_RUNTIME_DIR"])
+
+        self._profile: Optional[cProfile.Profile] = None
+        self._profile_path: Optional[Path] = None
+        self._stop_handle: Optional[asyncio.TimerHandle] = None
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+
+    def log(self, *args, **kwargs):
+        print("Profiler:", *args, **kwargs, flush=True)
+
+    def commands(self) -> dict[str, Callable]:
+        return {
+            "profile start": self.start_profile,
+            "profile stop": self.stop_profile,
+            "memory snapshot": self.memory_snapshot,
+            "memory stop": self.stop_memory,
+            "tasks": self.dump_tasks,
+        }
+
+    def _output_path(self, kind: str, suffix: str) -> Path:
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        return self.output_dir / f"sway-monitor-{kind}-{timestamp}{suffix}"
+
+    def start_profile(self, seconds: Optional[str] = None) -> dict:
+        """Profile the event loop for some seconds, then dump the stats"""
+        if self._profile is not None:
+            raise RuntimeError(f"Already profiling into {self._profile_path}")
+        duration = float(seconds) if seconds else self.default_seconds
+        if duration <= 0:
+            raise ValueError("The duration must be positive")
+
+        profile = cProfile.Profile()
+        profile.enable()
+        self._profile = profile
+        self._profile_path = self._output_path("profile", ".pstats")
+        self._stop_handle = asyncio.get_running_loop().call_later(
+            duration, self._stop_profile_logging_errors
+        )
+        self.log(f"Profiling for {duration:g}s")
+        return {"seconds": duration, "file": str(self._profile_path)}
+
+    def stop_profile(self) -> dict:
+        """Stop profiling now, dumping the stats"""
+        if self._profile is None:
+            raise RuntimeError("Not profiling")
+        profile, path = self._profile, self._profile_path
+        profile.disable()
+        self._profile = self._profile_path = None
+        if self._stop_handle is not None:
+            self._stop_handle.cancel()
+            self._stop_handle = None
+
+        # The binary stats for pstats or snakeviz, and a readable summary
+        profile.dump_stats(path)
+        summary_path = path.with_suffix(".txt")
+        with open(summary_path, "w", encoding="utf-8") as f:
+            stats = pstats.Stats(profile, stream=f)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE)
+            stats.print_stats(self.top_lines)
+        self.log(f"Profile written to {path}")
+        return {"file": str(path), "summary": str(summary_path)}
+
+    def _stop_profile_logging_errors(self):
+        self._stop_handle = None
+        try:
+            self.stop_profile()
+        except Exception as e:
+            self.log(f"Failed to write the profile: {e}")
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        # Leave out the allocations of tracemalloc itself
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+
+    def memory_snapshot(self) -> dict:
+        """
+        Write the difference of a new snapshot against the previous one. The
+        first one only starts tracing, as earlier allocations are unknown.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.traceback_frames)
+            self._snapshot = self._take_snapshot()
+            self.log("Started tracing memory allocations")
+            return {"tracing": True, "file": None}
+
+        snapshot = self._take_snapshot()
+        previous, self._snapshot = self._snapshot, snapshot
+        differences = snapshot.compare_to(previous, "lineno")
+        current, peak = tracemalloc.get_traced_memory()
+
+        path = self._output_path("memory", ".txt")
+        with open(path, "w", encoding="utf-8") as f:
+            growth = sum(difference.size_diff for difference in differences)
+            f.write(
+                f"Traced: {current / 1024:.1f} KiB (peak {peak / 1024:.1f} "
+                f"KiB), {growth / 1024:+.1f} KiB since the last snapshot\n\n"
+            )
+            f.write(f"Top {self.top_lines} differences by line:\n")
+            for difference in differences[:self.top_lines]:
+                f.write(f"{difference}\n")
+
+            # Where the largest growth came from
+            if differences and differences[0].size_diff > 0:
+                f.write("\nTraceback of the largest growth:\n")
+                f.write("\n".join(differences[0].traceback.format()) + "\n")
+        self.log(f"Memory snapshot difference written to {path}")
+        return {"tracing": True, "file": str(path)}
+
+    def stop_memory(self) -> dict:
+        """Stop tracing memory allocations, which frees the traces"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("Not tracing memory allocations")
+        tracemalloc.stop()
+        self._snapshot = None
+        self.log("Stopped tracing memory allocations")
+        return {"tracing": False}
+
+    def dump_tasks(self) -> dict:
+        """Write the stacks of all asyncio tasks"""
+        tasks = sorted(asyncio.all_tasks(), key=lambda task: task.get_name())
+        path = self._output_path("tasks", ".txt")
+        with open(path, "w", encoding="utf-8") as f:
+            for task in tasks:
+                task.print_stack(file=f)
+                f.write("\n")
+        return {"tasks": len(tasks), "file": str(path)}
@@ -0,0 +1,512 @@
+"""
+Checks whether a reboot is needed, either because a new kernel or new
+processor microcode was installed. The running versions are read from /proc
+and compared to the installed kernel images and microcode files, which are
+watched with inotify so the check runs again as soon as they change. Also lists
+the programs which need a restart because they use deleted files (see
+procscan.py).
+"""
+
+
+import asyncio
+import functools
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from .base_monitor import BaseMonitor
+from .inotify import (
+    IN_CLOSE_WRITE,
+    IN_CREATE,
+    IN_DELETE,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    Inotify,
+    InotifyEvent,
+)
+from .pacman import PacmanConfig, PacmanDbWatcher, vercmp
+from .power import PowerProfile
+from .procscan import DeletedMappingScanner, StaleProcess
+from .supervisor import register
+
+
+MODULES_PATH = Path("/usr/lib/modules")
+# Early microcode images loaded by the boot loader, and the firmware files
+# the kernel can load late
+MICROCODE_PATHS = {
+    "GenuineIntel": [
+        Path("/boot/intel-ucode.img"),
+        Path("/usr/lib/firmware/intel-ucode"),
+    ],
+    "AuthenticAMD": [
+        Path("/boot/amd-ucode.img"),
+        Path("/usr/lib/firmware/amd-ucode"),
+    ],
+}
+
+# Platform of Intel processors, as a bit to match against the processor flags
+# mask of the updates
+PROCESSOR_FLAGS_PATH = Path(
+    "/sys/devices/system/cpu/cpu0/microcode/processor_flags"
+)
+
+_AMD_CONTAINER_MAGIC = 0x00414D44
+_AMD_EQUIVALENCE_TABLE = 0
+_AMD_PATCH = 1
+_AMD_EQUIVALENCE_ENTRY = struct.Struct("<IIIHH")
+# header version, revision, date, signature, checksum, loader version,
+# processor flags, data size, total size
+_INTEL_HEADER = struct.Struct("<IiIIIIIII")
+_INTEL_HEADER_SIZE = 48
+
+
+@dataclass
+class VersionCheck:
+    current: str
+    new: str
+
+
+def _kernel_image_version(image: Path) -> Optional[str]:
+    """
+    The version string embedded in a bzImage, e.g.
+    "6.9.7-arch1-1 (linux@archlinux) #1 SMP PREEMPT_DYNAMIC Fri, 28 Jun 2024"
+    """
+    with open(image, "rb") as f:
+        header = f.read(0x210)
+        if len(header) < 0x210 or header[0x202:0x206] != b"HdrS":
+            return None
+        (offset,) = struct.unpack_from("<H", header, 0x20E)
+        f.seek(offset + 0x200)
+        version = f.read(256).split(b"\0", 1)[0]
+    return version.decode("utf-8", "replace")
+
+
+def _kernel_flavor(release: str) -> str:
+    """E.g. "lts" for 6.6.36-1-lts, empty for 6.9.7-arch1-1"""
+    suffix = release.rsplit("-", 1)[-1]
+    return "" if suffix.isdigit() else suffix
+
+
+def check_kernel(modules_path: Path = MODULES_PATH) -> Optional[VersionCheck]:
+    """Return the running and the newly installed kernel if they differ"""
+    release = Path("/proc/sys/kernel/osrelease").read_text().strip()
+    build = Path("/proc/sys/kernel/version").read_text().strip()
+
+    image = modules_path / release / "vmlinuz"
+    if image.exists():
+        # Same release, but it could have been rebuilt
+        image_version = _kernel_image_version(image)
+        if image_version is None or image_version.endswith(build):
+            return None
+        return VersionCheck(f"{release} {build}", image_version)
+
+    installed = [
+        path.name
+        for path in modules_path.iterdir()
+        if (path / "vmlinuz").exists()
+    ]
+    if not installed:
+        raise RuntimeError(f"No kernel images found in {modules_path}")
+    flavor = _kernel_flavor(release)
+    candidates = [
+        version for version in installed if _kernel_flavor(version) == flavor
+    ] or installed
+    newest = max(candidates, key=functools.cmp_to_key(vercmp))
+    return VersionCheck(release, newest)
+
+
+@dataclass
+class CpuInfo:
+    vendor: str
+    # CPUID signature, as used by the microcode files
+    signature: int
+    microcode: int
+    # Intel only, None if unknown
+    processor_flags: Optional[int] = None
+
+
+def _read_processor_flags() -> Optional[int]:
+    try:
+        return int(PROCESSOR_FLAGS_PATH.read_text(), 16)
+    except (OSError, ValueError):
+        return None
+
+
+def read_cpu_info() -> Optional[CpuInfo]:
+    """The first processor of /proc/cpuinfo, None if it has no microcode"""
+    fields = {}
+    with open("/proc/cpuinfo") as f:
+        for line in f:
+            if not line.strip():
+                break
+            key, _, value = line.partition(":")
+            fields[key.strip()] = value.strip()
+    if "microcode" not in fields:
+        return None
+
+    vendor = fields["vendor_id"]
+    family = int(fields["cpu family"])
+    model = int(fields["model"])
+    stepping = int(fields["stepping"])
+
+    # Undo the way the kernel combines the base and extended fields
+    base_family = min(family, 0xF)
+    extended_family = family - base_family
+    extended_model = 0
+    if base_family == 0xF or (vendor == "GenuineIntel" and base_family == 6):
+        extended_model = model >> 4
+        model &= 0xF
+    signature = (
+        extended_family << 20
+        | extended_model << 16
+        | base_family << 8
+        | model << 4
+        | stepping
+    )
+    processor_flags = None
+    if vendor == "GenuineIntel":
+        processor_flags = _read_processor_flags()
+    return CpuInfo(
+        vendor, signature, int(fields["microcode"], 16), processor_flags
+    )
+
+
+def _align4(offset: int) -> int:
+    return (offset + 3) & ~3
+
+
+def _cpio_files(data: bytes) -> Iterator[tuple[str, bytes]]:
+    """Files of a (possibly concatenated) newc cpio archive"""
+    offset = 0
+    while offset + 110 <= len(data):
+        magic = data[offset:offset + 6]
+        if magic not in (b"070701", b"070702"):
+            # Archives may be separated by padding
+            if data[offset:offset + 4] == b"\0\0\0\0":
+                offset += 4
+                continue
+            break
+        fields = [
+            int(data[offset + 6 + i * 8:offset + 14 + i * 8], 16)
+            for i in range(13)
+        ]
+        file_size, name_size = fields[6], fields[11]
+        name_start = offset + 110
+        name = data[name_start:name_start + name_size - 1].decode()
+        data_start = _align4(name_start + name_size)
+        offset = _align4(data_start + file_size)
+        if name != "TRAILER!!!":
+            yield name, data[data_start:data_start + file_size]
+
+
+def _intel_revision(
+    data: bytes, signature: int, processor_flags: Optional[int] = None
+) -> Optional[int]:
+    """
+    Newest revision for the signature and platform in a file of Intel
+    updates. Updates for other platforms of the same signature are skipped,
+    unless the platform is unknown
+    """
+    best = None
+    offset = 0
+    while offset + _INTEL_HEADER_SIZE <= len(data):
+        (
+            header_version, revision, _, update_signature, _, _,
+            update_flags, data_size, total_size,
+        ) = _INTEL_HEADER.unpack_from(data, offset)
+        if header_version != 1:
+            break
+        data_size = data_size or 2000
+        total_size = total_size or 2048
+
+        # (signature, processor flags) pairs the update applies to
+        targets = [(update_signature, update_flags)]
+        # Optional extended signature table after the data, 20 bytes of
+        # header then 12 bytes per signature, flags and checksum
+        extended = offset + _INTEL_HEADER_SIZE + data_size
+        if total_size > _INTEL_HEADER_SIZE + data_size:
+            (count,) = struct.unpack_from("<I", data, extended)
+            targets += [
+                struct.unpack_from("<II", data, extended + 20 + i * 12)
+                for i in range(count)
+            ]
+
+        matches = any(
+            target_signature == signature
+            and (processor_flags is None or target_flags & processor_flags)
+            for target_signature, target_flags in targets
+        )
+        if matches and (best is None or revision > best):
+            best = revision
+        offset += total_size
+    return best
+
+
+def _amd_revision(data: bytes, signature: int) -> Optional[int]:
+    """Newest revision for the signature in a file of AMD containers"""
+    best = None
+    offset = 0
+    while offset + 12 <= len(data):
+        magic, section, size = struct.unpack_from("<III", data, offset)
+        if magic != _AMD_CONTAINER_MAGIC or section != _AMD_EQUIVALENCE_TABLE:
+            break
+        # Patches refer to processors by an equivalence ID
+        equivalent_id = None
+        table = data[offset + 12:offset + 12 + size]
+        for entry in range(0, len(table), _AMD_EQUIVALENCE_ENTRY.size):
+            installed_cpu, _, _, equivalence, _ = \
+                _AMD_EQUIVALENCE_ENTRY.unpack_from(table, entry)
+            if installed_cpu == signature:
+                equivalent_id = equivalence
+        offset += 12 + size
+
+        # Patches up to the next container
+        while offset + 8 <= len(data):
+            section, size = struct.unpack_from("<II", data, offset)
+            if section != _AMD_PATCH:
+                break
+            (revision,) = struct.unpack_from("<I", data, offset + 12)
+            (processor_id,) = struct.unpack_from("<H", data, offset + 32)
+            if equivalent_id is not None and processor_id == equivalent_id \
+                    and (best is None or revision > best):
+                best = revision
+            offset += 8 + size
+    return best
+
+
+def _microcode_files(path: Path) -> Iterator[bytes]:
+    if path.is_dir():
+        for file in sorted(path.iterdir()):
+            if file.is_file():
+                yield file.read_bytes()
+    elif path.suffix == ".img":
+        for name, data in _cpio_files(path.read_bytes()):
+            if name.startswith("kernel/x86/microcode/"):
+                yield data
+
+
+def check_microcode(
+    microcode_paths: dict[str, list[Path]] = MICROCODE_PATHS,
+) -> Optional[VersionCheck]:
+    """Return the loaded and the newest installed microcode if it's newer"""
+    cpu = read_cpu_info()
+    if cpu is None or cpu.vendor not in microcode_paths:
+        return None
+
+    def find_revision(data: bytes) -> Optional[int]:
+        if cpu.vendor == "GenuineIntel":
+            return _intel_revision(data, cpu.signature, cpu.processor_flags)
+        return _amd_revision(data, cpu.signature)
+
+    newest = None
+    for path in microcode_paths[cpu.vendor]:
+        if not path.exists():
+            continue
+        for data in _microcode_files(path):
+            revision = find_revision(data)
+            if revision is not None and (newest is None or revision > newest):
+                newest = revision
+
+    if newest is None or newest <= cpu.microcode:
+        return None
+    return VersionCheck(hex(cpu.microcode), hex(newest))
+
+
+@register("reboot")
+class RebootMonitor(BaseMonitor):
+    def __init__(self, settle_time: float = 1):
+        super().__init__("reboot", "needreboot_monitor.json")
+        self.settle_time = settle_time
+        self.check_event = asyncio.Event()
+        self.process_scanner = DeletedMappingScanner()
+        # Processes are re-scanned this often to drop the ones which exited or
+        # were restarted, on AC and on battery (seconds)
+        self.process_scan_intervals = {
+            PowerProfile.AC: 300,
+            PowerProfile.BATTERY: 1800,
+        }
+        self.db_watcher: Optional[PacmanDbWatcher] = None
+        self._inotify = Inotify(self._on_event)
+        self._settle_handle: Optional[asyncio.TimerHandle] = None
+        self._kernel: Optional[VersionCheck] = None
+        self._microcode: Optional[VersionCheck] = None
+        self._stale_processes: list[StaleProcess] = []
+
+    def commands(self) -> dict[str, Callable]:
+        return {"recheck": self.request_check}
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["processes_scanned"] = self.process_scanner.processes_scanned
+        stats["stale_processes"] = [
+            {
+                "pid": process.pid,
+                "name": process.name,
+                "service": process.service,
+                "files": process.files,
+            }
+            for process in self._stale_processes
+        ]
+        return stats
+
+    def request_check(self):
+        self.check_event.set()
+
+    def _on_event(self, event: InotifyEvent):
+        # Wait until the package manager is done with the files
+        if self._settle_handle is not None:
+            self._settle_handle.cancel()
+        self._settle_handle = asyncio.get_running_loop().call_later(
+            self.settle_time, self._fire
+        )
+
+    def _fire(self):
+        self._settle_handle = None
+        self.request_check()
+
+    def _on_db_change(self, sync_changed: bool):
+        # Only installing packages can leave processes using deleted files
+        if not sync_changed:
+            self.process_scanner.invalidate()
+            self.request_check()
+
+    def _watch(self):
+        self._inotify.start()
+        self._inotify.add_watch(
+            MODULES_PATH, IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+        )
+        for paths in MICROCODE_PATHS.values():
+            for path in paths:
+                # Images are watched through their directory, as they are
+                # replaced rather than modified
+                directory = path if path.suffix != ".img" else path.parent
+                try:
+                    self._inotify.add_watch(
+                        directory,
+                        IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE | IN_CREATE,
+                    )
+                except FileNotFoundError:
+                    pass
+
+    def _write_status(self):
+        messages = []
+        if self._kernel is not None:
+            messages.append(
+                f"New kernel version:\n{self._kernel.new}\n"
+                f"Current kernel version:\n{self._kernel.current}"
+            )
+        if self._microcode is not None:
+            messages.append(
+                f"New microcode version:\n{self._microcode.new}\n"
+                f"Current microcode version:\n{self._microcode.current}"
+            )
+        if messages:
+            tooltip = "A reboot is needed\n\n" + "\n".join(messages)
+            tooltip += self._format_stale_processes()
+            self.write_json("", tooltip, "warning")
+        elif self._stale_processes:
+            tooltip = "Some programs need a restart" + \
+                self._format_stale_processes()
+            self.write_json("", tooltip, "restart")
+        else:
+            self.write_json("", "", "")
+
+    def _format_stale_processes(self) -> str:
+        if not self._stale_processes:
+            return ""
+        # Services are restarted as a whole, other processes by name
+        services = sorted({
+            process.service
+            for process in self._stale_processes
+            if process.service is not None
+        })
+        programs: dict[str, int] = {}
+        for process in self._stale_processes:
+            if process.service is None:
+                programs[process.name] = programs.get(process.name, 0) + 1
+        lines = ["", "", "Using outdated files:"]
+        for name, count in sorted(programs.items()):
+            lines.append(name if count == 1 else f"{name} ({count})")
+        if services:
+            lines += ["", "Services to restart:"] + services
+        return "\n".join(lines)
+
+    async def _check_versions(self):
+        """Check whether a reboot is needed"""
+        # Reading the kernel and microcode images is blocking file IO
+        self._kernel = await self.run_in_thread("kernel", check_kernel)
+        self._microcode = await self.run_in_thread(
+            "microcode", check_microcode
+        )
+        if self._kernel is not None or self._microcode is not None:
+            self.log("Reboot needed")
+
+    async def _scan_processes(self):
+        self._stale_processes = await self.run_in_thread(
+            "process_scan", self.process_scanner.scan
+        )
+
+    async def _wait_for_request(self) -> bool:
+        """
+        Wait for the next check, which is either requested or a periodic
+        process scan. Returns whether the versions should be checked too.
+        """
+        try:
+            await asyncio.wait_for(
+                self.check_event.wait(),
+                timeout=self.process_scan_intervals[self.power_profile],
+            )
+        except asyncio.TimeoutError:
+            return False
+        self.check_event.clear()
+        return True
+
+    async def run(self):
+        """Main loop"""
+        try:
+            self.log("Starting reboot monitor")
+            try:
+                self._watch()
+            except OSError as e:
+                self.log(f"Not watching kernel and microcode changes: {e}")
+
+            # Upgrades of any package can leave processes using deleted files
+            try:
+                self.db_watcher = PacmanDbWatcher(
+                    PacmanConfig.load().db_path, self._on_db_change
+                )
+                self.db_watcher.start()
+            except OSError as e:
+                self.log(f"Not watching the pacman database: {e}")
+
+            check_versions = True
+            while True:
+                try:
+                    with self.metrics.timed("cycle_duration_seconds"):
+                        if check_versions:
+                            with self.metrics.timed(
+                                "stage_duration_seconds", stage="versions"
+                            ):
+                                await self._check_versions()
+                        with self.metrics.timed(
+                            "stage_duration_seconds", stage="processes"
+                        ):
+                            await self._scan_processes()
+                except Exception as e:
+                    self.log(f"Error checking whether a reboot is needed: {e}")
+                    self.write_json(
+                        "ERROR",
+                        f"need reboot has encountered an error:\n{e}",
+                        "critical",
+                    )
+                else:
+                    self._write_status()
+                check_versions = await self._wait_for_request()
+        finally:
+            if self._settle_handle is not None:
+                self._settle_handle.cancel()
+                self._settle_handle = None
+            self._inotify.close()
+            if self.db_watcher is not None:
+                self.db_watcher.close()
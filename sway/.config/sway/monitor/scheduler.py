@@ -0,0 +1,112 @@
+"""
+Adaptive scheduling of periodic checks. The interval backs off exponentially
+while the observed state stays the same and healthy, drops to a short burst of
+fast re-checks as soon as the state degrades, and can be cut short at any time
+by an external trigger.
+
+While backed off, an optional cheap keepalive (such as a single ping) runs
+every keepalive interval, and a failing keepalive starts the full check right
+away. So a change is noticed within the keepalive interval (plus the
+keepalive's own timeout) however long the backoff is, and while unhealthy the
+checks never back off past the minimum interval.
+"""
+
+
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Hashable, Optional
+
+
+@dataclass
+class ScheduleConfig:
+    # Interval after a state change, and the start of the backoff
+    min_interval: float = 10
+    # Upper bound of the backoff while the state is stable
+    max_interval: float = 120
+    backoff_factor: float = 2
+    # Fast re-checks done after the state degrades
+    burst_interval: float = 2
+    burst_count: int = 3
+    # Interval of the keepalive between checks, if the caller has one
+    keepalive_interval: float = 10
+
+
+class AdaptiveScheduler:
+    def __init__(self, config: Optional[ScheduleConfig] = None):
+        self.config = config or ScheduleConfig()
+        self.interval = self.config.min_interval
+        self._last_state: Optional[Hashable] = None
+        self._burst_left = 0
+        self._trigger = asyncio.Event()
+
+    def trigger(self):
+        """
+        Request a check as soon as possible. Multiple triggers before the
+        check starts are collapsed into one.
+        """
+        self._trigger.set()
+
+    def set_config(self, config: ScheduleConfig):
+        """Switch to a different configuration, e.g. for a power profile"""
+        self.config = config
+        self.interval = min(self.interval, config.max_interval)
+
+    def start_burst(self):
+        """Check right away, followed by a burst of fast re-checks"""
+        self._burst_left = self.config.burst_count
+        self.trigger()
+
+    def record(self, state: Hashable, healthy: bool):
+        """
+        Update the next interval using the result of the latest check.
+        """
+        changed = state != self._last_state
+        self._last_state = state
+        config = self.config
+
+        if changed and not healthy:
+            self._burst_left = config.burst_count
+
+        if self._burst_left > 0:
+            self._burst_left -= 1
+            self.interval = config.burst_interval
+        elif changed or not healthy or self.interval < config.min_interval:
+            # Recovering is noticed as quickly as a failure
+            self.interval = config.min_interval
+        else:
+            self.interval = min(
+                self.interval * config.backoff_factor, config.max_interval
+            )
+
+    async def _wait_trigger(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._trigger.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def wait(
+        self, keepalive: Optional[Callable[[], Awaitable[bool]]] = None
+    ) -> bool:
+        """
+        Sleep until the next check is due, running the keepalive every
+        keepalive interval meanwhile. Returns True if woken up early by a
+        trigger or a failed keepalive.
+        """
+        loop = asyncio.get_running_loop()
+        due = loop.time() + self.interval
+        triggered = False
+        while not triggered:
+            remaining = due - loop.time()
+            if remaining <= 0:
+                break
+            if keepalive is None:
+                step = remaining
+            else:
+                step = min(remaining, self.config.keepalive_interval)
+            triggered = await self._wait_trigger(step)
+            if triggered or keepalive is None or loop.time() >= due:
+                continue
+            triggered = not await keepalive()
+        self._trigger.clear()
+        return triggered
@@ -0,0 +1,137 @@
+"""
+Rolling RTT, jitter and loss statistics of probe targets. Samples are stored in
+a fixed-size array-backed ring buffer, so recording a sample is O(1) and memory
+is bounded no matter how long the daemon runs. Summaries are computed on demand
+over a configurable window of the most recent samples.
+"""
+
+
+import math
+from array import array
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class LatencyThresholds:
+    """Above these the connection is considered degraded (seconds)"""
+    rtt: float = 0.25
+    jitter: float = 0.1
+
+
+def _format_ms(seconds: float) -> str:
+    ms = seconds * 1000
+    return f"{ms:.1f}" if ms < 10 else f"{ms:.0f}"
+
+
+@dataclass
+class RttSummary:
+    samples: int
+    received: int
+    # RTT fields are in seconds, NaN if nothing was received
+    min: float
+    avg: float
+    p50: float
+    p95: float
+    max: float
+    jitter: float
+
+    @property
+    def loss(self) -> float:
+        return 1 - self.received / self.samples
+
+    def as_dict(self) -> dict:
+        """JSON friendly version, in milliseconds and with NaN as None"""
+        result = {"samples": self.samples, "loss": self.loss}
+        for name in ["min", "avg", "p50", "p95", "max", "jitter"]:
+            value = getattr(self, name)
+            result[f"{name}_ms"] = None if math.isnan(value) else value * 1000
+        return result
+
+    def exceeds(self, thresholds: LatencyThresholds) -> bool:
+        if self.received == 0:
+            return False
+        return self.avg > thresholds.rtt or self.jitter > thresholds.jitter
+
+    def __str__(self):
+        loss = f"loss {self.loss:.0%} of {self.samples}"
+        if self.received == 0:
+            return loss
+        return (
+            f"{_format_ms(self.min)}/{_format_ms(self.avg)}/"
+            f"{_format_ms(self.max)} ms, "
+            f"p50 {_format_ms(self.p50)} p95 {_format_ms(self.p95)}, "
+            f"jitter {_format_ms(self.jitter)} ms, {loss}"
+        )
+
+
+def _percentile(sorted_rtts: list[float], fraction: float) -> float:
+    """Nearest-rank percentile"""
+    rank = max(math.ceil(fraction * len(sorted_rtts)), 1)
+    return sorted_rtts[rank - 1]
+
+
+class RttStats:
+    """
+    Ring buffer of the latest probe results of a single target. Lost probes are
+    stored as NaN.
+    """
+
+    def __init__(self, capacity: int = 256):
+        self.capacity = capacity
+        self._samples = array("d", [math.nan]) * capacity
+        self._next = 0
+        self._count = 0
+        # Totals since the daemon started
+        self.sent = 0
+        self.lost = 0
+
+    def add(self, rtt: Optional[float]):
+        """Record the RTT of a probe in seconds, or None if it was lost"""
+        self._samples[self._next] = math.nan if rtt is None else rtt
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+        self.sent += 1
+        if rtt is None:
+            self.lost += 1
+
+    def _recent(self, window: int) -> array:
+        """The latest `window` samples, oldest first"""
+        count = min(window, self._count)
+        start = (self._next - count) % self.capacity
+        end = start + count
+        if end <= self.capacity:
+            return self._samples[start:end]
+        return self._samples[start:] + self._samples[:end - self.capacity]
+
+    def summary(self, window: int) -> Optional[RttSummary]:
+        """Statistics over the latest `window` samples"""
+        samples = self._recent(window)
+        if not samples:
+            return None
+
+        # NaN never equals itself
+        rtts = [rtt for rtt in samples if rtt == rtt]
+        if not rtts:
+            nan = math.nan
+            return RttSummary(len(samples), 0, nan, nan, nan, nan, nan, nan)
+
+        # Mean deviation between consecutive replies
+        jitter = 0.0
+        if len(rtts) > 1:
+            jitter = sum(
+                abs(current - previous)
+                for previous, current in zip(rtts, rtts[1:])
+            ) / (len(rtts) - 1)
+
+        sorted_rtts = sorted(rtts)
+        return RttSummary(
+            samples=len(samples),
+            received=len(rtts),
+            min=sorted_rtts[0],
+            avg=sum(rtts) / len(rtts),
+            p50=_percentile(sorted_rtts, 0.5),
+            p95=_percentile(sorted_rtts, 0.95),
+            max=sorted_rtts[-1],
+            jitter=jitter,
+        )
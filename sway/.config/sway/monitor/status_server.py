@@ -0,0 +1,83 @@
+"""
+Local streaming socket which pushes monitor status to subscribed clients (such
+as waybar modules) as newline-delimited JSON. A client connects, sends the
+names of the channels it wants separated by spaces followed by a newline, and
+then receives the latest status of each channel followed by every change.
+"""
+
+
+import asyncio
+import os
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+
+# Clients that don't read their updates are disconnected after this much data
+# is buffered for them
+MAX_CLIENT_BUFFER = 64 * 1024
+
+
+def default_socket_path() -> Path:
+    return Path(os.environ["XDG_RUNTIME_DIR"]) / "sway-monitor.sock"
+
+
+class StatusServer:
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or default_socket_path()
+        self._latest: dict[str, bytes] = {}
+        self._subscribers: defaultdict[str, set[asyncio.StreamWriter]] = \
+            defaultdict(set)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        # A leftover socket of a previous run would make the bind fail
+        self.path.unlink(missing_ok=True)
+        self._server = await asyncio.start_unix_server(
+            self._handle_client, path=self.path
+        )
+
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for subscribers in self._subscribers.values():
+            for writer in subscribers:
+                writer.close()
+        self._subscribers.clear()
+        await self._server.wait_closed()
+        self._server = None
+        self.path.unlink(missing_ok=True)
+
+    def publish(self, channel: str, payload: bytes):
+        """Push a serialized status line to every subscriber of the channel"""
+        self._latest[channel] = payload
+        subscribers = self._subscribers[channel]
+        for writer in list(subscribers):
+            if writer.is_closing():
+                subscribers.discard(writer)
+                continue
+            writer.write(payload)
+            if writer.transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+                subscribers.discard(writer)
+                writer.close()
+
+    async def _handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        channels = []
+        try:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            channels = line.decode("utf-8", errors="ignore").split()
+            for channel in channels:
+                self._subscribers[channel].add(writer)
+                if channel in self._latest:
+                    writer.write(self._latest[channel])
+            # Nothing else is expected from the client, wait until it leaves
+            await reader.read()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            for channel in channels:
+                self._subscribers[channel].discard(writer)
+            writer.close()
@@ -0,0 +1,190 @@
+"""
+Runs every registered monitor as its own supervised task. A monitor whose
+`run()` fails is restarted with a jittered exponential backoff while the others
+keep running, and its health is published on its channel in the meantime.
+
+Monitors register themselves with the `register` decorator, declaring the
+monitors they depend on, which are created first and passed to the factory:
+
+    @register("updates", depends_on=["internet"])
+    class UpdatesMonitor(BaseMonitor):
+        def __init__(self, internet_monitor: InternetMonitor):
+"""
+
+
+import asyncio
+import random
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable, Iterable, Optional
+
+from .base_monitor import BaseMonitor
+from .metrics import Metrics
+
+
+class MonitorHealth(Enum):
+    STARTING = "starting"
+    RUNNING = "running"
+    BACKOFF = "backoff"
+
+
+@dataclass
+class MonitorSpec:
+    name: str
+    factory: Callable[..., BaseMonitor]
+    depends_on: tuple[str, ...] = ()
+
+
+_registry: dict[str, MonitorSpec] = {}
+
+
+def register(name: str, depends_on: Iterable[str] = ()):
+    """Class decorator adding a monitor to the ones the daemon runs"""
+    def decorator(factory):
+        _registry[name] = MonitorSpec(name, factory, tuple(depends_on))
+        return factory
+    return decorator
+
+
+def registered_monitors() -> list[MonitorSpec]:
+    return list(_registry.values())
+
+
+def _dependency_order(specs: list[MonitorSpec]) -> list[MonitorSpec]:
+    """Sort the specs so every monitor comes after its dependencies"""
+    by_name = {spec.name: spec for spec in specs}
+    ordered: list[MonitorSpec] = []
+    done: set[str] = set()
+    visiting: set[str] = set()
+
+    def visit(spec: MonitorSpec):
+        if spec.name in done:
+            return
+        if spec.name in visiting:
+            raise ValueError(f"Dependency cycle involving monitor {spec.name}")
+        visiting.add(spec.name)
+        for dependency in spec.depends_on:
+            if dependency not in by_name:
+                raise ValueError(
+                    f"Monitor {spec.name} depends on unknown monitor "
+                    f"{dependency}"
+                )
+            visit(by_name[dependency])
+        visiting.remove(spec.name)
+        done.add(spec.name)
+        ordered.append(spec)
+
+    for spec in specs:
+        visit(spec)
+    return ordered
+
+
+@dataclass
+class RestartPolicy:
+    initial_delay: float = 1
+    max_delay: float = 300
+    backoff_factor: float = 2
+    # The delay is randomized by up to this fraction either way
+    jitter: float = 0.2
+    # A monitor which ran at least this long before failing is considered to
+    # have recovered, so the delay starts over (seconds)
+    stable_after: float = 600
+
+
+@dataclass
+class _Supervised:
+    spec: MonitorSpec
+    monitor: BaseMonitor
+    health: MonitorHealth = MonitorHealth.STARTING
+    restarts: int = 0
+    last_error: Optional[str] = None
+    # Delay before the next restart, before jitter
+    delay: float = 0
+
+
+class Supervisor:
+    def __init__(
+        self,
+        specs: Optional[list[MonitorSpec]] = None,
+        policy: Optional[RestartPolicy] = None,
+    ):
+        self.policy = policy or RestartPolicy()
+        self.metrics = Metrics()
+        self._supervised: dict[str, _Supervised] = {}
+        for spec in _dependency_order(specs or registered_monitors()):
+            dependencies = [
+                self._supervised[dependency].monitor
+                for dependency in spec.depends_on
+            ]
+            self._supervised[spec.name] = _Supervised(
+                spec=spec,
+                monitor=spec.factory(*dependencies),
+                delay=self.policy.initial_delay,
+            )
+
+    def log(self, *args, **kwargs):
+        print("Supervisor:", *args, **kwargs, flush=True)
+
+    @property
+    def monitors(self) -> dict[str, BaseMonitor]:
+        return {
+            name: supervised.monitor
+            for name, supervised in self._supervised.items()
+        }
+
+    def health(self) -> dict:
+        return {
+            name: {
+                "health": supervised.health.value,
+                "restarts": supervised.restarts,
+                "last_error": supervised.last_error,
+            }
+            for name, supervised in self._supervised.items()
+        }
+
+    async def run(self):
+        """Run all monitors until cancelled"""
+        await asyncio.gather(*(
+            self._supervise(supervised)
+            for supervised in self._supervised.values()
+        ))
+
+    async def _supervise(self, supervised: _Supervised):
+        loop = asyncio.get_running_loop()
+        policy = self.policy
+        name = supervised.spec.name
+        monitor = supervised.monitor
+
+        while True:
+            supervised.health = MonitorHealth.RUNNING
+            started = loop.time()
+            try:
+                await monitor.run()
+                error = "Monitor stopped unexpectedly"
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+
+            if loop.time() - started >= policy.stable_after:
+                supervised.delay = policy.initial_delay
+            delay = supervised.delay * random.uniform(
+                1 - policy.jitter, 1 + policy.jitter
+            )
+            supervised.delay = min(
+                supervised.delay * policy.backoff_factor, policy.max_delay
+            )
+            supervised.health = MonitorHealth.BACKOFF
+            supervised.restarts += 1
+            self.metrics.inc("restarts_total", monitor=name)
+            supervised.last_error = error
+
+            self.log(f"{name} failed, restarting in {delay:.1f}s: {error}")
+            try:
+                monitor.write_json(
+                    "!",
+                    f"The {name} monitor failed, restarting in "
+                    f"{delay:.0f}s (restart {supervised.restarts})\n{error}",
+                    "critical",
+                )
+            except Exception as e:
+                self.log(f"Failed to publish the health of {name}: {e}")
+            await asyncio.sleep(delay)
@@ -4,6 +4,9 @@
 # This script monitors the JSON file created by the updates monitor using
 # inotify and prints the content whenever it changes.
 #
+# Only needed when the monitor runs with --write-files, by default waybar gets
+# the status pushed through ~/.config/sway/monitor/client.py.
+#
 
 set updates_file "$XDG_RUNTIME_DIR/arch_updates_monitor.json"
 
@@ -20,12 +23,15 @@ end
 # Print initial content
 print_json_content
 
-# Monitor the file for changes using inotifywait
+# Monitor the directory for changes using inotifywait. The monitor replaces the
+# file atomically by renaming a temporary file over it, which would end a watch
+# on the file itself
 # -m: monitor continuously
-# -e modify: watch for file modifications
-# -e create: watch for file creation (in case it doesn't exist initially)
-# -e move: watch for file moves (atomic writes)
-# --format '': suppress default output format
-inotifywait -m -e modify -e create -e move --format '' "$updates_file" 2>/dev/null | while read
-    print_json_content
+# -e moved_to: watch for files renamed into the directory (atomic writes)
+# -e close_write: watch for files written in place
+# --format '%f': print the name of the changed file
+inotifywait -m -e moved_to -e close_write --format '%f' (path dirname $updates_file) 2>/dev/null | while read -l changed_file
+    if test "$changed_file" = (path basename $updates_file)
+        print_json_content
+    end
 end